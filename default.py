@@ -7,7 +7,7 @@ from os import path as os_path
 from sys import path as sys_path, argv
 from urlparse import parse_qsl
 
-from xbmc import translatePath, sleep, executebuiltin
+from xbmc import translatePath, executebuiltin
 from xbmcaddon import Addon
 from xbmcgui import ListItem
 from xbmcplugin import setResolvedUrl
@@ -32,10 +32,10 @@ sys_path.append(_base_resource)
 ###############################################################################
 
 import entrypoint
-from utils import window, pickl_window, reset, passwordsXML, language as lang,\
-    dialog
-from pickler import unpickle_me
-from PKC_listitem import convert_PKC_to_listitem
+from utils import window, reset, passwordsXML, language as lang, dialog, \
+    request_lib_scan
+from command_pipeline import send_command, PLAY_TIMEOUT
+from PKC_listitem import PKC_ListItem, convert_PKC_to_listitem
 import variables as v
 
 ###############################################################################
@@ -127,28 +127,28 @@ class Main():
                 log.error('Not connected to a PMS.')
             else:
                 if mode == 'repair':
-                    window('plex_runLibScan', value='repair')
+                    request_lib_scan('repair')
                     log.info('Requesting repair lib sync')
                 elif mode == 'manualsync':
                     log.info('Requesting full library scan')
-                    window('plex_runLibScan', value='full')
+                    request_lib_scan('full')
 
         elif mode == 'texturecache':
-            window('plex_runLibScan', value='del_textures')
+            request_lib_scan('del_textures')
 
         elif mode == 'chooseServer':
             entrypoint.chooseServer()
 
         elif mode == 'refreshplaylist':
             log.info('Requesting playlist/nodes refresh')
-            window('plex_runLibScan', value='views')
+            request_lib_scan('views')
 
         elif mode == 'deviceid':
             self.deviceid()
 
         elif mode == 'fanart':
             log.info('User requested fanarttv refresh')
-            window('plex_runLibScan', value='fanart')
+            request_lib_scan('fanart')
 
         elif '/extrafanart' in argv[0]:
             plexpath = argv[2][1:]
@@ -169,15 +169,8 @@ class Main():
         """
         Start up playback_starter in main Python thread
         """
-        # Put the request into the 'queue'
-        while window('plex_command'):
-            sleep(50)
-        window('plex_command',
-               value='play_%s' % argv[2])
-        # Wait for the result
-        while not pickl_window('plex_result'):
-            sleep(50)
-        result = unpickle_me()
+        # Hand the request to the PKC service and wait for the result
+        result = send_command('play', timeout=PLAY_TIMEOUT, params=argv[2])
         if result is None:
             log.error('Error encountered, aborting')
             dialog('notification',
@@ -186,8 +179,10 @@ class Main():
                    icon='{error}',
                    time=3000)
             setResolvedUrl(HANDLE, False, ListItem())
-        elif result.listitem:
-            listitem = convert_PKC_to_listitem(result.listitem)
+        elif result['listitem']:
+            listitem = PKC_ListItem()
+            listitem.data = result['listitem']
+            listitem = convert_PKC_to_listitem(listitem)
             setResolvedUrl(HANDLE, True, listitem)
 
     def deviceid(self):
@@ -41,6 +41,8 @@ from json import dumps
 from urllib import urlencode, quote_plus, unquote
 from os.path import basename, join
 from os import makedirs
+from functools import wraps
+from copy import deepcopy
 
 import xbmcgui
 from xbmc import sleep, executebuiltin
@@ -49,9 +51,10 @@ from xbmcvfs import exists
 import clientinfo as client
 from downloadutils import DownloadUtils
 from utils import window, settings, language as lang, tryDecode, tryEncode, \
-    DateToKodi, exists_dir
+    DateToKodi, exists_dir, wake_up_threads
 from PlexFunctions import PMSHttpsEnabled
 import plexdb_functions as plexdb
+from web_cache import get_json
 import variables as v
 import state
 
@@ -61,6 +64,30 @@ log = logging.getLogger("PLEX."+__name__)
 
 REGEX_IMDB = re_compile(r'''/(tt\d+)''')
 REGEX_TVDB = re_compile(r'''thetvdb:\/\/(.+?)\?''')
+
+###############################################################################
+
+
+def cached(func):
+    """
+    Decorator for API methods that only read the PMS xml. Remembers the result
+    per API instance (and per arguments), so that the xml of an item needs to
+    be parsed only once even if several methods need the same information.
+    Returns copies of lists and dicts - callers may change them
+    """
+    @wraps(func)
+    def wrapper(self, *args, **kwargs):
+        key = (func.__name__, args, tuple(sorted(kwargs.items())))
+        try:
+            result = self.cache[key]
+        except KeyError:
+            result = func(self, *args, **kwargs)
+            self.cache[key] = result
+        if isinstance(result, (list, dict)):
+            result = deepcopy(result)
+        return result
+    return wrapper
+
 ###############################################################################
 
 
@@ -1138,6 +1165,8 @@ class API():
         self.part = 0
         self.mediastream = None
         self.server = window('pms_server')
+        # Results of methods decorated with @cached
+        self.cache = {}
 
     def setPartNumber(self, number=None):
         """
@@ -1160,14 +1189,14 @@ class API():
 
     def getChecksum(self):
         """
-        Returns a string, not int. 
+        Returns the item's updatedAt as an int, 0 if not set
 
         WATCH OUT - time in Plex, not Kodi ;-)
         """
-        # Include a letter to prohibit saving as an int!
-        checksum = "K%s%s" % (self.getRatingKey(),
-                              self.item.attrib.get('updatedAt', ''))
-        return checksum
+        try:
+            return int(self.item.attrib['updatedAt'])
+        except (KeyError, ValueError):
+            return 0
 
     def getRatingKey(self):
         """
@@ -1248,6 +1277,7 @@ class API():
         """
         return self.item.attrib.get('index')
 
+    @cached
     def getDateCreated(self):
         """
         Returns the date when this library item was created.
@@ -1261,6 +1291,7 @@ class API():
             res = '2000-01-01 10:00:00'
         return res
 
+    @cached
     def getUserData(self):
         """
         Returns a dict with None if a value is missing
@@ -1320,6 +1351,7 @@ class API():
             'UserRating': userrating
         }
 
+    @cached
     def getCollections(self):
         """
         Returns a list of PMS collection tags or an empty list
@@ -1331,6 +1363,7 @@ class API():
                     collections.append(child.attrib['tag'])
         return collections
 
+    @cached
     def getSets(self):
         """
         Returns a list of PMS collection tags or an empty list
@@ -1343,6 +1376,7 @@ class API():
                         collections.append(child.attrib['tag'])
         return collections
 
+    @cached
     def getTags(self):
         """
         Returns a list of PMS collection tags or an empty list
@@ -1355,6 +1389,7 @@ class API():
                         collections.append(child.attrib['tag'])
         return collections
 
+    @cached
     def getPeople(self):
         """
         Returns a dict of lists of people found.
@@ -1385,6 +1420,7 @@ class API():
             'Producer': producer
         }
 
+    @cached
     def getPeopleList(self):
         """
         Returns a list of people from item, with a list item of the form
@@ -1426,6 +1462,7 @@ class API():
                     people[-1].update({'Role': Role})
         return people
 
+    @cached
     def getGenres(self):
         """
         Returns a list of genres found. (Not a string)
@@ -1544,6 +1581,7 @@ class API():
             mpaa = "Rated Not Rated"
         return mpaa
 
+    @cached
     def getCountry(self):
         """
         Returns a list of all countries found in item.
@@ -1563,6 +1601,7 @@ class API():
     def getMusicStudio(self):
         return self.item.attrib.get('studio', '')
 
+    @cached
     def getStudios(self):
         """
         Returns a list with a single entry for the studio, or an empty list
@@ -1708,6 +1747,7 @@ class API():
             answ['bitDepth'] = None
         return answ
 
+    @cached
     def getExtras(self):
         """
         Currently ONLY returns the very first trailer found!
@@ -1758,6 +1798,7 @@ class API():
             break
         return elements
 
+    @cached
     def getMediaStreams(self):
         """
         Returns the media streams for metadata purposes
@@ -1841,6 +1882,7 @@ class API():
             artwork = ""
         return artwork
 
+    @cached
     def getAllArtwork(self, parentInfo=False):
         """
         Gets the URLs to the Plex artwork, or empty string if not found.
@@ -1942,17 +1984,13 @@ class API():
         # if the title has the year in remove it as tmdb cannot deal with it...
         # replace e.g. 'The Americans (2015)' with 'The Americans'
         title = sub(r'\s*\(\d{4}\)$', '', title, count=1)
-        url = 'https://api.themoviedb.org/3/search/%s' % media_type
+        url = '%s/search/%s' % (v.TMDB_URL, media_type)
         parameters = {
             'api_key': apiKey,
             'language': v.KODILANGUAGE,
             'query': tryEncode(title)
         }
-        data = DownloadUtils().downloadUrl(
-            url,
-            authenticate=False,
-            parameters=parameters,
-            timeout=7)
+        data = get_json(url, parameters=parameters, timeout=7)
         try:
             data.get('test')
         except:
@@ -2034,16 +2072,12 @@ class API():
         for language in [v.KODILANGUAGE, "en"]:
             parameters['language'] = language
             if media_type == "movie":
-                url = 'https://api.themoviedb.org/3/movie/%s' % tmdbId
+                url = '%s/movie/%s' % (v.TMDB_URL, tmdbId)
                 parameters['append_to_response'] = 'videos'
             elif media_type == "tv":
-                url = 'https://api.themoviedb.org/3/tv/%s' % tmdbId
+                url = '%s/tv/%s' % (v.TMDB_URL, tmdbId)
                 parameters['append_to_response'] = 'external_ids,videos'
-            data = DownloadUtils().downloadUrl(
-                url,
-                authenticate=False,
-                parameters=parameters,
-                timeout=7)
+            data = get_json(url, parameters=parameters, timeout=7)
             try:
                 data.get('test')
             except:
@@ -2063,12 +2097,8 @@ class API():
                 mediaId = str(data.get("belongs_to_collection").get("id"))
                 log.debug('Retrieved collections tmdb id %s for %s'
                           % (mediaId, title))
-                url = 'https://api.themoviedb.org/3/collection/%s' % mediaId
-                data = DownloadUtils().downloadUrl(
-                    url,
-                    authenticate=False,
-                    parameters=parameters,
-                    timeout=7)
+                url = '%s/collection/%s' % (v.TMDB_URL, mediaId)
+                data = get_json(url, parameters=parameters, timeout=7)
                 try:
                     data.get('poster_path')
                 except AttributeError:
@@ -2095,18 +2125,13 @@ class API():
             typus = 'tv'
 
         if typus == "movie":
-            url = 'http://webservice.fanart.tv/v3/movies/%s?api_key=%s' \
-                % (mediaId, api_key)
+            url = '%s/movies/%s' % (v.FANARTTV_URL, mediaId)
         elif typus == 'tv':
-            url = 'http://webservice.fanart.tv/v3/tv/%s?api_key=%s' \
-                % (mediaId, api_key)
+            url = '%s/tv/%s' % (v.FANARTTV_URL, mediaId)
         else:
             # Not supported artwork
             return allartworks
-        data = DownloadUtils().downloadUrl(
-            url,
-            authenticate=False,
-            timeout=15)
+        data = get_json(url, parameters={'api_key': api_key}, timeout=15)
         try:
             data.get('test')
         except:
@@ -2630,6 +2655,7 @@ class API():
                 # Validate the path is correct with user intervention
                 if self.askToValidate(path):
                     state.STOP_SYNC = True
+                    wake_up_threads()
                     path = None
                 window('plex_pathverified', value='true')
             else:
@@ -4,7 +4,11 @@ from urllib import urlencode
 from ast import literal_eval
 from urlparse import urlparse, parse_qsl
 import re
-from copy import deepcopy
+from cStringIO import StringIO
+from collections import deque
+from threading import Thread
+from Queue import Queue, Empty
+import xml.etree.ElementTree as etree
 
 import downloadutils
 from utils import settings
@@ -15,6 +19,22 @@ from variables import PLEX_TO_KODI_TIMEFACTOR
 log = getLogger("PLEX."+__name__)
 
 CONTAINERSIZE = int(settings('limitindex'))
+# Max. number of chunks of CONTAINERSIZE that we download at once
+CHUNK_WINDOW = 4
+# Seconds we wait for one of these chunks before giving up on the rest
+CHUNK_TIMEOUT = 300
+# Arguments for all our requests of /library/metadata/<plex id>
+METADATA_ARGS = {
+    'checkFiles': 0,
+    'includeExtras': 1,         # Trailers and Extras => Extras
+    'includeReviews': 1,
+    'includeRelated': 0,        # Similar movies => Video -> Related
+    # 'includeRelatedCount': 0,
+    # 'includeOnDeck': 1,
+    # 'includeChapters': 1,
+    # 'includePopularLeaves': 1,
+    # 'includeConcerts': 1
+}
 
 ###############################################################################
 
@@ -117,18 +137,7 @@ def GetPlexMetadata(key):
         url = "{server}" + key
     else:
         url = "{server}/library/metadata/" + key
-    arguments = {
-        'checkFiles': 0,
-        'includeExtras': 1,         # Trailers and Extras => Extras
-        'includeReviews': 1,
-        'includeRelated': 0,        # Similar movies => Video -> Related
-        # 'includeRelatedCount': 0,
-        # 'includeOnDeck': 1,
-        # 'includeChapters': 1,
-        # 'includePopularLeaves': 1,
-        # 'includeConcerts': 1
-    }
-    url = url + '?' + urlencode(arguments)
+    url = url + '?' + urlencode(METADATA_ARGS)
     xml = downloadutils.DownloadUtils().downloadUrl(url)
     if xml == 401:
         # Either unauthorized (taken care of by doUtils) or PMS under strain
@@ -143,83 +152,329 @@ def GetPlexMetadata(key):
     return xml
 
 
-def GetAllPlexChildren(key):
+def GetMultiplePlexMetadata(keys):
+    """
+    Returns raw API metadata for several Plex ids (digits 'xxxx' only) with
+    one single PMS request.
+
+    Returns a dict {Plex id: etree XML}; every XML is set up like the one
+    from GetPlexMetadata, i.e. the item is XML[0]. Items the PMS did not
+    return are missing in the dict.
+
+    Returns None or 401 if something went wrong
+    """
+    url = "{server}/library/metadata/%s?%s" % (','.join(keys),
+                                                urlencode(METADATA_ARGS))
+    xml = downloadutils.DownloadUtils().downloadUrl(url)
+    if xml == 401:
+        # Either unauthorized (taken care of by doUtils) or PMS under strain
+        return 401
+    # Did we receive a valid XML?
+    try:
+        xml.attrib
+    # Nope we did not receive a valid XML
+    except AttributeError:
+        log.error("Error retrieving metadata for %s" % url)
+        return None
+    result = {}
+    for item in xml:
+        container = etree.Element(xml.tag, xml.attrib)
+        # Items might stem from different sections
+        for attrib in ('librarySectionID', 'librarySectionTitle'):
+            if attrib in item.attrib:
+                container.set(attrib, item.attrib[attrib])
+        container.append(item)
+        result[item.attrib.get('ratingKey')] = container
+    return result
+
+
+def GetPlexMetadataForItems(keys):
+    """
+    Returns raw API metadata for the list of Plex ids keys (digits 'xxxx'
+    only), using one single PMS request if possible. Items that the PMS did
+    not return are downloaded one by one.
+
+    Returns a dict {Plex id: etree XML} like GetMultiplePlexMetadata (ids we
+    could not get metadata for are missing) or 401
+    """
+    result = {}
+    if len(keys) > 1:
+        xmls = GetMultiplePlexMetadata(keys)
+        if xmls == 401:
+            return 401
+        elif xmls is not None:
+            result.update(xmls)
+    for key in keys:
+        if key in result:
+            continue
+        xml = GetPlexMetadata(key)
+        if xml == 401:
+            return 401
+        elif xml is not None:
+            result[key] = xml
+    return result
+
+
+def GetAllPlexChildren(key, stream=False, errors=None):
     """
     Returns a list (raw xml API dump) of all Plex children for the key.
     (e.g. /library/metadata/194853/children pointing to a season)
 
     Input:
         key             Key to a Plex item, e.g. 12345
+        stream          If True, returns the generator StreamChunks(url)
+        errors          Optional list, see DownloadChunks
     """
-    return DownloadChunks("{server}/library/metadata/%s/children?" % key)
+    url = "{server}/library/metadata/%s/children?" % key
+    if stream is True:
+        return StreamChunks(url, errors=errors)
+    return DownloadChunks(url, errors=errors)
 
 
-def GetPlexSectionResults(viewId, args=None):
+def GetPlexSectionResults(viewId, args=None, stream=False, updatedAt=None,
+                          errors=None):
     """
     Returns a list (XML API dump) of all Plex items in the Plex
     section with key = viewId.
 
     Input:
         args:       optional dict to be urlencoded
+        stream      If True, returns the generator StreamChunks(url)
+        updatedAt   Unix timestamp; only retrieves PMS items updated by the
+                    PMS since that point of time until now.
+        errors      Optional list, see DownloadChunks
+
+    Returns None if something went wrong
+    """
+    url = "{server}/library/sections/%s/all?" % viewId
+    if args:
+        url += urlencode(args) + '&'
+    if updatedAt:
+        url += 'updatedAt>=%s&' % updatedAt
+    if stream is True:
+        return StreamChunks(url, errors=errors)
+    return DownloadChunks(url, errors=errors)
+
+
+def GetPlexSectionSize(viewId, args=None):
+    """
+    Returns the number of Plex items (int) in the Plex section with key =
+    viewId without downloading them.
+
+    Input:
+        args:       optional dict to be urlencoded, e.g. {'type': 4}
 
     Returns None if something went wrong
     """
     url = "{server}/library/sections/%s/all?" % viewId
     if args:
         url += urlencode(args) + '&'
-    return DownloadChunks(url)
+    chunk = _download_chunk(url, 0, _parse_xml, size=0)
+    if chunk is None:
+        return None
+    return chunk[2]
 
 
-def DownloadChunks(url):
+def DownloadChunks(url, errors=None):
     """
     Downloads PMS url in chunks of CONTAINERSIZE.
 
     url MUST end with '?' (if no other url encoded args are present) or '&'
 
+    errors: Optional list; url will be appended for every chunk that could
+    not be downloaded - the answer is incomplete if errors grew
+
     Returns a stitched-together xml or None.
     """
     xml = None
-    pos = 0
     errorCounter = 0
-    while errorCounter < 10:
-        args = {
-            'X-Plex-Container-Size': CONTAINERSIZE,
-            'X-Plex-Container-Start': pos
-        }
-        xmlpart = downloadutils.DownloadUtils().downloadUrl(
-            url + urlencode(args))
+    for xmlpart in _download_chunks(url, _parse_xml):
         # If something went wrong - skip in the hope that it works next time
-        try:
-            xmlpart.attrib
-        except AttributeError:
-            log.error('Error while downloading chunks: %s'
-                      % (url + urlencode(args)))
-            pos += CONTAINERSIZE
+        if xmlpart is None:
             errorCounter += 1
+            if errors is not None:
+                errors.append(url)
             continue
-
         # Very first run: starting xml (to retain data in xml's root!)
         if xml is None:
-            xml = deepcopy(xmlpart)
-            if len(xmlpart) < CONTAINERSIZE:
-                break
-            else:
-                pos += CONTAINERSIZE
-                continue
+            xml = xmlpart
+            continue
         # Build answer xml - containing the entire library
         for child in xmlpart:
             xml.append(child)
-        # Done as soon as we don't receive a full complement of items
-        if len(xmlpart) < CONTAINERSIZE:
-            break
-        pos += CONTAINERSIZE
     if errorCounter == 10:
         log.error('Fatal error while downloading chunks for %s' % url)
         return None
     return xml
 
 
-def GetAllPlexLeaves(viewId, lastViewedAt=None, updatedAt=None):
+def StreamChunks(url, attributes=('ratingKey', 'updatedAt', 'title', 'type'),
+                 errors=None):
+    """
+    Generator: downloads PMS url in chunks of CONTAINERSIZE like
+    DownloadChunks, but only ever keeps a few chunks in memory.
+
+    url MUST end with '?' (if no other url encoded args are present) or '&'
+
+    Yields one dict {attribute: value} per child of the xml root (e.g. per
+    movie) with the given attributes only - if the PMS sent them. Chunks
+    that could not be downloaded are skipped and logged, and url is appended
+    to the optional list errors for every one of them.
+    """
+    errorCounter = 0
+    for items in _download_chunks(
+            url, lambda content: _parse_chunk(content, attributes)):
+        if items is None:
+            errorCounter += 1
+            if errors is not None:
+                errors.append(url)
+            continue
+        for item in items:
+            yield item
+    if errorCounter == 10:
+        log.error('Fatal error while downloading chunks for %s' % url)
+
+
+def _download_chunks(url, parse):
+    """
+    Generator downloading PMS url in chunks of CONTAINERSIZE. Yields the
+    parsed chunks in the right order, or None if a chunk could not be
+    downloaded. Gives up after 10 failed chunks.
+
+    The first chunk tells us the totalSize of the PMS container; we then
+    download up to CHUNK_WINDOW chunks at once.
+
+    parse(<xml string>) needs to return the tuple
+        (<parsed chunk>, <number of items>, <totalSize of the root or None>)
+    """
+    pos = 0
+    errorCounter = 0
+    total_size = None
+    # Download chunk(s) until we know how many items there are
+    while total_size is None:
+        chunk = _download_chunk(url, pos, parse)
+        pos += CONTAINERSIZE
+        if chunk is None:
+            yield None
+            errorCounter += 1
+            if errorCounter == 10:
+                return
+            continue
+        yield chunk[0]
+        # Done as soon as we don't receive a full complement of items
+        if chunk[1] < CONTAINERSIZE:
+            return
+        total_size = chunk[2]
+    # Download the remaining chunks concurrently, but keep at most
+    # CHUNK_WINDOW of them in memory or in flight
+    positions = deque(xrange(pos, total_size, CONTAINERSIZE))
+    done = Queue()
+    results = {}
+    running = 0
+    while positions or running or results:
+        while positions and running + len(results) < CHUNK_WINDOW:
+            thread = Thread(target=_download_chunk,
+                            args=(url, positions.popleft(), parse, done))
+            thread.setDaemon(True)
+            thread.start()
+            running += 1
+        try:
+            chunk_pos, chunk = done.get(timeout=CHUNK_TIMEOUT)
+        except Empty:
+            log.error('Timeout while downloading chunks for %s' % url)
+            yield None
+            return
+        running -= 1
+        results[chunk_pos] = chunk
+        # Yield in the right order
+        while pos in results:
+            chunk = results.pop(pos)
+            pos += CONTAINERSIZE
+            if chunk is None:
+                yield None
+                errorCounter += 1
+                if errorCounter == 10:
+                    return
+                continue
+            yield chunk[0]
+            if chunk[1] < CONTAINERSIZE:
+                return
+
+
+def _download_chunk(url, pos, parse, queue=None, size=CONTAINERSIZE):
+    """
+    Downloads and parses one chunk of size items of url starting at pos.
+    Returns parse(<xml string>) or None if something went wrong. Also puts
+    (pos, <return value>) into queue if one was passed - no matter what
+    """
+    args = {
+        'X-Plex-Container-Size': size,
+        'X-Plex-Container-Start': pos
+    }
+    chunk = None
+    try:
+        response = downloadutils.DownloadUtils().downloadUrl(
+            url + urlencode(args), return_response=True)
+        try:
+            chunk = parse(response.content)
+        except (AttributeError, SyntaxError):
+            # AttributeError: no response; SyntaxError: etree.ParseError
+            log.error('Error while downloading chunks: %s'
+                      % (url + urlencode(args)))
+    finally:
+        # _download_chunks waits for every chunk
+        if queue is not None:
+            queue.put((pos, chunk))
+    return chunk
+
+
+def _total_size(xml):
+    """
+    Returns the int totalSize of the PMS xml container or None
+    """
+    try:
+        return int(xml.attrib['totalSize'])
+    except (KeyError, ValueError):
+        return None
+
+
+def _parse_xml(content):
+    """
+    Parses one chunk for DownloadChunks
+    """
+    xml = etree.fromstring(content)
+    return xml, len(xml), _total_size(xml)
+
+
+def _parse_chunk(content, attributes):
+    """
+    Parses one chunk for StreamChunks: incrementally parses the xml string
+    content, creating a list of dicts with attributes for every child of the
+    xml root. Parsed elements are thrown away immediately
+    """
+    items = []
+    total_size = None
+    depth = 0
+    root = None
+    for event, elem in etree.iterparse(StringIO(content),
+                                       events=('start', 'end')):
+        if event == 'start':
+            if root is None:
+                root = elem
+                total_size = _total_size(root)
+            depth += 1
+            continue
+        depth -= 1
+        if depth == 1:
+            items.append(dict((attribute, elem.attrib[attribute])
+                              for attribute in attributes
+                              if attribute in elem.attrib))
+            root.clear()
+    return items, len(items), total_size
+
+
+def GetAllPlexLeaves(viewId, lastViewedAt=None, updatedAt=None,
+                     stream=False, errors=None):
     """
     Returns a list (raw XML API dump) of all Plex subitems for the key.
     (e.g. /library/sections/2/allLeaves pointing to all TV shows)
@@ -230,6 +485,8 @@ def GetAllPlexLeaves(viewId, lastViewedAt=None, updatedAt=None):
                             since that point of time until now.
         updatedAt           Unix timestamp; only retrieves PMS items updated
                             by the PMS since that point of time until now.
+        stream              If True, returns the generator StreamChunks(url)
+        errors              Optional list, see DownloadChunks
 
     If lastViewedAt and updatedAt=None, ALL PMS items are returned.
 
@@ -249,7 +506,9 @@ def GetAllPlexLeaves(viewId, lastViewedAt=None, updatedAt=None):
         url += '?' + '&'.join(args) + '&'
     else:
         url += '?'
-    return DownloadChunks(url)
+    if stream is True:
+        return StreamChunks(url, errors=errors)
+    return DownloadChunks(url, errors=errors)
 
 
 def GetPlexOnDeck(viewId):
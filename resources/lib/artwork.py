@@ -6,14 +6,16 @@ from json import dumps, loads
 import requests
 from shutil import rmtree
 from urllib import quote_plus, unquote
-from threading import Thread
-from Queue import Queue, Empty
+from threading import Thread, Condition, Lock
+from Queue import Empty
 
 from xbmc import executeJSONRPC, sleep, translatePath
-from xbmcvfs import exists
+from xbmcvfs import exists, delete
 
 from utils import window, settings, language as lang, kodiSQL, tryEncode, \
-    thread_methods, dialog, exists_dir, tryDecode
+    thread_methods, dialog, exists_dir, tryDecode, Worker_Queue, \
+    register_waiter
+import metrics
 
 # Disable annoying requests warnings
 import requests.packages.urllib3
@@ -24,7 +26,89 @@ log = logging.getLogger("PLEX."+__name__)
 
 ###############################################################################
 
-ARTWORK_QUEUE = Queue()
+ARTWORK_QUEUE = Worker_Queue()
+# utf-8 encoded urls that are in Kodi's texture cache or in ARTWORK_QUEUE -
+# no need to put them into ARTWORK_QUEUE (again). See queue_url()
+SEEN_URLS = set()
+SEEN_URLS_LOCK = Lock()
+SEEN_URLS_LOADED = False
+# utf-8 encoded urls whose textures need to be deleted from the texture cache,
+# see invalidate_texture(). Use SEEN_URLS_LOCK
+INVALIDATE_QUEUE = Worker_Queue()
+INVALIDATING = set()
+# urls that need to be cached again once they've been invalidated
+REQUEUE = set()
+INVALIDATION_THREAD = None
+# Max. number of textures deleted at once
+INVALIDATION_BATCH = 500
+
+
+def queue_url(url):
+    """
+    Puts url into ARTWORK_QUEUE unless Kodi already cached it or it's already
+    queued. Returns True if url was queued, False otherwise
+    """
+    global SEEN_URLS_LOADED
+    url = tryEncode(url)
+    with SEEN_URLS_LOCK:
+        if SEEN_URLS_LOADED is False:
+            # Load the texture DB's urls once
+            connection = kodiSQL('texture')
+            try:
+                for row in connection.execute('SELECT url FROM texture'):
+                    SEEN_URLS.add(tryEncode(row[0]))
+            finally:
+                connection.close()
+            SEEN_URLS_LOADED = True
+            log.debug('%s urls already in the texture cache'
+                      % len(SEEN_URLS))
+        if url in INVALIDATING:
+            # Cache it again as soon as the old texture is gone
+            REQUEUE.add(url)
+            return True
+        if url in SEEN_URLS:
+            return False
+        SEEN_URLS.add(url)
+    ARTWORK_QUEUE.put(double_urlencode(url))
+    return True
+
+
+def invalidate_texture(url):
+    """
+    Deletes url's texture from Kodi's texture cache - soon, in batches, by
+    the Texture_Invalidation_Thread. Returns immediately
+    """
+    global INVALIDATION_THREAD
+    url = tryEncode(url)
+    with SEEN_URLS_LOCK:
+        if url in INVALIDATING:
+            return
+        INVALIDATING.add(url)
+        if INVALIDATION_THREAD is None or not INVALIDATION_THREAD.is_alive():
+            INVALIDATION_THREAD = Texture_Invalidation_Thread()
+            INVALIDATION_THREAD.setDaemon(True)
+            INVALIDATION_THREAD.start()
+    INVALIDATE_QUEUE.put(url)
+
+
+def forget_urls(urls):
+    """
+    Call for urls that are no longer (or not yet) in Kodi's texture cache -
+    they will be queued again by queue_url()
+    """
+    with SEEN_URLS_LOCK:
+        for url in urls:
+            SEEN_URLS.discard(tryEncode(url))
+
+
+def reset_seen_urls():
+    """
+    Call after emptying the texture cache
+    """
+    global SEEN_URLS_LOADED
+    with SEEN_URLS_LOCK:
+        SEEN_URLS.clear()
+        SEEN_URLS_LOADED = False
 
 
 def setKodiWebServerDetails():
@@ -126,87 +210,288 @@ def double_urldecode(text):
     return unquote(unquote(text))
 
 
+class Adaptive_Limit(object):
+    """
+    Limits the number of concurrent requests to Kodi's webserver, adjusting
+    the limit AIMD-style (additive increase, multiplicative decrease): +1
+    after limit successful requests in a row, halved whenever Kodi is
+    overloaded.
+
+    Usage:
+        limit.acquire() / limit.release()   around every request
+        limit.success() or limit.overloaded()
+    """
+    def __init__(self, minimum, maximum, start):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = min(max(start, minimum), maximum)
+        # Number of requests currently running
+        self.active = 0
+        self.successes = 0
+        self.condition = Condition()
+        # Wake up acquire() if the waiting threads should stop
+        register_waiter(self)
+
+    def acquire(self, stopped):
+        """
+        Blocks until we may start another request. Returns False if
+        stopped() returned True in the meantime, True otherwise
+        """
+        with self.condition:
+            while self.active >= self.limit:
+                if stopped():
+                    return False
+                self.condition.wait()
+            self.active += 1
+        return True
+
+    def wake_up(self):
+        """
+        Wakes up the threads waiting in acquire(), see utils.wake_up_threads()
+        """
+        with self.condition:
+            self.condition.notify_all()
+
+    def release(self):
+        with self.condition:
+            self.active -= 1
+            self.condition.notify()
+
+    def success(self):
+        with self.condition:
+            self.successes += 1
+            if self.successes >= self.limit and self.limit < self.maximum:
+                self.limit += 1
+                self.successes = 0
+                log.debug('Increased texture cache concurrency to %s'
+                          % self.limit)
+                self.condition.notify()
+
+    def overloaded(self):
+        with self.condition:
+            self.successes = 0
+            if self.limit > self.minimum:
+                self.limit = max(self.limit // 2, self.minimum)
+                log.debug('Kodi webserver overloaded, decreased texture cache '
+                          'concurrency to %s' % self.limit)
+
+
 @thread_methods(add_stops=['STOP_SYNC'],
                 add_suspends=['SUSPEND_LIBRARY_THREAD', 'DB_SCAN'])
 class Image_Cache_Thread(Thread):
+    """
+    Triggers Kodi to download the urls in ARTWORK_QUEUE to its texture cache
+    by requesting them from Kodi's webserver. Runs a pool of up to
+    settings('imageCacheThreads') workers, see Adaptive_Limit
+    """
     xbmc_host = 'localhost'
     xbmc_port, xbmc_username, xbmc_password = setKodiWebServerDetails()
-    sleep_between = 50
     # Potentially issues with limited number of threads
     # Hence let Kodi wait till download is successful
     timeout = (35.1, 35.1)
+    # Log progress every x cached urls
+    progress_interval = 100
 
     def __init__(self):
         self.queue = ARTWORK_QUEUE
+        try:
+            self.max_workers = int(settings('imageCacheThreads'))
+        except ValueError:
+            self.max_workers = 6
+        self.limit = Adaptive_Limit(minimum=1,
+                                    maximum=self.max_workers,
+                                    start=2)
+        self.lock = Lock()
+        self.cached = 0
         Thread.__init__(self)
 
     def run(self):
+        log.info("---===### Starting Image_Cache_Thread with %s workers "
+                 "###===---" % self.max_workers)
+        metrics.gauge('queue.artwork', self.queue.qsize)
+        workers = []
+        for _ in range(self.max_workers - 1):
+            worker = Thread(target=self.work)
+            worker.setDaemon(True)
+            worker.start()
+            workers.append(worker)
+        # This thread is a worker as well
+        self.work()
+        for worker in workers:
+            worker.join()
+        metrics.gauge('queue.artwork')
+        log.info("---===### Stopped Image_Cache_Thread ###===---")
+
+    def work(self):
+        """
+        Caches urls until we need to stop. Uses its own keep-alive connection
+        """
         thread_stopped = self.thread_stopped
         thread_suspended = self.thread_suspended
         queue = self.queue
-        sleep_between = self.sleep_between
-        while not thread_stopped():
-            # In the event the server goes offline
-            while thread_suspended():
-                # Set in service.py
-                if thread_stopped():
-                    # Abort was requested while waiting. We should exit
-                    log.info("---===### Stopped Image_Cache_Thread ###===---")
-                    return
-                sleep(1000)
+        limit = self.limit
+        session = requests.Session()
+        session.auth = (self.xbmc_username, self.xbmc_password)
+        try:
+            while not thread_stopped():
+                # Wait for the next url
+                url = queue.get_or_stop(thread_stopped)
+                if url is None:
+                    break
+                try:
+                    # In the event the server goes offline
+                    while thread_suspended():
+                        # Set in service.py
+                        if thread_stopped():
+                            # Abort was requested while waiting. We should
+                            # exit
+                            return
+                        sleep(1000)
+                    if not limit.acquire(thread_stopped):
+                        break
+                    try:
+                        self.cache_url(session, url)
+                    finally:
+                        limit.release()
+                    self.cached_one(url)
+                finally:
+                    # Also for urls we did not cache, or queue.join() hangs
+                    queue.task_done()
+        finally:
+            session.close()
+
+    def cache_url(self, session, url):
+        thread_stopped = self.thread_stopped
+        sleeptime = 0
+        while True:
             try:
-                url = queue.get(block=False)
-            except Empty:
-                sleep(1000)
+                session.head(
+                    url="http://%s:%s/image/image://%s"
+                        % (self.xbmc_host, self.xbmc_port, url),
+                    timeout=self.timeout)
+            except requests.Timeout:
+                # We don't need the result, only trigger Kodi to start the
+                # download. All is well - but don't speed up
+                return
+            except requests.ConnectionError:
+                if thread_stopped():
+                    # Kodi terminated
+                    break
+                # Server thinks its a DOS attack, ('error 10053')
+                # Throttle all workers and wait before trying again
+                self.limit.overloaded()
+                if sleeptime > 5:
+                    log.error('Repeatedly got ConnectionError for url %s'
+                              % double_urldecode(url))
+                    # Try again next time
+                    forget_urls((double_urldecode(url), ))
+                    break
+                log.debug('Were trying too hard to download art, server '
+                          'over-loaded. Sleep %s seconds before trying '
+                          'again to download %s'
+                          % (2**sleeptime, double_urldecode(url)))
+                sleep((2**sleeptime)*1000)
+                sleeptime += 1
                 continue
-            sleeptime = 0
-            while True:
+            except Exception as e:
+                log.error('Unknown exception for url %s: %s'
+                          % (double_urldecode(url), e))
+                import traceback
+                log.error("Traceback:\n%s" % traceback.format_exc())
+                forget_urls((double_urldecode(url), ))
+                break
+            # We did not even get a timeout
+            break
+        if sleeptime == 0:
+            self.limit.success()
+
+    def cached_one(self, url):
+        log.debug('Cached art: %s' % double_urldecode(url))
+        metrics.count('artwork.cached')
+        with self.lock:
+            self.cached += 1
+            cached = self.cached
+        if cached % self.progress_interval == 0:
+            log.info('Texture cache: %s images cached, %s waiting, %s '
+                     'concurrent requests'
+                     % (cached, self.queue.qsize(), self.limit.limit))
+
+
+@thread_methods
+class Texture_Invalidation_Thread(Thread):
+    """
+    Deletes the textures in INVALIDATE_QUEUE from Kodi's texture cache, up to
+    INVALIDATION_BATCH at once using one texture DB connection. Started by
+    invalidate_texture()
+    """
+    def run(self):
+        log.debug('Texture invalidation thread started')
+        thread_stopped = self.thread_stopped
+        queue = INVALIDATE_QUEUE
+        while not thread_stopped():
+            url = queue.get_or_stop(thread_stopped)
+            if url is None:
+                break
+            urls = [url]
+            while len(urls) < INVALIDATION_BATCH:
                 try:
-                    requests.head(
-                        url="http://%s:%s/image/image://%s"
-                            % (self.xbmc_host, self.xbmc_port, url),
-                        auth=(self.xbmc_username, self.xbmc_password),
-                        timeout=self.timeout)
-                except requests.Timeout:
-                    # We don't need the result, only trigger Kodi to start the
-                    # download. All is well
+                    urls.append(queue.get(block=False))
+                except Empty:
                     break
-                except requests.ConnectionError:
-                    if thread_stopped():
-                        # Kodi terminated
-                        break
-                    # Server thinks its a DOS attack, ('error 10053')
-                    # Wait before trying again
-                    if sleeptime > 5:
-                        log.error('Repeatedly got ConnectionError for url %s'
-                                  % double_urldecode(url))
-                        break
-                    log.debug('Were trying too hard to download art, server '
-                              'over-loaded. Sleep %s seconds before trying '
-                              'again to download %s'
-                              % (2**sleeptime, double_urldecode(url)))
-                    sleep((2**sleeptime)*1000)
-                    sleeptime += 1
-                    continue
-                except Exception as e:
-                    log.error('Unknown exception for url %s: %s'
-                              % (double_urldecode(url), e))
-                    import traceback
-                    log.error("Traceback:\n%s" % traceback.format_exc())
-                    break
-                # We did not even get a timeout
+            self.invalidate(urls)
+        # Don't leave stale textures behind
+        urls = []
+        while True:
+            try:
+                urls.append(queue.get(block=False))
+            except Empty:
                 break
-            queue.task_done()
-            log.debug('Cached art: %s' % double_urldecode(url))
-            # Sleep for a bit to reduce CPU strain
-            sleep(sleep_between)
-        log.info("---===### Stopped Image_Cache_Thread ###===---")
+        if urls:
+            self.invalidate(urls)
+        log.debug('Texture invalidation thread stopped')
+
+    @staticmethod
+    def invalidate(urls):
+        try:
+            connection = kodiSQL('texture')
+            try:
+                cursor = connection.cursor()
+                query = 'SELECT cachedurl FROM texture WHERE url IN (%s)' \
+                    % ','.join('?' * len(urls))
+                cursor.execute(query, [tryDecode(url) for url in urls])
+                for row in cursor.fetchall():
+                    # Delete thumbnail as well as the entry
+                    path = translatePath("special://thumbnails/%s" % row[0])
+                    log.debug("Deleting cached thumbnail: %s" % path)
+                    if exists(path):
+                        delete(path)
+                query = 'DELETE FROM texture WHERE url IN (%s)' \
+                    % ','.join('?' * len(urls))
+                cursor.execute(query, [tryDecode(url) for url in urls])
+                connection.commit()
+            finally:
+                connection.close()
+        except Exception as e:
+            log.error('Could not delete %s cached textures: %s'
+                      % (len(urls), e))
+            import traceback
+            log.error("Traceback:\n%s" % traceback.format_exc())
+        with SEEN_URLS_LOCK:
+            requeue = []
+            for url in urls:
+                INVALIDATING.discard(url)
+                SEEN_URLS.discard(url)
+                if url in REQUEUE:
+                    REQUEUE.discard(url)
+                    requeue.append(url)
+            for url in urls:
+                INVALIDATE_QUEUE.task_done()
+        for url in requeue:
+            queue_url(url)
 
 
 class Artwork():
     enableTextureCache = settings('enableTextureCache') == "true"
-    if enableTextureCache:
-        queue = ARTWORK_QUEUE
 
     def fullTextureCacheSync(self):
         """
@@ -238,6 +523,7 @@ class Artwork():
                     cursor.execute("DELETE FROM %s" % tableName)
             connection.commit()
             connection.close()
+            reset_seen_urls()
 
         # Cache all entries in video DB
         connection = kodiSQL('video')
@@ -249,9 +535,10 @@ class Artwork():
         total = len(result)
         log.info("Image cache sync about to process %s video images" % total)
         connection.close()
-
+        queued = 0
         for url in result:
-            self.cacheTexture(url[0])
+            if self.cacheTexture(url[0]):
+                queued += 1
         # Cache all entries in music DB
         connection = kodiSQL('music')
         cursor = connection.cursor()
@@ -261,14 +548,26 @@ class Artwork():
         log.info("Image cache sync about to process %s music images" % total)
         connection.close()
         for url in result:
-            self.cacheTexture(url[0])
+            if self.cacheTexture(url[0]):
+                queued += 1
+        log.info('Image cache sync queued %s images, the others are already '
+                 'cached' % queued)
 
     def cacheTexture(self, url):
-        # Cache a single image url to the texture cache
+        """
+        Cache a single image url to the texture cache. Returns True if url
+        was queued, False if it's already cached or queued
+        """
         if url and self.enableTextureCache:
-            self.queue.put(double_urlencode(tryEncode(url)))
+            return queue_url(url)
+        return False
 
     def addArtwork(self, artwork, kodiId, mediaType, cursor):
+        """
+        Brings the Kodi art table in line with the dict artwork for kodiId of
+        mediaType with as few queries as possible: one to look up the
+        existing art, then only the necessary inserts, updates and deletes
+        """
         # Kodi conversion table
         kodiart = {
             'Primary': ["thumb", "poster"],
@@ -280,109 +579,126 @@ class Artwork():
             'Backdrop': "fanart",
             'BoxRear': "poster"
         }
-
+        # {Kodi art type: url}
+        new_art = {}
         # Artwork is a dictionary
         for art in artwork:
             if art == "Backdrop":
                 # Backdrop entry is a list
                 # Process extra fanart for artwork downloader (fanart, fanart1,
                 # fanart2...)
-                backdrops = artwork[art]
-                backdropsNumber = len(backdrops)
-
-                query = ' '.join((
-                    "SELECT url",
-                    "FROM art",
-                    "WHERE media_id = ?",
-                    "AND media_type = ?",
-                    "AND type LIKE ?"
-                ))
-                cursor.execute(query, (kodiId, mediaType, "fanart%",))
-                rows = cursor.fetchall()
-
-                if len(rows) > backdropsNumber:
-                    # More backdrops in database. Delete extra fanart.
-                    query = ' '.join((
-                        "DELETE FROM art",
-                        "WHERE media_id = ?",
-                        "AND media_type = ?",
-                        "AND type LIKE ?"
-                    ))
-                    cursor.execute(query, (kodiId, mediaType, "fanart_",))
-
-                # Process backdrops and extra fanart
-                index = ""
-                for backdrop in backdrops:
-                    self.addOrUpdateArt(
-                        imageUrl=backdrop,
-                        kodiId=kodiId,
-                        mediaType=mediaType,
-                        imageType="%s%s" % ("fanart", index),
-                        cursor=cursor)
-
-                    if backdropsNumber > 1:
-                        try:  # Will only fail on the first try, str to int.
-                            index += 1
-                        except TypeError:
-                            index = 1
-
+                for index, backdrop in enumerate(artwork[art]):
+                    new_art['fanart%s' % (index or '')] = backdrop
             elif art == "Primary":
                 # Primary art is processed as thumb and poster for Kodi.
                 for artType in kodiart[art]:
-                    self.addOrUpdateArt(
-                        imageUrl=artwork[art],
-                        kodiId=kodiId,
-                        mediaType=mediaType,
-                        imageType=artType,
-                        cursor=cursor)
-
+                    new_art[artType] = artwork[art]
             elif kodiart.get(art):
                 # Process the rest artwork type that Kodi can use
-                self.addOrUpdateArt(
-                    imageUrl=artwork[art],
-                    kodiId=kodiId,
-                    mediaType=mediaType,
-                    imageType=kodiart[art],
-                    cursor=cursor)
-
-    def addOrUpdateArt(self, imageUrl, kodiId, mediaType, imageType, cursor):
-        if not imageUrl:
-            # Possible that the imageurl is an empty string
-            return
-
+                new_art[kodiart[art]] = artwork[art]
         query = ' '.join((
-            "SELECT url",
+            "SELECT type, url",
             "FROM art",
             "WHERE media_id = ?",
-            "AND media_type = ?",
-            "AND type = ?"
+            "AND media_type = ?"
         ))
-        cursor.execute(query, (kodiId, mediaType, imageType,))
-        try:
-            # Update the artwork
-            url = cursor.fetchone()[0]
-        except TypeError:
-            # Add the artwork
-            log.debug("Adding Art Link for kodiId: %s (%s)"
-                      % (kodiId, imageUrl))
+        cursor.execute(query, (kodiId, mediaType,))
+        old_art = dict(((kodiId, mediaType, row[0]), row[1])
+                       for row in cursor.fetchall())
+        self._reconcileArt(
+            [(kodiId, mediaType, artType, url)
+             for artType, url in new_art.iteritems()],
+            old_art,
+            cursor)
+        if "Backdrop" in artwork:
+            # More backdrops in database. Delete extra fanart.
+            delete = [(kodiId, mediaType, artType)
+                      for (_, _, artType) in old_art
+                      if (artType.startswith('fanart') and
+                          artType[6:].isdigit() and
+                          not new_art.get(artType))]
+            if delete:
+                query = ' '.join((
+                    "DELETE FROM art",
+                    "WHERE media_id = ?",
+                    "AND media_type = ?",
+                    "AND type = ?"
+                ))
+                cursor.executemany(query, delete)
+
+    def addPeopleArt(self, people, cursor):
+        """
+        Adds or updates the thumbs of several people at once. people is a
+        list of tuples (kodi_id, media_type, url), e.g. media_type 'actor'
+        """
+        # Last entry wins
+        thumbs = dict(((kodi_id, media_type, "thumb"), url)
+                      for kodi_id, media_type, url in people if url)
+        old_art = {}
+        by_media_type = {}
+        for (kodi_id, media_type, _) in thumbs:
+            by_media_type.setdefault(media_type, []).append(kodi_id)
+        for media_type, kodi_ids in by_media_type.iteritems():
+            # Stay well below SQLite's limit of 999 parameters
+            for pos in xrange(0, len(kodi_ids), 500):
+                chunk = kodi_ids[pos:pos + 500]
+                query = ' '.join((
+                    "SELECT media_id, url",
+                    "FROM art",
+                    "WHERE media_type = ?",
+                    "AND type = ?",
+                    "AND media_id IN (%s)" % ','.join('?' * len(chunk))
+                ))
+                cursor.execute(query, [media_type, "thumb"] + chunk)
+                for row in cursor.fetchall():
+                    old_art[(row[0], media_type, "thumb")] = row[1]
+        self._reconcileArt([key + (url, ) for key, url in thumbs.iteritems()],
+                           old_art,
+                           cursor)
+
+    def _reconcileArt(self, new_art, old_art, cursor):
+        """
+        new_art: list of (media_id, media_type, type, url) that should be in
+                 the art table
+        old_art: {(media_id, media_type, type): url} currently in the table
+
+        Inserts or updates new_art with executemany and caches changed art
+        """
+        inserts = []
+        updates = []
+        for media_id, media_type, imageType, imageUrl in new_art:
+            if not imageUrl:
+                # Possible that the imageurl is an empty string
+                continue
+            url = old_art.get((media_id, media_type, imageType))
+            if url is None:
+                log.debug("Adding Art Link for kodiId: %s (%s)"
+                          % (media_id, imageUrl))
+                inserts.append((media_id, media_type, imageType, imageUrl))
+            elif url == imageUrl:
+                # Only cache artwork if it changed
+                continue
+            else:
+                # Only for the main backdrop, poster
+                if (window('plex_initialScan') != "true" and
+                        imageType in ("fanart", "poster")):
+                    # Delete current entry before updating with the new one
+                    self.deleteCachedArtwork(url)
+                log.debug("Updating Art url for %s kodiId %s %s -> (%s)"
+                          % (imageType, media_id, url, imageUrl))
+                updates.append((imageUrl, media_id, media_type, imageType))
+            # Cache fanart and poster in Kodi texture cache
+            if media_type != 'actor':
+                self.cacheTexture(imageUrl)
+        if inserts:
             query = (
                 '''
                 INSERT INTO art(media_id, media_type, type, url)
                 VALUES (?, ?, ?, ?)
                 '''
             )
-            cursor.execute(query, (kodiId, mediaType, imageType, imageUrl))
-        else:
-            if url == imageUrl:
-                # Only cache artwork if it changed
-                return
-            # Only for the main backdrop, poster
-            if (window('plex_initialScan') != "true" and
-                    imageType in ("fanart", "poster")):
-                # Delete current entry before updating with the new one
-                self.deleteCachedArtwork(url)
-            log.debug("Updating Art url for %s kodiId %s %s -> (%s)"
-                      % (imageType, kodiId, url, imageUrl))
+            cursor.executemany(query, inserts)
+        if updates:
             query = ' '.join((
                 "UPDATE art",
                 "SET url = ?",
@@ -390,11 +706,26 @@ class Artwork():
                 "AND media_type = ?",
                 "AND type = ?"
             ))
-            cursor.execute(query, (imageUrl, kodiId, mediaType, imageType))
+            cursor.executemany(query, updates)
 
-        # Cache fanart and poster in Kodi texture cache
-        if mediaType != 'actor':
-            self.cacheTexture(imageUrl)
+    def addOrUpdateArt(self, imageUrl, kodiId, mediaType, imageType, cursor):
+        if not imageUrl:
+            # Possible that the imageurl is an empty string
+            return
+
+        query = ' '.join((
+            "SELECT url",
+            "FROM art",
+            "WHERE media_id = ?",
+            "AND media_type = ?",
+            "AND type = ?"
+        ))
+        cursor.execute(query, (kodiId, mediaType, imageType,))
+        old_art = dict(((kodiId, mediaType, imageType), row[0])
+                       for row in cursor.fetchall())
+        self._reconcileArt([(kodiId, mediaType, imageType, imageUrl)],
+                           old_art,
+                           cursor)
 
     def deleteArtwork(self, kodiId, mediaType, cursor):
         query = ' '.join((
@@ -410,21 +741,4 @@ class Artwork():
 
     def deleteCachedArtwork(self, url):
         # Only necessary to remove and apply a new backdrop or poster
-        connection = kodiSQL('texture')
-        cursor = connection.cursor()
-        try:
-            cursor.execute("SELECT cachedurl FROM texture WHERE url = ?",
-                           (url,))
-            cachedurl = cursor.fetchone()[0]
-        except TypeError:
-            log.info("Could not find cached url.")
-        else:
-            # Delete thumbnail as well as the entry
-            path = translatePath("special://thumbnails/%s" % cachedurl)
-            log.debug("Deleting cached thumbnail: %s" % path)
-            if exists(path):
-                rmtree(tryDecode(path), ignore_errors=True)
-            cursor.execute("DELETE FROM texture WHERE url = ?", (url,))
-            connection.commit()
-        finally:
-            connection.close()
+        invalidate_texture(url)
@@ -1,73 +1,304 @@
 # -*- coding: utf-8 -*-
+"""
+Channel for commands from other PKC Python instances (e.g. default.py) to the
+PKC service: a loopback TCP socket owned by the service. Both requests and
+responses are JSON objects, framed by their length as 4 byte unsigned int
+(network byte order). Every request carries an 'id' that is passed back with
+its response - a connection may send several requests without waiting.
+Requests need to carry window('plex_command_token') to be accepted.
+"""
 ###############################################################################
 import logging
-from threading import Thread
+import socket
+from threading import Thread, Lock
 from Queue import Queue
+from json import dumps, loads
+from struct import pack, unpack
+from os import urandom
 
-from xbmc import sleep
-
-from utils import window, thread_methods
+from utils import window, thread_methods, wake_up_threads
 import state
 
 ###############################################################################
 log = logging.getLogger("PLEX."+__name__)
 
+# Refuse frames bigger than this many bytes
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+# Seconds to wait for the service to answer a command (None: forever)
+COMMAND_TIMEOUT = 10
+# Seconds to wait for playback to be set up - the user might need to pick a
+# media version or whether to resume
+PLAY_TIMEOUT = 5*60
+
 ###############################################################################
 
 
-@thread_methods
-class Monitor_Window(Thread):
+def send_frame(sock, obj):
+    """
+    Sends obj as JSON frame through the socket sock
+    """
+    data = dumps(obj)
+    sock.sendall(pack('!I', len(data)) + data)
+
+
+def _recv_exactly(sock, length):
+    """
+    Returns length bytes from the socket sock or None if the connection was
+    closed before
     """
-    Monitors window('plex_command') for new entries that we need to take care
-    of, e.g. for new plays initiated on the Kodi side with addon paths.
+    chunks = []
+    while length > 0:
+        chunk = sock.recv(min(length, 65536))
+        if not chunk:
+            return
+        chunks.append(chunk)
+        length -= len(chunk)
+    return ''.join(chunks)
 
-    Possible values of window('plex_command'):
-        'play_....': to start playback using playback_starter
 
-    Adjusts state.py accordingly
+def recv_frame(sock):
+    """
+    Returns the next JSON frame received through the socket sock, or None if
+    the connection was closed
+    """
+    header = _recv_exactly(sock, 4)
+    if header is None:
+        return
+    length = unpack('!I', header)[0]
+    if length > MAX_FRAME_SIZE:
+        raise ValueError('Frame too big: %s bytes' % length)
+    data = _recv_exactly(sock, length)
+    if data is None:
+        return
+    return loads(data)
+
+
+def send_command(command, timeout=COMMAND_TIMEOUT, **kwargs):
+    """
+    Sends command (with arguments kwargs) to the PKC service and waits for
+    its result. Returns the result or None if something went wrong, e.g. if
+    the service is not running
+    """
+    port = window('plex_command_port')
+    if not port:
+        log.error('PKC service not running, cannot send command %s'
+                  % command)
+        return
+    request = dict(kwargs)
+    request['id'] = 1
+    request['command'] = command
+    request['token'] = window('plex_command_token')
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(timeout)
+        sock.connect(('127.0.0.1', int(port)))
+        send_frame(sock, request)
+        response = recv_frame(sock)
+    except (socket.error, ValueError, TypeError) as err:
+        log.error('Could not send command %s to the PKC service: %s'
+                  % (command, err))
+        return
+    finally:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        sock.close()
+    if response is None or 'error' in response:
+        log.error('PKC service could not execute command %s: %s'
+                  % (command, response))
+        return
+    return response.get('result')
+
+
+class Request(object):
+    """
+    A command received by the Command_Server. Answer with respond(result)
+    """
+    def __init__(self, connection, request):
+        self.connection = connection
+        self.id = request.get('id')
+        self.command = request.get('command')
+        self.args = request
+
+    def respond(self, result=None, error=None):
+        response = {'id': self.id}
+        if error is not None:
+            response['error'] = error
+        else:
+            response['result'] = result
+        self.connection.send(response)
+
+
+class Connection(Thread):
+    """
+    Reads the requests of one client and hands them to the Command_Server.
+    The socket is closed once the client is done and every request has been
+    answered
+    """
+    def __init__(self, server, sock):
+        self.server = server
+        self.sock = sock
+        self.lock = Lock()
+        # Number of requests that have not yet been answered
+        self.pending = 0
+        self.reading = True
+        Thread.__init__(self)
+
+    def send(self, response):
+        """
+        Thread safe - responses might be sent by several threads. Every
+        request needs to be answered exactly once
+        """
+        with self.lock:
+            try:
+                try:
+                    send_frame(self.sock, response)
+                except (TypeError, ValueError, UnicodeDecodeError) as err:
+                    # Result could not be encoded as JSON - don't let the
+                    # client wait for an answer that never comes
+                    log.error('Could not encode response %s: %s'
+                              % (response, err))
+                    send_frame(self.sock, {
+                        'id': response.get('id'),
+                        'error': 'Could not encode response: %s' % err
+                    })
+            except socket.error as err:
+                log.error('Could not send response %s: %s' % (response, err))
+            self.pending -= 1
+            if self.reading is False and self.pending == 0:
+                self.close()
+
+    def close(self):
+        """
+        Call with self.lock held
+        """
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        self.sock.close()
+
+    def run(self):
+        try:
+            while True:
+                request = recv_frame(self.sock)
+                if request is None:
+                    break
+                request = Request(self, request)
+                with self.lock:
+                    self.pending += 1
+                if self.server.token != request.args.get('token'):
+                    log.error('Rejecting command %s with invalid token'
+                              % request.command)
+                    request.respond(error='Invalid token')
+                    break
+                self.server.process(request)
+        except (socket.error, ValueError) as err:
+            log.error('Error receiving commands: %s' % err)
+        # Pending playback requests still get answered
+        with self.lock:
+            self.reading = False
+            if self.pending == 0:
+                self.close()
+
+
+@thread_methods
+class Command_Server(Thread):
+    """
+    Receives the commands of other PKC Python instances, e.g. for new plays
+    initiated on the Kodi side with addon paths. See send_command()
+
+    Commands:
+        'play':     params=<the add-on's paths argument>. Answered by
+                    playback_starter once playback is set up
+        'state':    key=<state.py variable>, value=<string>. Adjusts state.py
+                    accordingly
+        'lib_scan': kind=<'full', 'repair', 'views', 'fanart' or
+                    'del_textures'>. Asks the library sync thread to scan
     """
-    # Borg - multiple instances, shared state
     def __init__(self, callback=None):
         self.mgr = callback
         self.playback_queue = Queue()
+        self.token = urandom(16).encode('hex')
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(5)
+        # Check every now and then whether we need to stop
+        self.sock.settimeout(1.0)
         Thread.__init__(self)
 
+    def process(self, request):
+        """
+        Executes the Request request or hands it on to playback_starter
+        """
+        if request.command == 'play':
+            self.playback_queue.put(request)
+        elif request.command == 'state':
+            try:
+                self.set_state(request.args['key'], request.args['value'])
+            except (KeyError, NotImplementedError) as err:
+                log.error('Could not set state: %s' % err)
+                request.respond(error=str(err))
+            else:
+                request.respond()
+        elif request.command == 'lib_scan':
+            window('plex_runLibScan', value=request.args.get('kind'))
+            # Wakes up the library sync thread waiting for PMS messages
+            wake_up_threads()
+            request.respond()
+        else:
+            log.error('Command %s not implemented' % request.command)
+            request.respond(error='Command not implemented')
+
+    @staticmethod
+    def set_state(key, value):
+        if key == 'SUSPEND_LIBRARY_THREAD' and value == 'True':
+            state.SUSPEND_LIBRARY_THREAD = True
+            # Stops the sync threads
+            wake_up_threads()
+        elif key == 'SUSPEND_LIBRARY_THREAD' and value == 'False':
+            state.SUSPEND_LIBRARY_THREAD = False
+        elif key == 'STOP_SYNC' and value == 'True':
+            state.STOP_SYNC = True
+            wake_up_threads()
+        elif key == 'STOP_SYNC' and value == 'False':
+            state.STOP_SYNC = False
+        elif key == 'PMS_STATUS' and value == 'Auth':
+            state.PMS_STATUS = 'Auth'
+        elif key == 'PMS_STATUS' and value == '401':
+            state.PMS_STATUS = '401'
+        elif key == 'SUSPEND_USER_CLIENT' and value == 'True':
+            state.SUSPEND_USER_CLIENT = True
+        elif key == 'SUSPEND_USER_CLIENT' and value == 'False':
+            state.SUSPEND_USER_CLIENT = False
+        elif key == 'PLEX_TOKEN':
+            state.PLEX_TOKEN = value or None
+        elif key == 'PLEX_USERNAME':
+            state.PLEX_USERNAME = value or None
+        else:
+            raise NotImplementedError('%s-%s not implemented' % (key, value))
+
     def run(self):
         thread_stopped = self.thread_stopped
-        queue = self.playback_queue
-        log.info("----===## Starting Kodi_Play_Client ##===----")
+        log.info("----===## Starting Command_Server ##===----")
+        window('plex_command_token', value=self.token)
+        window('plex_command_port', value=str(self.sock.getsockname()[1]))
         while not thread_stopped():
-            if window('plex_command'):
-                value = window('plex_command')
-                window('plex_command', clear=True)
-                if value.startswith('play_'):
-                    queue.put(value)
-
-                elif value == 'SUSPEND_LIBRARY_THREAD-True':
-                    state.SUSPEND_LIBRARY_THREAD = True
-                elif value == 'SUSPEND_LIBRARY_THREAD-False':
-                    state.SUSPEND_LIBRARY_THREAD = False
-                elif value == 'STOP_SYNC-True':
-                    state.STOP_SYNC = True
-                elif value == 'STOP_SYNC-False':
-                    state.STOP_SYNC = False
-                elif value == 'PMS_STATUS-Auth':
-                    state.PMS_STATUS = 'Auth'
-                elif value == 'PMS_STATUS-401':
-                    state.PMS_STATUS = '401'
-                elif value == 'SUSPEND_USER_CLIENT-True':
-                    state.SUSPEND_USER_CLIENT = True
-                elif value == 'SUSPEND_USER_CLIENT-False':
-                    state.SUSPEND_USER_CLIENT = False
-                elif value.startswith('PLEX_TOKEN-'):
-                    state.PLEX_TOKEN = value.replace('PLEX_TOKEN-', '') or None
-                elif value.startswith('PLEX_USERNAME-'):
-                    state.PLEX_USERNAME = \
-                        value.replace('PLEX_USERNAME-', '') or None
-                else:
-                    raise NotImplementedError('%s not implemented' % value)
-            else:
-                sleep(50)
+            try:
+                sock, _ = self.sock.accept()
+            except socket.timeout:
+                continue
+            except socket.error as err:
+                log.error('Error accepting connection: %s' % err)
+                continue
+            sock.settimeout(None)
+            connection = Connection(self, sock)
+            connection.setDaemon(True)
+            connection.start()
+        window('plex_command_port', clear=True)
+        window('plex_command_token', clear=True)
+        self.sock.close()
         # Put one last item into the queue to let playback_starter end
-        queue.put(None)
-        log.info("----===## Kodi_Play_Client stopped ##===----")
+        self.playback_queue.put(None)
+        log.info("----===## Command_Server stopped ##===----")
@@ -4,10 +4,12 @@
 
 import logging
 import requests
+from time import time
 import xml.etree.ElementTree as etree
 
 from utils import settings, window, language as lang, dialog
 import clientinfo as client
+import metrics
 
 import state
 
@@ -128,16 +130,20 @@ class DownloadUtils():
         return header
 
     def _doDownload(self, s, action_type, **kwargs):
-        if action_type == "GET":
-            r = s.get(**kwargs)
-        elif action_type == "POST":
-            r = s.post(**kwargs)
-        elif action_type == "DELETE":
-            r = s.delete(**kwargs)
-        elif action_type == "OPTIONS":
-            r = s.options(**kwargs)
-        elif action_type == "PUT":
-            r = s.put(**kwargs)
+        start = time()
+        try:
+            if action_type == "GET":
+                r = s.get(**kwargs)
+            elif action_type == "POST":
+                r = s.post(**kwargs)
+            elif action_type == "DELETE":
+                r = s.delete(**kwargs)
+            elif action_type == "OPTIONS":
+                r = s.options(**kwargs)
+            elif action_type == "PUT":
+                r = s.put(**kwargs)
+        finally:
+            metrics.observe('pms.request', time() - start)
         return r
 
     def downloadUrl(self, url, action_type="GET", postBody=None,
@@ -12,7 +12,8 @@ from xbmc import sleep, executebuiltin, translatePath
 from xbmcgui import ListItem
 
 from utils import window, settings, language as lang, dialog, tryEncode, \
-    CatchExceptions, JSONRPC, exists_dir, plex_command, tryDecode
+    CatchExceptions, JSONRPC, exists_dir, plex_command, tryDecode, \
+    request_lib_scan
 import downloadutils
 
 from PlexFunctions import GetPlexMetadata, GetPlexSectionResults, \
@@ -575,7 +576,7 @@ def RunLibScan(mode):
         # Server is not online, do not run the sync
         dialog('ok', lang(29999), lang(39205))
     else:
-        window('plex_runLibScan', value='full')
+        request_lib_scan('full')
 
 
 def getOnDeck(viewid, mediatype, tagname, limit):
@@ -970,7 +971,7 @@ def __LogIn():
     SUSPEND_LIBRARY_THREAD is set to False in service.py if user was signed
     out!
     """
-    window('plex_runLibScan', value='full')
+    request_lib_scan('full')
     # Restart user client
     plex_command('SUSPEND_USER_CLIENT', 'False')
 
@@ -23,6 +23,8 @@ import state
 log = logging.getLogger("PLEX."+__name__)
 
 MARK_PLAYED_AT = 0.90
+# Commit to the DBs after this many items were processed during syncs
+COMMIT_INTERVAL = 500
 ###############################################################################
 
 
@@ -33,11 +35,19 @@ class Items(object):
 
     Input:
         kodiType:       optional argument; e.g. 'video' or 'music'
+
+    Pass cache_ids=True to cache the Kodi ids of actors, genres, paths etc.
+    while the DBs are open (see kodidb_functions.Id_Cache), e.g. for syncs
+
+    All add_update methods return True once the item has been written to the
+    DBs - anything else, also the None returned by CatchExceptions after a
+    crash, means it was not
     """
 
-    def __init__(self):
+    def __init__(self, cache_ids=False):
         self.artwork = artwork.Artwork()
         self.server = window('pms_server')
+        self.cache_ids = cache_ids
 
     def __enter__(self):
         """
@@ -48,25 +58,45 @@ class Items(object):
         self.kodiconn = kodiSQL('video')
         self.kodicursor = self.kodiconn.cursor()
         self.plex_db = plexdb.Plex_DB_Functions(self.plexcursor)
-        self.kodi_db = kodidb.Kodidb_Functions(self.kodicursor)
+        self.kodi_db = kodidb.Kodidb_Functions(self.kodicursor,
+                                               cache_ids=self.cache_ids)
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         """
         Make sure DB changes are committed and connection to DB is closed.
         """
-        self.plexconn.commit()
-        self.kodiconn.commit()
+        self.commit()
         self.plexconn.close()
         self.kodiconn.close()
         return self
 
-    @CatchExceptions(warnuser=True)
-    def getfanart(self, plex_id, refresh=False):
+    def commit(self):
         """
-        Tries to get additional fanart for movies (+sets) and TV shows.
+        Writes the rows batched by kodi_db and commits both the Plex and the
+        Kodi DB. Use to keep transactions short while processing many items
+        """
+        self.kodi_db.flush()
+        self.plexconn.commit()
+        self.kodiconn.commit()
+        # Kodi may change its DB now
+        self.kodi_db.clear_id_cache()
 
-        Returns True if successful, False otherwise
+    @staticmethod
+    def lookup_fanart(plex_id, refresh=False):
+        """
+        Looks up additional fanart for movies (+sets) and TV shows on the
+        internet without writing to the Kodi DB. Thread safe - pass the result
+        on to getfanart().
+
+        Returns None if unsuccessful, True if the item already has all the
+        fanart it needs or a dict:
+            {
+                'kodi_id':
+                'kodi_type':
+                'artworks':     artwork dict for addArtwork()
+                'sets':         list of (set name, artwork dict) tuples
+            }
         """
         with plexdb.Get_Plex_DB() as plex_db:
             db_item = plex_db.getItem_byId(plex_id)
@@ -76,7 +106,7 @@ class Items(object):
         except TypeError:
             log.error('Could not get Kodi id for plex id %s, abort getfanart'
                       % plex_id)
-            return False
+            return
         if refresh is True:
             # Leave the Plex art untouched
             allartworks = None
@@ -98,29 +128,55 @@ class Items(object):
             # Did not receive a valid XML - skip that item for now
             log.error("Could not get metadata for %s. Skipping that item "
                       "for now" % plex_id)
-            return False
+            return
         elif xml == 401:
             log.error('HTTP 401 returned by PMS. Too much strain? '
                       'Cancelling sync for now')
             # Kill remaining items in queue (for main thread to cont.)
-            return False
+            return
         API = PlexAPI.API(xml[0])
         if allartworks is None:
             allartworks = API.getAllArtwork()
-        self.artwork.addArtwork(API.getFanartArtwork(allartworks),
-                                kodi_id,
-                                kodi_type,
-                                self.kodicursor)
+        fanart = {
+            'kodi_id': kodi_id,
+            'kodi_type': kodi_type,
+            'artworks': API.getFanartArtwork(allartworks),
+            'sets': []
+        }
         # Also get artwork for collections/movie sets
         if kodi_type == v.KODI_TYPE_MOVIE:
             for setname in API.getSets():
                 log.debug('Getting artwork for movie set %s' % setname)
-                setid = self.kodi_db.createBoxset(setname)
-                self.artwork.addArtwork(API.getSetArtwork(),
-                                        setid,
-                                        v.KODI_TYPE_SET,
-                                        self.kodicursor)
-                self.kodi_db.assignBoxset(setid, kodi_id)
+                fanart['sets'].append((setname, API.getSetArtwork()))
+        return fanart
+
+    @CatchExceptions(warnuser=True)
+    def getfanart(self, plex_id, refresh=False, fanart=None):
+        """
+        Tries to get additional fanart for movies (+sets) and TV shows.
+        Pass the result of lookup_fanart() as fanart if you already looked
+        it up.
+
+        Returns True if successful, False otherwise
+        """
+        if fanart is None:
+            fanart = self.lookup_fanart(plex_id, refresh=refresh)
+        if fanart is None:
+            return False
+        elif fanart is True:
+            return True
+        kodi_id = fanart['kodi_id']
+        self.artwork.addArtwork(fanart['artworks'],
+                                kodi_id,
+                                fanart['kodi_type'],
+                                self.kodicursor)
+        for setname, setartworks in fanart['sets']:
+            setid = self.kodi_db.createBoxset(setname)
+            self.artwork.addArtwork(setartworks,
+                                    setid,
+                                    v.KODI_TYPE_SET,
+                                    self.kodicursor)
+            self.kodi_db.assignBoxset(setid, kodi_id)
         return True
 
     def updateUserdata(self, xml, viewtag=None, viewid=None):
@@ -461,9 +517,12 @@ class Movies(Items):
         self.kodi_db.addSets(movieid, collections, kodicursor)
         # Process playstates
         self.kodi_db.addPlaystate(fileid, resume, runtime, playcount, dateplayed)
+        return True
 
     def remove(self, itemid):
         # Remove movieid, fileid, plex reference
+        # Kodi triggers only delete link rows that are already in the DB
+        self.kodi_db.flush()
         plex_db = self.plex_db
         kodicursor = self.kodicursor
         artwork = self.artwork
@@ -742,6 +801,7 @@ class TVShows(Items):
         tags = [viewtag]
         tags.extend(collections)
         self.kodi_db.addTags(showid, tags, "tvshow")
+        return True
 
     @CatchExceptions(warnuser=True)
     def add_updateSeason(self, item, viewtag=None, viewid=None):
@@ -791,6 +851,26 @@ class TVShows(Items):
                                  parent_id=showid,
                                  view_id=viewid,
                                  checksum=checksum)
+        return True
+
+    def refreshSeasonEntry(self, plex_id, artworks):
+        """
+        Adds or updates the "All seasons" entry (season -1) of the already
+        synced TV show with plex_id, using the show's artworks as returned by
+        PlexAPI.API.getAllArtwork()
+        """
+        plex_dbitem = self.plex_db.getItem_byId(plex_id)
+        try:
+            showid = plex_dbitem[0]
+        except TypeError:
+            log.error('TV show %s not found in the Plex DB, not refreshing '
+                      'its seasons' % plex_id)
+            return
+        seasonid = self.kodi_db.addSeason(showid, -1)
+        self.artwork.addArtwork(artworks,
+                                seasonid,
+                                "season",
+                                self.kodicursor)
 
     @CatchExceptions(warnuser=True)
     def add_updateEpisode(self, item, viewtag=None, viewid=None):
@@ -1132,9 +1212,12 @@ class TVShows(Items):
                                       runtime,
                                       playcount,
                                       dateplayed)
+        return True
 
     def remove(self, itemid):
         # Remove showid, fileid, pathid, plex reference
+        # Kodi triggers only delete link rows that are already in the DB
+        self.kodi_db.flush()
         plex_db = self.plex_db
         kodicursor = self.kodicursor
 
@@ -1242,6 +1325,11 @@ class TVShows(Items):
     def removeShow(self, kodi_id):
         kodicursor = self.kodicursor
         self.artwork.deleteArtwork(kodi_id, v.KODI_TYPE_SHOW, kodicursor)
+        # "All seasons" entry, see refreshSeasonEntry
+        query = "SELECT idSeason FROM seasons WHERE idShow = ? AND season = -1"
+        kodicursor.execute(query, (kodi_id,))
+        for row in kodicursor.fetchall():
+            self.removeSeason(row[0])
         kodicursor.execute("DELETE FROM tvshow WHERE idShow = ?", (kodi_id,))
         if v.KODIVERSION >= 17:
             self.kodi_db.remove_uniqueid(kodi_id, v.KODI_TYPE_SHOW)
@@ -1280,7 +1368,8 @@ class Music(Items):
         self.kodiconn = kodiSQL('music')
         self.kodicursor = self.kodiconn.cursor()
         self.plex_db = plexdb.Plex_DB_Functions(self.plexcursor)
-        self.kodi_db = kodidb.Kodidb_Functions(self.kodicursor)
+        self.kodi_db = kodidb.Kodidb_Functions(self.kodicursor,
+                                               cache_ids=self.cache_ids)
         return self
 
     @CatchExceptions(warnuser=True)
@@ -1366,6 +1455,7 @@ class Music(Items):
 
         # Update artwork
         artwork.addArtwork(artworks, artistid, v.KODI_TYPE_ARTIST, kodicursor)
+        return True
 
     @CatchExceptions(warnuser=True)
     def add_updateAlbum(self, item, viewtag=None, viewid=None, children=None):
@@ -1558,8 +1648,11 @@ class Music(Items):
         # Update artwork
         artwork.addArtwork(artworks, albumid, v.KODI_TYPE_ALBUM, kodicursor)
         # Add all children - all tracks
+        written = True
         for child in children:
-            self.add_updateSong(child, viewtag, viewid)
+            if self.add_updateSong(child, viewtag, viewid) is not True:
+                written = False
+        return written
 
     @CatchExceptions(warnuser=True)
     def add_updateSong(self, item, viewtag=None, viewid=None):
@@ -1664,8 +1757,7 @@ class Music(Items):
                      % (itemid, title, path))
             # Update path
             # Use dummy strHash '123' for Kodi
-            query = "UPDATE path SET strPath = ?, strHash = ? WHERE idPath = ?"
-            kodicursor.execute(query, (path, '123', pathid))
+            self.kodi_db.updatePath(pathid, path, '123')
 
             # Update the song entry
             query = '''
@@ -1696,26 +1788,6 @@ class Music(Items):
                 plex_dbalbum = plex_db.getItem_byId(
                     item.attrib.get('parentRatingKey'))
                 albumid = plex_dbalbum[0]
-            except KeyError:
-                # Verify if there's an album associated.
-                album_name = item.get('parentTitle')
-                if album_name:
-                    log.info("Creating virtual music album for song: %s."
-                             % itemid)
-                    albumid = self.kodi_db.addAlbum(
-                        album_name,
-                        API.getProvider('MusicBrainzAlbum'))
-                    plex_db.addReference("%salbum%s" % (itemid, albumid),
-                                         v.PLEX_TYPE_ALBUM,
-                                         albumid,
-                                         v.KODI_TYPE_ALBUM,
-                                         view_id=viewid)
-                else:
-                    # No album Id associated to the song.
-                    log.error("Song itemid: %s has no albumId associated."
-                              % itemid)
-                    return False
-
             except TypeError:
                 # No album found. Let's create it
                 log.info("Album database entry missing.")
@@ -1913,9 +1985,12 @@ class Music(Items):
         if item.get('parentKey') is None:
             # Update album artwork
             artwork.addArtwork(allart, albumid, v.KODI_TYPE_ALBUM, kodicursor)
+        return True
 
     def remove(self, itemid):
         # Remove kodiid, fileid, pathid, plex reference
+        # Kodi triggers only delete link rows that are already in the DB
+        self.kodi_db.flush()
         plex_db = self.plex_db
 
         plex_dbitem = plex_db.getItem_byId(itemid)
@@ -1936,21 +2011,6 @@ class Music(Items):
         if mediatype == v.KODI_TYPE_SONG:
             # Delete song
             self.removeSong(kodiid)
-            # This should only address single song scenario, where server doesn't actually
-            # create an album for the song. 
-            plex_db.removeWildItem(itemid)
-
-            for item in plex_db.getItem_byWildId(itemid):
-
-                item_kid = item[0]
-                item_mediatype = item[1]
-
-                if item_mediatype == v.KODI_TYPE_ALBUM:
-                    childs = plex_db.getItem_byParentId(item_kid,
-                                                        v.KODI_TYPE_SONG)
-                    if not childs:
-                        # Delete album
-                        self.removeAlbum(item_kid)
 
         ##### IF ALBUM #####
 
@@ -2292,9 +2352,12 @@ class MusicVideos(Items):
         self.kodi_db.addSets(mvideoid, collections, kodicursor)
         # Process playstates
         self.kodi_db.addPlaystate(fileid, resume, runtime, playcount, dateplayed)
+        return True
 
     def remove(self, itemid):
         # Remove mvideoid, fileid, plex reference
+        # Kodi triggers only delete link rows that are already in the DB
+        self.kodi_db.flush()
         plex_db = self.plex_db
         kodicursor = self.kodicursor
         artwork = self.artwork
@@ -4,6 +4,7 @@
 
 import logging
 from ntpath import dirname
+from re import compile as re_compile
 
 import artwork
 from utils import kodiSQL
@@ -13,6 +14,19 @@ import variables as v
 
 log = logging.getLogger("PLEX."+__name__)
 
+# Kodi tables that we look up by name (Kodi Isengard and later):
+#   table: (id column, name column, COLLATE NOCASE?)
+ID_TABLES = {
+    'actor': ('actor_id', 'name', False),
+    'country': ('country_id', 'name', True),
+    'genre': ('genre_id', 'name', True),
+    'studio': ('studio_id', 'name', True),
+    'tag': ('tag_id', 'name', True),
+    'path': ('idPath', 'strPath', False)
+}
+# SQLite's COLLATE NOCASE only folds ASCII characters
+ASCII_UPPER = re_compile(r'[A-Z]')
+
 ###############################################################################
 
 
@@ -32,18 +46,184 @@ class GetKodiDB():
 
     def __enter__(self):
         self.kodiconn = kodiSQL(self.db_type)
-        kodi_db = Kodidb_Functions(self.kodiconn.cursor())
-        return kodi_db
+        self.kodi_db = Kodidb_Functions(self.kodiconn.cursor())
+        return self.kodi_db
 
     def __exit__(self, type, value, traceback):
+        self.kodi_db.flush()
         self.kodiconn.commit()
         self.kodiconn.close()
 
 
-class Kodidb_Functions():
+class Write_Batch():
+    """
+    Collects rows for INSERT statements of the Kodi link tables (genre_link,
+    actor_link, streamdetails, ...) and writes them all at once with
+    executemany() on flush().
+
+    Rows are remembered per query and per key, e.g. (table, media_id,
+    media_type) of the Kodi item. Use discard(key) whenever the rows of a key
+    are DELETEd from the DB before flush() - otherwise we would write them
+    again afterwards.
+    """
     def __init__(self, cursor):
+        self.cursor = cursor
+        # {query: {key: [row, row, ...]}}
+        self.rows = {}
+
+    def add(self, query, key, row):
+        self.rows.setdefault(query, {}).setdefault(key, []).append(row)
+
+    def discard(self, key):
+        for keys in self.rows.itervalues():
+            keys.pop(key, None)
+
+    def flush(self):
+        for query, keys in self.rows.iteritems():
+            self.cursor.executemany(
+                query, [row for rows in keys.itervalues() for row in rows])
+        self.rows = {}
+
+
+class Id_Cache():
+    """
+    Write-through cache name -> id for one of the Kodi ID_TABLES, e.g. actor.
+    The entire table is loaded with one SELECT on first use. Rows INSERTed by
+    our own connection need to be add()ed.
+
+    Only valid as long as nobody else changes the table - Kodi might do so as
+    soon as we commit. Hence clear() it with every commit
+    """
+    def __init__(self, cursor, table):
+        self.cursor = cursor
+        self.table = table
+        self.id_column, self.name_column, self.nocase = ID_TABLES[table]
+        self.ids = None
+        # Reverse lookup id -> key of self.ids
+        self.keys = {}
+
+    def _key(self, name):
+        if self.nocase and name:
+            return ASCII_UPPER.sub(lambda x: x.group(0).lower(), name)
+        return name
+
+    def _load(self):
+        self.ids = {}
+        self.cursor.execute('SELECT %s, %s FROM %s ORDER BY %s'
+                            % (self.id_column, self.name_column, self.table,
+                               self.id_column))
+        for kodi_id, name in self.cursor.fetchall():
+            # Several entries for the same name: SQL would return the first
+            key = self._key(name)
+            if key not in self.ids:
+                self.ids[key] = kodi_id
+                self.keys[kodi_id] = key
+        log.debug('Cached %s ids for table %s' % (len(self.ids), self.table))
+
+    def get(self, name):
+        """
+        Returns the id for name or None if name is not yet in the table
+        """
+        if self.ids is None:
+            self._load()
+        return self.ids.get(self._key(name))
+
+    def add(self, kodi_id, name):
+        """
+        Use after INSERTing a new row kodi_id for name
+        """
+        if self.ids is None:
+            self._load()
+        else:
+            key = self._key(name)
+            self.ids[key] = kodi_id
+            self.keys[kodi_id] = key
+
+    def clear(self):
+        """
+        Forgets all ids; the table is loaded again on next use
+        """
+        self.ids = None
+        self.keys = {}
+
+    def update(self, kodi_id, name):
+        """
+        Use if the name of an existing kodi_id was changed in the DB
+        """
+        if self.ids is None:
+            return
+        key = self.keys.pop(kodi_id, None)
+        if key is not None and self.ids.get(key) == kodi_id:
+            del self.ids[key]
+        key = self._key(name)
+        self.ids[key] = kodi_id
+        self.keys[kodi_id] = key
+
+
+class Kodidb_Functions():
+    """
+    Rows for the Kodi link tables are NOT written immediately, but only once
+    flush() is called - GetKodiDB and itemtypes.Items take care of that
+    before committing
+
+    Pass cache_ids=True to look up the ids of actors, genres, paths etc. in
+    an Id_Cache instead of the DB, e.g. for syncs. Call clear_id_cache() after
+    every commit - Kodi might add such entries in the meantime
+    """
+    def __init__(self, cursor, cache_ids=False):
         self.cursor = cursor
         self.artwork = artwork.Artwork()
+        self.batch = Write_Batch(cursor)
+        if cache_ids:
+            self.id_cache = dict((table, Id_Cache(cursor, table))
+                                 for table in ID_TABLES)
+        else:
+            self.id_cache = None
+
+    def flush(self):
+        """
+        Writes all rows collected for the Kodi link tables to the DB
+        """
+        self.batch.flush()
+
+    def clear_id_cache(self):
+        """
+        Forgets all cached ids, see Id_Cache
+        """
+        if self.id_cache is not None:
+            for cache in self.id_cache.itervalues():
+                cache.clear()
+
+    def _get_id(self, table, name):
+        """
+        Returns the Kodi id for name in one of the ID_TABLES or None if there
+        is no such entry yet
+        """
+        if self.id_cache is not None:
+            return self.id_cache[table].get(name)
+        id_column, name_column, nocase = ID_TABLES[table]
+        query = ' '.join((
+            "SELECT %s" % id_column,
+            "FROM %s" % table,
+            "WHERE %s = ?" % name_column,
+            "COLLATE NOCASE" if nocase else "",
+            "LIMIT 1"
+        ))
+        self.cursor.execute(query, (name,))
+        try:
+            return self.cursor.fetchone()[0]
+        except TypeError:
+            return None
+
+    def _new_id(self, table, name):
+        """
+        Returns the Kodi id of the entry for name in one of the ID_TABLES that
+        we just INSERTed - without an id, letting SQLite pick an unused one
+        """
+        kodi_id = self.cursor.lastrowid
+        if self.id_cache is not None:
+            self.id_cache[table].add(kodi_id, name)
+        return kodi_id
 
     def pathHack(self):
         """
@@ -77,13 +257,12 @@ class Kodidb_Functions():
             parentpath = "%s/" % dirname(dirname(path))
         pathid = self.getPath(parentpath)
         if pathid is None:
-            self.cursor.execute("select coalesce(max(idPath),0) from path")
-            pathid = self.cursor.fetchone()[0] + 1
             query = ' '.join((
-                "INSERT INTO path(idPath, strPath)",
-                "VALUES (?, ?)"
+                "INSERT INTO path(strPath)",
+                "VALUES (?)"
             ))
-            self.cursor.execute(query, (pathid, parentpath))
+            self.cursor.execute(query, (parentpath,))
+            pathid = self._new_id('path', parentpath)
             parentPathid = self.getParentPathId(parentpath)
             query = ' '.join((
                 "UPDATE path",
@@ -97,56 +276,43 @@ class Kodidb_Functions():
         # SQL won't return existing paths otherwise
         if path is None:
             path = ""
-        query = ' '.join((
-
-            "SELECT idPath",
-            "FROM path",
-            "WHERE strPath = ?"
-        ))
-        self.cursor.execute(query, (path,))
-        try:
-            pathid = self.cursor.fetchone()[0]
-        except TypeError:
-            self.cursor.execute("select coalesce(max(idPath),0) from path")
-            pathid = self.cursor.fetchone()[0] + 1
+        pathid = self._get_id('path', path)
+        if pathid is None:
             if strHash is None:
                 query = (
                     '''
                     INSERT INTO path(
-                        idPath, strPath)
+                        strPath)
 
-                    VALUES (?, ?)
+                    VALUES (?)
                     '''
                 )
-                self.cursor.execute(query, (pathid, path))
+                self.cursor.execute(query, (path,))
             else:
                 query = (
                     '''
                     INSERT INTO path(
-                        idPath, strPath, strHash)
+                        strPath, strHash)
 
-                    VALUES (?, ?, ?)
+                    VALUES (?, ?)
                     '''
                 )
-                self.cursor.execute(query, (pathid, path, strHash))
+                self.cursor.execute(query, (path, strHash))
+            pathid = self._new_id('path', path)
 
         return pathid
 
     def getPath(self, path):
+        return self._get_id('path', path)
 
-        query = ' '.join((
-
-            "SELECT idPath",
-            "FROM path",
-            "WHERE strPath = ?"
-        ))
-        self.cursor.execute(query, (path,))
-        try:
-            pathid = self.cursor.fetchone()[0]
-        except TypeError:
-            pathid = None
-
-        return pathid
+    def updatePath(self, pathid, path, strHash):
+        """
+        Changes strPath and strHash of the existing path with id pathid
+        """
+        query = "UPDATE path SET strPath = ?, strHash = ? WHERE idPath = ?"
+        self.cursor.execute(query, (path, strHash, pathid))
+        if self.id_cache is not None:
+            self.id_cache['path'].update(pathid, path)
 
     def addFile(self, filename, pathid):
 
@@ -208,37 +374,25 @@ class Kodidb_Functions():
         if v.KODIVERSION > 14:
             # Kodi Isengard, Jarvis, Krypton
             for country in countries:
-                query = ' '.join((
-
-                    "SELECT country_id",
-                    "FROM country",
-                    "WHERE name = ?",
-                    "COLLATE NOCASE"
-                ))
-                self.cursor.execute(query, (country,))
-
-                try:
-                    country_id = self.cursor.fetchone()[0]
-
-                except TypeError:
+                country_id = self._get_id('country', country)
+                if country_id is None:
                     # Country entry does not exists
-                    self.cursor.execute("select coalesce(max(country_id),0) from country")
-                    country_id = self.cursor.fetchone()[0] + 1
-
-                    query = "INSERT INTO country(country_id, name) values(?, ?)"
-                    self.cursor.execute(query, (country_id, country))
+                    query = "INSERT INTO country(name) values(?)"
+                    self.cursor.execute(query, (country,))
+                    country_id = self._new_id('country', country)
                     log.debug("Add country to media, processing: %s" % country)
+                # Assign country to content
+                query = (
+                    '''
+                    INSERT OR REPLACE INTO country_link(
+                        country_id, media_id, media_type)
 
-                finally: # Assign country to content
-                    query = (
-                        '''
-                        INSERT OR REPLACE INTO country_link(
-                            country_id, media_id, media_type)
-                        
-                        VALUES (?, ?, ?)
-                        '''
-                    )
-                    self.cursor.execute(query, (country_id, kodiid, mediatype))
+                    VALUES (?, ?, ?)
+                    '''
+                )
+                self.batch.add(query,
+                               ('country_link', kodiid, mediatype),
+                               (country_id, kodiid, mediatype))
         else:
             # Kodi Helix
             for country in countries:
@@ -280,21 +434,12 @@ class Kodidb_Functions():
         """
         Crucial für sync speed!
         """
-        query = ' '.join((
-            "SELECT actor_id",
-            "FROM actor",
-            "WHERE name = ?",
-            "LIMIT 1"
-        ))
-        self.cursor.execute(query, (name,))
-        try:
-            actorid = self.cursor.fetchone()[0]
-        except TypeError:
+        actorid = self._get_id('actor', name)
+        if actorid is None:
             # Cast entry does not exists
-            self.cursor.execute("select coalesce(max(actor_id),0) from actor")
-            actorid = self.cursor.fetchone()[0] + 1
-            query = "INSERT INTO actor(actor_id, name) VALUES (?, ?)"
-            self.cursor.execute(query, (actorid, name))
+            query = "INSERT INTO actor(name) VALUES (?)"
+            self.cursor.execute(query, (name,))
+            actorid = self._new_id('actor', name)
         return actorid
 
     def _addPerson(self, role, person_type, actorid, kodiid, mediatype,
@@ -305,8 +450,9 @@ class Kodidb_Functions():
                     actor_id, media_id, media_type, role, cast_order)
                 VALUES (?, ?, ?, ?, ?)
             '''
-            self.cursor.execute(query, (actorid, kodiid, mediatype, role,
-                                        castorder))
+            self.batch.add(query,
+                           ('actor_link', kodiid, mediatype),
+                           (actorid, kodiid, mediatype, role, castorder))
             castorder += 1
         elif "Director" == person_type:
             query = '''
@@ -314,24 +460,37 @@ class Kodidb_Functions():
                     actor_id, media_id, media_type)
                 VALUES (?, ?, ?)
                 '''
-            self.cursor.execute(query, (actorid, kodiid, mediatype))
+            self.batch.add(query,
+                           ('director_link', kodiid, mediatype),
+                           (actorid, kodiid, mediatype))
         elif person_type == "Writer":
             query = '''
                 INSERT OR REPLACE INTO writer_link(
                     actor_id, media_id, media_type)
                 VALUES (?, ?, ?)
             '''
-            self.cursor.execute(query, (actorid, kodiid, mediatype))
+            self.batch.add(query,
+                           ('writer_link', kodiid, mediatype),
+                           (actorid, kodiid, mediatype))
         elif "Artist" == person_type:
             query = '''
                 INSERT OR REPLACE INTO actor_link(
                     actor_id, media_id, media_type)
                 VALUES (?, ?, ?)
             '''
-            self.cursor.execute(query, (actorid, kodiid, mediatype))
+            self.batch.add(query,
+                           ('actor_link', kodiid, mediatype),
+                           (actorid, kodiid, mediatype))
         return castorder
 
     def addPeople(self, kodiid, people, mediatype):
+        # [(actorid, media_type, url)] of the people's images, to add them to
+        # the art table all at once
+        art = []
+        self._addPeopleLinks(kodiid, people, mediatype, art)
+        self.artwork.addPeopleArt(art, self.cursor)
+
+    def _addPeopleLinks(self, kodiid, people, mediatype, art):
         castorder = 1
         for person in people:
             # Kodi Isengard, Jarvis, Krypton
@@ -478,9 +637,8 @@ class Kodidb_Functions():
 
             # Add person image to art table
             if person['imageurl']:
-                self.artwork.addOrUpdateArt(person['imageurl'], actorid,
-                                            person['Type'].lower(), "thumb",
-                                            self.cursor)
+                art.append((actorid, person['Type'].lower(),
+                            person['imageurl']))
 
     def existingArt(self, kodiId, mediaType, refresh=False):
         """
@@ -537,42 +695,29 @@ class Kodidb_Functions():
                 "AND media_type = ?"
             ))
             self.cursor.execute(query, (kodiid, mediatype,))
+            self.batch.discard(('genre_link', kodiid, mediatype))
 
             # Add genres
             for genre in genres:
-                
-                query = ' '.join((
-
-                    "SELECT genre_id",
-                    "FROM genre",
-                    "WHERE name = ?",
-                    "COLLATE NOCASE"
-                ))
-                self.cursor.execute(query, (genre,))
-                
-                try:
-                    genre_id = self.cursor.fetchone()[0]
-                
-                except TypeError:
+                genre_id = self._get_id('genre', genre)
+                if genre_id is None:
                     # Create genre in database
-                    self.cursor.execute("select coalesce(max(genre_id),0) from genre")
-                    genre_id = self.cursor.fetchone()[0] + 1
-                    
-                    query = "INSERT INTO genre(genre_id, name) values(?, ?)"
-                    self.cursor.execute(query, (genre_id, genre))
+                    query = "INSERT INTO genre(name) values(?)"
+                    self.cursor.execute(query, (genre,))
+                    genre_id = self._new_id('genre', genre)
                     log.debug("Add Genres to media, processing: %s" % genre)
-                
-                finally:
-                    # Assign genre to item
-                    query = (
-                        '''
-                        INSERT OR REPLACE INTO genre_link(
-                            genre_id, media_id, media_type)
-
-                        VALUES (?, ?, ?)
-                        '''
-                    )
-                    self.cursor.execute(query, (genre_id, kodiid, mediatype))
+                # Assign genre to item
+                query = (
+                    '''
+                    INSERT OR REPLACE INTO genre_link(
+                        genre_id, media_id, media_type)
+
+                    VALUES (?, ?, ?)
+                    '''
+                )
+                self.batch.add(query,
+                               ('genre_link', kodiid, mediatype),
+                               (genre_id, kodiid, mediatype))
         else:
             # Kodi Helix
             # Delete current genres for clean slate
@@ -644,35 +789,24 @@ class Kodidb_Functions():
         for studio in studios:
             if v.KODIVERSION > 14:
                 # Kodi Isengard, Jarvis, Krypton
-                query = ' '.join((
-
-                    "SELECT studio_id",
-                    "FROM studio",
-                    "WHERE name = ?",
-                    "COLLATE NOCASE"
-                ))
-                self.cursor.execute(query, (studio,))
-                try:
-                    studioid = self.cursor.fetchone()[0]
-                
-                except TypeError:
+                studioid = self._get_id('studio', studio)
+                if studioid is None:
                     # Studio does not exists.
-                    self.cursor.execute("select coalesce(max(studio_id),0) from studio")
-                    studioid = self.cursor.fetchone()[0] + 1
-
-                    query = "INSERT INTO studio(studio_id, name) values(?, ?)"
-                    self.cursor.execute(query, (studioid, studio))
+                    query = "INSERT INTO studio(name) values(?)"
+                    self.cursor.execute(query, (studio,))
+                    studioid = self._new_id('studio', studio)
                     log.debug("Add Studios to media, processing: %s" % studio)
+                # Assign studio to item
+                query = (
+                    '''
+                    INSERT OR REPLACE INTO studio_link(
+                        studio_id, media_id, media_type)
 
-                finally: # Assign studio to item
-                    query = (
-                        '''
-                        INSERT OR REPLACE INTO studio_link(
-                            studio_id, media_id, media_type)
-                        
-                        VALUES (?, ?, ?)
-                        ''')
-                    self.cursor.execute(query, (studioid, kodiid, mediatype))
+                    VALUES (?, ?, ?)
+                    ''')
+                self.batch.add(query,
+                               ('studio_link', kodiid, mediatype),
+                               (studioid, kodiid, mediatype))
             else:
                 # Kodi Helix
                 query = ' '.join((
@@ -726,6 +860,7 @@ class Kodidb_Functions():
         
         # First remove any existing entries
         self.cursor.execute("DELETE FROM streamdetails WHERE idFile = ?", (fileid,))
+        self.batch.discard(('streamdetails', fileid))
         if streamdetails:
             # Video details
             for videotrack in streamdetails['video']:
@@ -738,9 +873,10 @@ class Kodidb_Functions():
                     VALUES (?, ?, ?, ?, ?, ?, ?, ?)
                     '''
                 )
-                self.cursor.execute(query, (fileid, 0, videotrack['codec'],
-                    videotrack['aspect'], videotrack['width'], videotrack['height'],
-                    runtime ,videotrack['video3DFormat']))
+                self.batch.add(query, ('streamdetails', fileid), (fileid, 0,
+                    videotrack['codec'], videotrack['aspect'],
+                    videotrack['width'], videotrack['height'], runtime,
+                    videotrack['video3DFormat']))
             
             # Audio details
             for audiotrack in streamdetails['audio']:
@@ -752,8 +888,9 @@ class Kodidb_Functions():
                     VALUES (?, ?, ?, ?, ?)
                     '''
                 )
-                self.cursor.execute(query, (fileid, 1, audiotrack['codec'],
-                    audiotrack['channels'], audiotrack['language']))
+                self.batch.add(query, ('streamdetails', fileid), (fileid, 1,
+                    audiotrack['codec'], audiotrack['channels'],
+                    audiotrack['language']))
 
             # Subtitles details
             for subtitletrack in streamdetails['subtitle']:
@@ -765,7 +902,8 @@ class Kodidb_Functions():
                     VALUES (?, ?, ?)
                     '''
                 )
-                self.cursor.execute(query, (fileid, 2, subtitletrack))
+                self.batch.add(query, ('streamdetails', fileid),
+                               (fileid, 2, subtitletrack))
 
     def getResumes(self):
         """
@@ -969,6 +1107,7 @@ class Kodidb_Functions():
                 "AND media_type = ?"
             ))
             self.cursor.execute(query, (kodiid, mediatype))
+            self.batch.discard(('tag_link', kodiid, mediatype))
         else:
             # Kodi Helix
             query = ' '.join((
@@ -987,33 +1126,23 @@ class Kodidb_Functions():
     def addTag(self, kodiid, tag, mediatype):
         if v.KODIVERSION > 14:
             # Kodi Isengard, Jarvis, Krypton
-            query = ' '.join((
-
-                "SELECT tag_id",
-                "FROM tag",
-                "WHERE name = ?",
-                "COLLATE NOCASE"
-            ))
-            self.cursor.execute(query, (tag,))
-            try:
-                tag_id = self.cursor.fetchone()[0]
-            
-            except TypeError:
+            tag_id = self._get_id('tag', tag)
+            if tag_id is None:
                 # Create the tag, because it does not exist
                 tag_id = self.createTag(tag)
                 log.debug("Adding tag: %s" % tag)
+            # Assign tag to item
+            query = (
+                '''
+                INSERT OR REPLACE INTO tag_link(
+                    tag_id, media_id, media_type)
 
-            finally:
-                # Assign tag to item
-                query = (
-                    '''
-                    INSERT OR REPLACE INTO tag_link(
-                        tag_id, media_id, media_type)
-                    
-                    VALUES (?, ?, ?)
-                    '''
-                )
-                self.cursor.execute(query, (tag_id, kodiid, mediatype))
+                VALUES (?, ?, ?)
+                '''
+            )
+            self.batch.add(query,
+                           ('tag_link', kodiid, mediatype),
+                           (tag_id, kodiid, mediatype))
         else:
             # Kodi Helix
             query = ' '.join((
@@ -1048,23 +1177,11 @@ class Kodidb_Functions():
         # This will create and return the tag_id
         if v.KODIVERSION > 14:
             # Kodi Isengard, Jarvis, Krypton
-            query = ' '.join((
-
-                "SELECT tag_id",
-                "FROM tag",
-                "WHERE name = ?",
-                "COLLATE NOCASE"
-            ))
-            self.cursor.execute(query, (name,))
-            try:
-                tag_id = self.cursor.fetchone()[0]
-            
-            except TypeError:
-                self.cursor.execute("select coalesce(max(tag_id),0) from tag")
-                tag_id = self.cursor.fetchone()[0] + 1
-
-                query = "INSERT INTO tag(tag_id, name) values(?, ?)"
-                self.cursor.execute(query, (tag_id, name))
+            tag_id = self._get_id('tag', name)
+            if tag_id is None:
+                query = "INSERT INTO tag(name) values(?)"
+                self.cursor.execute(query, (name,))
+                tag_id = self._new_id('tag', name)
                 log.debug("Create tag_id: %s name: %s" % (tag_id, name))
         else:
             # Kodi Helix
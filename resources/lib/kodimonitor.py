@@ -9,7 +9,8 @@ from xbmc import Monitor, Player, sleep
 
 import downloadutils
 import plexdb_functions as plexdb
-from utils import window, settings, CatchExceptions, tryDecode, tryEncode
+from utils import window, settings, CatchExceptions, tryDecode, tryEncode, \
+    wake_up_threads, request_lib_scan
 from PlexFunctions import scrobble
 from kodidb_functions import get_kodiid_from_filename
 from PlexAPI import API
@@ -71,7 +72,7 @@ class KodiMonitor(Monitor):
                 window(window_value, value=settings(settings_value))
                 if settings_value == 'fetch_pms_item_number':
                     log.info('Requesting playlist/nodes refresh')
-                    window('plex_runLibScan', value="views")
+                    request_lib_scan('views')
 
     @CatchExceptions(warnuser=False)
     def onNotification(self, sender, method, data):
@@ -136,11 +137,12 @@ class KodiMonitor(Monitor):
         elif method == "GUI.OnScreensaverDeactivated":
             if settings('dbSyncScreensaver') == "true":
                 sleep(5000)
-                window('plex_runLibScan', value="full")
+                request_lib_scan('full')
 
         elif method == "System.OnQuit":
             log.info('Kodi OnQuit detected - shutting down')
             state.STOP_PKC = True
+            wake_up_threads()
 
     def PlayBackStart(self, data):
         """
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+Finds the Plex items that a full sync needs to add, update or delete without
+keeping dicts of all the items in memory
+"""
+from array import array
+from bisect import bisect_left
+
+###############################################################################
+
+
+class Checksum_Diff(object):
+    """
+    Holds the Plex DB's plex_ids and checksums of plex_types, sorted by
+    plex_id, in compact int arrays. Look up every item the PMS lists with
+    get(); the plex_ids that were never looked up are the items that have
+    been deleted on the PMS, see removed().
+
+    Pass plex_db=None to start with an empty Plex DB, e.g. for repair syncs:
+    every item is then new
+    """
+    def __init__(self, plex_db=None, plex_types=()):
+        self.plex_ids = array('l')
+        self.checksums = array('l')
+        if plex_db is not None:
+            for plex_id, checksum in plex_db.checksums_by_types(plex_types):
+                self.plex_ids.append(plex_id)
+                # Won't match anything we get from the PMS - will be synced
+                self.checksums.append(-1 if checksum is None else checksum)
+        # 1 for plex_ids that we've seen on the PMS
+        self.seen = bytearray(len(self.plex_ids))
+        # Number of get() calls for plex_ids unknown to the Plex DB
+        self.unknown = 0
+
+    def __len__(self):
+        return len(self.plex_ids)
+
+    def get(self, plex_id):
+        """
+        Returns the Plex DB's int checksum for plex_id (str or int) or None
+        if the Plex DB does not know the item. Remembers that the PMS still
+        has the item
+        """
+        plex_id = int(plex_id)
+        index = bisect_left(self.plex_ids, plex_id)
+        if index == len(self.plex_ids) or self.plex_ids[index] != plex_id:
+            self.unknown += 1
+            return
+        self.seen[index] = 1
+        return self.checksums[index]
+
+    def removed(self):
+        """
+        Yields the plex_ids (as str) of all Plex DB items that we did not
+        get() - they are gone from the PMS
+        """
+        index = self.seen.find('\x00')
+        while index != -1:
+            yield str(self.plex_ids[index])
+            index = self.seen.find('\x00', index + 1)
@@ -1,11 +1,10 @@
 # -*- coding: utf-8 -*-
 from logging import getLogger
 from threading import Thread
-from Queue import Empty
 
 from xbmc import sleep
 
-from utils import thread_methods
+from utils import thread_methods, Worker_Queue
 import plexdb_functions as plexdb
 import itemtypes
 import variables as v
@@ -14,6 +13,9 @@ import variables as v
 
 log = getLogger("PLEX."+__name__)
 
+# Number of items we look up on the internet at once
+LOOKUP_WORKERS = 4
+
 ###############################################################################
 
 
@@ -21,11 +23,13 @@ log = getLogger("PLEX."+__name__)
                 add_stops=['STOP_SYNC'])
 class Process_Fanart_Thread(Thread):
     """
-    Threaded download of additional fanart in the background
+    Threaded download of additional fanart in the background. LOOKUP_WORKERS
+    threads look up the fanart on the internet (see web_cache for caching
+    and rate limiting), this thread writes it to the Kodi DB one by one
 
     Input:
-        queue           Queue.Queue() object that you will need to fill with
-                        dicts of the following form:
+        queue           utils.Worker_Queue() object that you will need to fill
+                        with dicts of the following form:
             {
               'plex_id':                the Plex id as a string
               'plex_type':              the Plex media type, e.g. 'movie'
@@ -35,6 +39,8 @@ class Process_Fanart_Thread(Thread):
     """
     def __init__(self, queue):
         self.queue = queue
+        # (item, result of lookup_fanart()) ready to be written
+        self.results = Worker_Queue()
         Thread.__init__(self)
 
     def run(self):
@@ -48,39 +54,88 @@ class Process_Fanart_Thread(Thread):
             import traceback
             log.error("Traceback:\n%s" % traceback.format_exc())
 
+    def wait_while_suspended(self):
+        """
+        Returns False if we need to stop, True otherwise
+        """
+        thread_stopped = self.thread_stopped
+        # In the event the server goes offline
+        while self.thread_suspended():
+            # Set in service.py
+            if thread_stopped():
+                # Abort was requested while waiting. We should exit
+                return False
+            sleep(1000)
+        return True
+
+    def lookup(self):
+        """
+        Lookup worker: fills self.results
+        """
+        thread_stopped = self.thread_stopped
+        queue = self.queue
+        results = self.results
+        while not thread_stopped():
+            # grabs Plex item from queue, waiting for one
+            item = queue.get_or_stop(thread_stopped)
+            if item is None:
+                break
+            if not self.wait_while_suspended():
+                break
+            log.debug('Get additional fanart for Plex id %s' % item['plex_id'])
+            try:
+                fanart = itemtypes.Items.lookup_fanart(
+                    item['plex_id'], refresh=item['refresh'])
+            except Exception as e:
+                log.error('Could not look up fanart for Plex id %s: %s'
+                          % (item['plex_id'], e))
+                import traceback
+                log.error("Traceback:\n%s" % traceback.format_exc())
+                fanart = None
+            if not results.put_or_stop((item, fanart), thread_stopped):
+                queue.task_done()
+                break
+
     def __run(self):
         """
         Do the work
         """
         log.debug("---===### Starting FanartSync ###===---")
         thread_stopped = self.thread_stopped
-        thread_suspended = self.thread_suspended
         queue = self.queue
+        results = self.results
+        workers = []
+        for _ in range(LOOKUP_WORKERS):
+            worker = Thread(target=self.lookup)
+            worker.setDaemon(True)
+            worker.start()
+            workers.append(worker)
         while not thread_stopped():
-            # In the event the server goes offline
-            while thread_suspended():
-                # Set in service.py
-                if thread_stopped():
-                    # Abort was requested while waiting. We should exit
-                    log.info("---===### Stopped FanartSync ###===---")
-                    return
-                sleep(1000)
-            # grabs Plex item from queue
-            try:
-                item = queue.get(block=False)
-            except Empty:
-                sleep(200)
-                continue
-
-            log.debug('Get additional fanart for Plex id %s' % item['plex_id'])
-            with getattr(itemtypes,
-                         v.ITEMTYPE_FROM_PLEXTYPE[item['plex_type']])() as cls:
-                result = cls.getfanart(item['plex_id'],
-                                       refresh=item['refresh'])
+            result = results.get_or_stop(thread_stopped)
+            if result is None:
+                break
+            item, fanart = result
+            if not self.wait_while_suspended():
+                break
+            if fanart is None:
+                result = False
+            elif fanart is True:
+                # Already got all the fanart
+                result = True
+            else:
+                with getattr(itemtypes,
+                             v.ITEMTYPE_FROM_PLEXTYPE[item['plex_type']])() \
+                        as cls:
+                    result = cls.getfanart(item['plex_id'],
+                                           refresh=item['refresh'],
+                                           fanart=fanart)
             if result is True:
                 log.debug('Done getting fanart for Plex id %s'
                           % item['plex_id'])
                 with plexdb.Get_Plex_DB() as plex_db:
                     plex_db.set_fanart_synched(item['plex_id'])
+            results.task_done()
             queue.task_done()
+        for worker in workers:
+            worker.join()
         log.debug("---===### Stopped FanartSync ###===---")
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+from logging import getLogger
+from threading import Thread
+from Queue import Queue
+
+###############################################################################
+
+log = getLogger("PLEX."+__name__)
+
+###############################################################################
+
+
+def fetch_concurrently(function, items, workers):
+    """
+    Generator calling function(item) for every item of the iterable items,
+    from a pool of up to workers daemon threads, e.g. to download stuff from
+    the PMS.
+
+    Yields the tuples (item, function(item)) in the order of items. At most
+    workers results are running or waiting to be yielded at any time. If
+    function raises an exception, it is logged and the result is None. The
+    threads terminate once the generator is exhausted or closed
+    """
+    items = iter(items)
+    tasks = Queue()
+    done = Queue()
+    threads = []
+    # {index: item} of all items we did not yet yield
+    pending = {}
+    # {index: result}
+    results = {}
+    submitted = 0
+    yielded = 0
+    exhausted = False
+    try:
+        while True:
+            while not exhausted and submitted - yielded < workers:
+                try:
+                    item = next(items)
+                except StopIteration:
+                    exhausted = True
+                    break
+                pending[submitted] = item
+                if len(threads) < workers:
+                    thread = Thread(target=_work, args=(function, tasks, done))
+                    thread.setDaemon(True)
+                    thread.start()
+                    threads.append(thread)
+                tasks.put((submitted, item))
+                submitted += 1
+            # Yield in the right order
+            while yielded in results:
+                yield pending.pop(yielded), results.pop(yielded)
+                yielded += 1
+            if yielded == submitted:
+                if exhausted:
+                    return
+                continue
+            index, result = done.get()
+            results[index] = result
+    finally:
+        # Let the threads terminate
+        for _ in threads:
+            tasks.put(None)
+
+
+def _work(function, tasks, done):
+    """
+    Takes (index, item) from the queue tasks and puts (index, function(item))
+    into the queue done - until it gets None
+    """
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        index, item = task
+        try:
+            result = function(item)
+        except Exception as err:
+            log.error('Error while fetching %s: %s' % (item, err))
+            import traceback
+            log.error("Traceback:\n%s" % traceback.format_exc())
+            result = None
+        done.put((index, result))
@@ -2,12 +2,16 @@
 from logging import getLogger
 from threading import Thread
 from Queue import Empty
+from time import time
 
 from xbmc import sleep
 
 from utils import thread_methods, window
-from PlexFunctions import GetPlexMetadata, GetAllPlexChildren
+from PlexFunctions import GetPlexMetadataForItems, GetAllPlexChildren
 import sync_info
+import metrics
+from metadata_cache import Metadata_Cache
+from update_list import checksum
 
 ###############################################################################
 
@@ -23,14 +27,31 @@ class Threaded_Get_Metadata(Thread):
     Fills the out_queue with the downloaded etree XML objects
 
     Input:
-        queue               Queue.Queue() object that you'll need to fill up
-                            with Plex itemIds
-        out_queue           Queue() object where this thread will store
-                            the downloaded metadata XMLs as etree objects
+        queue               utils.Worker_Queue() object that you'll need to
+                            fill up with update_list.Update_Items
+        out_queue           Worker_Queue() object where this thread will store
+                            the items with the downloaded metadata XMLs as
+                            etree objects (item.XML is None if the download
+                            failed)
+        batch_size          Metadata for up to batch_size items is requested
+                            from the PMS at once
+        use_cache           If True, use metadata from the Metadata_Cache if
+                            the item's updatedAt did not change. Downloaded
+                            metadata is always cached
+        abort               Optional function called with the reason if the
+                            sync needs to be cancelled, e.g. if the PMS
+                            returned 401 or if this thread crashed
+
+    Every item taken from queue is passed on to out_queue, no matter what
     """
-    def __init__(self, queue, out_queue):
+    def __init__(self, queue, out_queue, batch_size=1, use_cache=False,
+                 abort=None):
         self.queue = queue
         self.out_queue = out_queue
+        self.batch_size = batch_size
+        self.use_cache = use_cache
+        self.abort = abort
+        self.cache = None
         Thread.__init__(self)
 
     def terminate_now(self):
@@ -59,16 +80,61 @@ class Threaded_Get_Metadata(Thread):
                 else:
                     self.out_queue.task_done()
 
+    def get_metadata(self, keys, updated_at):
+        """
+        Gets the metadata for the list of Plex ids keys. Pass the dict
+        updated_at = {Plex id: int updatedAt} to look up the Metadata_Cache
+        first. Downloads the rest, batch_size items with one request. Items
+        that the PMS did not return are downloaded one by one.
+
+        Returns a dict {Plex id: etree XML} (ids we could not get metadata
+        for are missing) or 401
+        """
+        result = {}
+        if self.use_cache is True:
+            for key in keys:
+                xml = self.cache.get(key, updated_at.get(key))
+                if xml is not None:
+                    result[key] = xml
+            if result:
+                keys = [key for key in keys if key not in result]
+                log.debug('Using cached metadata for %s items' % len(result))
+            # Never hold a lock on the cache while downloading
+            self.cache.commit()
+        for pos in xrange(0, len(keys), self.batch_size):
+            xmls = GetPlexMetadataForItems(keys[pos:pos + self.batch_size])
+            if xmls == 401:
+                return 401
+            for key, xml in xmls.iteritems():
+                self.cache.put(key, xml)
+            self.cache.commit()
+            result.update(xmls)
+        return result
+
     def run(self):
         """
         Catch all exceptions and log them
         """
         try:
-            self.__run()
+            with Metadata_Cache() as self.cache:
+                self.__run()
         except Exception as e:
             log.error('Exception %s' % e)
             import traceback
             log.error("Traceback:\n%s" % traceback.format_exc())
+            if self.abort is not None:
+                self.abort('Get metadata thread crashed')
+
+    def forward(self, item):
+        """
+        Passes item on to out_queue
+        """
+        if self.out_queue.put_or_stop(item, self.thread_stopped):
+            # Keep track of where we are at
+            with sync_info.LOCK:
+                sync_info.GET_METADATA_COUNT += 1
+        # signals to queue job is done
+        self.queue.task_done()
 
     def __run(self):
         """
@@ -77,63 +143,87 @@ class Threaded_Get_Metadata(Thread):
         log.debug('Starting get metadata thread')
         # cache local variables because it's faster
         queue = self.queue
-        out_queue = self.out_queue
         thread_stopped = self.thread_stopped
         while thread_stopped() is False:
-            # grabs Plex item from queue
-            try:
-                item = queue.get(block=False)
-            # Empty queue
-            except Empty:
-                sleep(20)
-                continue
-            # Download Metadata
-            xml = GetPlexMetadata(item['itemId'])
-            if xml is None:
-                # Did not receive a valid XML - skip that item for now
-                log.error("Could not get metadata for %s. Skipping that item "
-                          "for now" % item['itemId'])
-                # Increase BOTH counters - since metadata won't be processed
-                with sync_info.LOCK:
-                    sync_info.GET_METADATA_COUNT += 1
-                    sync_info.PROCESS_METADATA_COUNT += 1
-                queue.task_done()
-                continue
-            elif xml == 401:
-                log.error('HTTP 401 returned by PMS. Too much strain? '
-                          'Cancelling sync for now')
-                window('plex_scancrashed', value='401')
-                # Kill remaining items in queue (for main thread to cont.)
-                queue.task_done()
+            # grabs Plex items from queue, waiting for the first one
+            item = queue.get_or_stop(thread_stopped)
+            if item is None:
                 break
-
-            item['XML'] = xml
-            if item.get('get_children') is True:
-                children_xml = GetAllPlexChildren(item['itemId'])
+            items = [item]
+            # Grab more items, as many as we download at once
+            while len(items) < self.batch_size:
                 try:
-                    children_xml[0].attrib
-                except (TypeError, IndexError, AttributeError):
-                    log.error('Could not get children for Plex id %s'
-                              % item['itemId'])
-                else:
-                    item['children'] = []
-                    for child in children_xml:
-                        child_xml = GetPlexMetadata(child.attrib['ratingKey'])
-                        try:
-                            child_xml[0].attrib
-                        except (TypeError, IndexError, AttributeError):
-                            log.error('Could not get child for Plex id %s'
-                                      % child.attrib['ratingKey'])
-                        else:
-                            item['children'].append(child_xml[0])
-
-            # place item into out queue
-            out_queue.put(item)
-            # Keep track of where we are at
-            with sync_info.LOCK:
-                sync_info.GET_METADATA_COUNT += 1
-            # signals to queue job is done
-            queue.task_done()
+                    items.append(queue.get(block=False))
+                except Empty:
+                    break
+            forwarded = 0
+            try:
+                # Download Metadata
+                start = time()
+                xmls = self.get_metadata(
+                    [item.itemId for item in items],
+                    dict((item.itemId, item.updatedAt) for item in items))
+                metrics.observe('sync.download', time() - start)
+                metrics.count('sync.downloaded', len(items))
+                if xmls == 401:
+                    log.error('HTTP 401 returned by PMS. Too much strain? '
+                              'Cancelling sync for now')
+                    window('plex_scancrashed', value='401')
+                    if self.abort is not None:
+                        self.abort('PMS returned 401')
+                    xmls = {}
+                for item in items:
+                    xml = xmls.get(item.itemId)
+                    if xml is None:
+                        # Did not receive a valid XML - skip that item for
+                        # now. Still pass it on, the processing thread
+                        # handles all items in turn
+                        log.error("Could not get metadata for %s. Skipping "
+                                  "that item for now" % item.itemId)
+                        item.failed = True
+                    else:
+                        item.XML = xml
+                        if item.get_children is True:
+                            self.get_children(item)
+                    forwarded += 1
+                    self.forward(item)
+            finally:
+                # The processing thread waits for every single item - pass on
+                # the ones left after an exception, without metadata
+                for item in items[forwarded:]:
+                    item.XML = item.children = None
+                    item.failed = True
+                    self.forward(item)
         # Empty queue in case PKC was shut down (main thread hangs otherwise)
         self.terminate_now()
         log.debug('Get metadata thread terminated')
+
+    def get_children(self, item):
+        """
+        Sets item.children to the list of metadata of all of item's children,
+        e.g. the songs of an album
+        """
+        children_xml = GetAllPlexChildren(item.itemId)
+        try:
+            children_xml[0].attrib
+        except (TypeError, IndexError, AttributeError):
+            log.error('Could not get children for Plex id %s' % item.itemId)
+            item.failed = True
+            return
+        keys = [child.attrib['ratingKey'] for child in children_xml]
+        xmls = self.get_metadata(
+            keys,
+            dict((child.attrib['ratingKey'],
+                  checksum(child.attrib.get('updatedAt')))
+                 for child in children_xml))
+        if xmls == 401:
+            log.error('Could not get children for Plex id %s' % item.itemId)
+            item.failed = True
+            xmls = {}
+        item.children = []
+        for key in keys:
+            try:
+                item.children.append(xmls[key][0])
+            except (KeyError, IndexError):
+                log.error('Could not get child for Plex id %s' % key)
+                item.failed = True
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+from logging import getLogger
+from zlib import compress, decompress
+from sqlite3 import Binary
+import xml.etree.ElementTree as etree
+
+from utils import kodiSQL, window, getUnixTimestamp
+from update_list import checksum
+
+###############################################################################
+
+log = getLogger("PLEX."+__name__)
+
+# Max. size of all cached (compressed) metadata in bytes
+MAX_SIZE = 200 * 1024 * 1024
+
+###############################################################################
+
+
+def create_table():
+    """
+    Run once during startup to set up the DB for Metadata_Cache
+    """
+    conn = kodiSQL('plexcache')
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS metadata(
+        server TEXT,
+        plex_id TEXT,
+        updated_at INTEGER,
+        last_used INTEGER,
+        data BLOB,
+        PRIMARY KEY (server, plex_id))
+    ''')
+    conn.commit()
+    conn.close()
+
+
+class Metadata_Cache(object):
+    """
+    On-disk cache for the metadata xmls of Plex items. One entry per Plex id,
+    only valid for exactly the updatedAt of the cached xml. Stored
+    compressed in its own DB next to the Plex DB.
+
+    Usage: with Metadata_Cache() as cache:
+               do stuff with cache
+
+    get() does not write to the DB; the last use of the entries we read is
+    only stamped by commit(). Call commit() before anything that might block
+    (e.g. downloads) - other threads can't write while we hold a write lock.
+
+    Do NOT share an instance between threads
+    """
+    def __enter__(self):
+        self.conn = kodiSQL('plexcache')
+        self.cursor = self.conn.cursor()
+        self.server = window('plex_machineIdentifier')
+        # Plex ids that get() returned since the last commit()
+        self.used = []
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.commit()
+        self.conn.close()
+
+    def commit(self):
+        """
+        Stamps the last use of the entries we read and commits
+        """
+        if self.used:
+            now = getUnixTimestamp()
+            self.cursor.executemany(
+                'UPDATE metadata SET last_used = ? '
+                'WHERE server = ? AND plex_id = ?',
+                [(now, self.server, plex_id) for plex_id in self.used])
+            self.used = []
+        self.conn.commit()
+
+    def get(self, plex_id, updated_at):
+        """
+        Returns the cached etree xml for plex_id if it was cached for the
+        same int updated_at (see update_list.checksum). None otherwise
+        """
+        if not updated_at:
+            return
+        query = '''
+            SELECT data FROM metadata
+            WHERE server = ? AND plex_id = ? AND updated_at = ?
+        '''
+        self.cursor.execute(query, (self.server, plex_id, updated_at))
+        row = self.cursor.fetchone()
+        if row is None:
+            return
+        try:
+            xml = etree.fromstring(decompress(row[0]))
+        except Exception as err:
+            log.error('Could not read cached metadata for %s: %s'
+                      % (plex_id, err))
+            return
+        self.used.append(plex_id)
+        return xml
+
+    def put(self, plex_id, xml):
+        """
+        Caches the etree xml (as received by GetPlexMetadata) for plex_id
+        """
+        try:
+            updated_at = checksum(xml[0].attrib.get('updatedAt'))
+        except IndexError:
+            return
+        if not updated_at:
+            # We could never tell whether the cached xml is up to date
+            return
+        query = '''
+            INSERT OR REPLACE INTO metadata(
+                server, plex_id, updated_at, last_used, data)
+            VALUES (?, ?, ?, ?, ?)
+        '''
+        self.cursor.execute(query, (self.server,
+                                    plex_id,
+                                    updated_at,
+                                    getUnixTimestamp(),
+                                    Binary(compress(etree.tostring(xml)))))
+
+    def evict(self, max_size=MAX_SIZE):
+        """
+        Deletes the least recently used entries until all cached metadata is
+        smaller than max_size bytes
+        """
+        self.cursor.execute('SELECT sum(length(data)) FROM metadata')
+        size = self.cursor.fetchone()[0] or 0
+        if size <= max_size:
+            return
+        log.info('Metadata cache holds %s bytes, evicting entries' % size)
+        self.cursor.execute('''
+            SELECT server, plex_id, length(data) FROM metadata
+            ORDER BY last_used
+        ''')
+        evict = []
+        for server, plex_id, length in self.cursor.fetchall():
+            if size <= max_size:
+                break
+            evict.append((server, plex_id))
+            size -= length
+        self.cursor.executemany(
+            'DELETE FROM metadata WHERE server = ? AND plex_id = ?', evict)
+        self.conn.commit()
+        log.info('Evicted %s entries from the metadata cache' % len(evict))
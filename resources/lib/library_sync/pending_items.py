@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+from heapq import heappush, heappop
+
+###############################################################################
+
+
+class Pending_Items(object):
+    """
+    Plex items the PMS told us about via websocket timeline messages that we
+    still need to process. Items are keyed by their ratingKey (only one entry
+    per Plex id) and handed out once they are due, oldest first.
+
+    Items are dicts with (at least) the keys 'ratingKey' and 'state'
+    """
+    def __init__(self):
+        # {ratingKey: item}
+        self.items = {}
+        # Heap of (due timestamp, sequence number, ratingKey)
+        self.heap = []
+        # Keeps items with identical due timestamps in insertion order
+        self.counter = 0
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, plex_id):
+        return plex_id in self.items
+
+    def add(self, item, due):
+        """
+        Adds item that we should process at unix timestamp due. Returns False
+        if an item with the same ratingKey is already pending (item is then
+        discarded), True otherwise
+        """
+        plex_id = item['ratingKey']
+        if plex_id in self.items:
+            return False
+        self.items[plex_id] = item
+        self.counter += 1
+        heappush(self.heap, (due, self.counter, plex_id))
+        return True
+
+    def pop_due(self, now):
+        """
+        Removes and returns the next item that is due at unix timestamp now.
+        Returns None if no item is due yet
+        """
+        if self.heap and self.heap[0][0] <= now:
+            return self.items.pop(heappop(self.heap)[2])
+
+    def next_due(self):
+        """
+        Returns the unix timestamp when the next item will be due or None if
+        there are no items
+        """
+        if self.heap:
+            return self.heap[0][0]
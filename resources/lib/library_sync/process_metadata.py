@@ -2,12 +2,16 @@
 from logging import getLogger
 from threading import Thread
 from Queue import Empty
+from heapq import heappush, heappop
+from time import time
 
 from xbmc import sleep
 
 from utils import thread_methods
 import itemtypes
 import sync_info
+import metrics
+from update_list import Sync_Job
 
 ###############################################################################
 log = getLogger("PLEX."+__name__)
@@ -18,19 +22,30 @@ log = getLogger("PLEX."+__name__)
 @thread_methods(add_stops=['SUSPEND_LIBRARY_THREAD'])
 class Threaded_Process_Metadata(Thread):
     """
-    Not yet implemented for more than 1 thread - if ever. Only to be called by
-    ONE thread!
-    Processes the XML metadata in the queue
+    The one and only thread writing the XML metadata to the Kodi and Plex DBs
+    - SQLite does not allow several writers. Only to be called by ONE thread!
+    Commits every itemtypes.COMMIT_INTERVAL items
+
+    Items (update_list.Update_Item) and jobs (update_list.Sync_Job) are
+    processed strictly in the order of their sequence number, starting with 0
+    - no matter in which order the download threads deliver them. E.g. a TV
+    show is always written before its seasons
 
     Input:
-        queue:      Queue.Queue() object that you'll need to fill up with
-                    the downloaded XML eTree objects
-        item_type:  as used to call functions in itemtypes.py e.g. 'Movies' =>
-                    itemtypes.Movies()
+        queue:      utils.Worker_Queue() object that you'll need to fill up
+                    with the items (with downloaded XML eTree objects) and
+                    jobs
+        callback:   Optional function called with every item and job once
+                    it has been processed
+        abort:      Optional function called with the reason if this thread
+                    crashed
     """
-    def __init__(self, queue, item_type):
+    def __init__(self, queue, callback=None, abort=None):
         self.queue = queue
-        self.item_type = item_type
+        self.callback = callback
+        self.abort = abort
+        # itemtypes class instance, e.g. itemtypes.Movies(), with open DBs
+        self.item_class = None
         Thread.__init__(self)
 
     def terminate_now(self):
@@ -58,45 +73,100 @@ class Threaded_Process_Metadata(Thread):
             log.error('Exception %s' % e)
             import traceback
             log.error("Traceback:\n%s" % traceback.format_exc())
+            if self.abort is not None:
+                self.abort('Processing thread crashed')
+        finally:
+            self.close_item_class()
+
+    def open_item_class(self, item_type):
+        """
+        Makes sure self.item_class is an instance of itemtypes.<item_type>
+        with open DB connections
+        """
+        if (self.item_class is not None and
+                self.item_class.__class__.__name__ == item_type):
+            return
+        self.close_item_class()
+        self.item_class = getattr(itemtypes, item_type)(cache_ids=True)
+        self.item_class.__enter__()
+
+    def close_item_class(self):
+        """
+        Commits and closes the DB connections of self.item_class, if any
+        """
+        if self.item_class is not None:
+            self.item_class.__exit__(None, None, None)
+            self.item_class = None
 
     def __run(self):
         """
         Do the work
         """
         log.debug('Processing thread started')
-        # Constructs the method name, e.g. itemtypes.Movies
-        item_fct = getattr(itemtypes, self.item_type)
         # cache local variables because it's faster
         queue = self.queue
+        callback = self.callback
         thread_stopped = self.thread_stopped
-        with item_fct() as item_class:
-            while thread_stopped() is False:
+        # Heap of (sequence, item) that arrived before it was their turn
+        waiting = []
+        next_sequence = 0
+        processed = 0
+        while thread_stopped() is False:
+            if not waiting or waiting[0][0] != next_sequence:
                 # grabs item from queue
+                item = queue.get_or_stop(thread_stopped)
+                if item is None:
+                    break
+                heappush(waiting, (item.sequence, item))
+                continue
+            item = heappop(waiting)[1]
+            next_sequence += 1
+            if isinstance(item, Sync_Job):
+                # Jobs open their own DB connections - which would be locked
+                # by ours
+                self.close_item_class()
                 try:
-                    item = queue.get(block=False)
-                except Empty:
-                    sleep(20)
-                    continue
+                    item.run()
+                except Exception as e:
+                    log.error('Sync job %s failed: %s' % (item, e))
+                    import traceback
+                    log.error("Traceback:\n%s" % traceback.format_exc())
+            elif item.XML is not None:
                 # Do the work
-                item_method = getattr(item_class, item['method'])
-                if item.get('children') is not None:
-                    item_method(item['XML'][0],
-                                viewtag=item['viewName'],
-                                viewid=item['viewId'],
-                                children=item['children'])
+                start = time()
+                self.open_item_class(item.itemType)
+                item_method = getattr(self.item_class, item.method)
+                if item.children is not None:
+                    written = item_method(item.XML[0],
+                                          viewtag=item.viewName,
+                                          viewid=item.viewId,
+                                          children=item.children)
                 else:
-                    item_method(item['XML'][0],
-                                viewtag=item['viewName'],
-                                viewid=item['viewId'])
+                    written = item_method(item.XML[0],
+                                          viewtag=item.viewName,
+                                          viewid=item.viewId)
+                if written is not True:
+                    # itemtypes' CatchExceptions swallows exceptions. Make
+                    # sure we'll try again, see Sync_Pipeline.failed_items
+                    log.error('Could not write %s %s to the DBs'
+                              % (item.mediaType, item.itemId))
+                    item.failed = True
+                processed += 1
+                if processed % itemtypes.COMMIT_INTERVAL == 0:
+                    # Don't lock Kodi out of its DB for the entire sync
+                    self.item_class.commit()
+                metrics.observe('sync.write', time() - start)
+                metrics.count('sync.written')
+            if not isinstance(item, Sync_Job):
                 # Keep track of where we are at
-                try:
-                    log.debug('found child: %s'
-                              % item['children'].attrib)
-                except:
-                    pass
                 with sync_info.LOCK:
                     sync_info.PROCESS_METADATA_COUNT += 1
-                    sync_info.PROCESSING_VIEW_NAME = item['title']
-                queue.task_done()
+                    sync_info.PROCESSING_ITEM_TYPE = item.itemType
+                    sync_info.PROCESSING_VIEW_NAME = item.title
+                # Free the memory right away
+                item.XML = item.children = None
+            if callback is not None:
+                callback(item)
+            queue.task_done()
         self.terminate_now()
         log.debug('Processing thread terminated')
@@ -10,27 +10,45 @@ from utils import thread_methods, language as lang
 
 log = getLogger("PLEX."+__name__)
 
+# Progress of the entire sync. Only access while holding LOCK
+# Number of items handed to the sync pipeline - grows while we're still
+# looking for items on the PMS
+TOTAL_COUNT = 0
 GET_METADATA_COUNT = 0
 PROCESS_METADATA_COUNT = 0
+# itemType (e.g. 'Movies') and title of the item processed last
+PROCESSING_ITEM_TYPE = ''
 PROCESSING_VIEW_NAME = ''
 LOCK = Lock()
 
 ###############################################################################
 
 
+def reset():
+    """
+    Resets all counters, e.g. before starting a new sync
+    """
+    global TOTAL_COUNT, GET_METADATA_COUNT, PROCESS_METADATA_COUNT
+    global PROCESSING_ITEM_TYPE, PROCESSING_VIEW_NAME
+    with LOCK:
+        TOTAL_COUNT = 0
+        GET_METADATA_COUNT = 0
+        PROCESS_METADATA_COUNT = 0
+        PROCESSING_ITEM_TYPE = ''
+        PROCESSING_VIEW_NAME = ''
+
+
 @thread_methods(add_stops=['SUSPEND_LIBRARY_THREAD'])
 class Threaded_Show_Sync_Info(Thread):
     """
-    Threaded class to show the Kodi statusbar of the metadata download.
+    Threaded class to show the Kodi statusbar of the metadata download and
+    processing of the entire sync, see the counters of this module
 
     Input:
         dialog       xbmcgui.DialogProgressBG() object to show progress
-        total:       Total number of items to get
     """
-    def __init__(self, dialog, total, item_type):
-        self.total = total
+    def __init__(self, dialog):
         self.dialog = dialog
-        self.item_type = item_type
         Thread.__init__(self)
 
     def run(self):
@@ -50,25 +68,25 @@ class Threaded_Show_Sync_Info(Thread):
         """
         log.debug('Show sync info thread started')
         # cache local variables because it's faster
-        total = self.total
         dialog = self.dialog
         thread_stopped = self.thread_stopped
-        dialog.create("%s %s: %s %s"
-                      % (lang(39714), self.item_type, str(total), lang(39715)))
-
-        total = 2 * total
-        totalProgress = 0
+        dialog.create(lang(39714))
         while thread_stopped() is False:
             with LOCK:
+                total = TOTAL_COUNT
                 get_progress = GET_METADATA_COUNT
                 process_progress = PROCESS_METADATA_COUNT
+                item_type = PROCESSING_ITEM_TYPE
                 viewName = PROCESSING_VIEW_NAME
             totalProgress = get_progress + process_progress
             try:
-                percentage = int(float(totalProgress) / float(total)*100.0)
+                percentage = int(float(totalProgress) / float(2 * total)*100.0)
             except ZeroDivisionError:
                 percentage = 0
             dialog.update(percentage,
+                          heading="%s %s: %s %s"
+                                  % (lang(39714), item_type, total,
+                                     lang(39715)),
                           message="%s %s. %s %s: %s"
                                   % (get_progress,
                                      lang(39712),
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+from logging import getLogger
+from threading import Condition
+
+import xbmcgui
+
+from get_metadata import Threaded_Get_Metadata
+from process_metadata import Threaded_Process_Metadata
+from update_list import Sync_Job
+from utils import Worker_Queue, register_waiter
+import sync_info
+import metrics
+
+###############################################################################
+
+log = getLogger("PLEX."+__name__)
+
+# Max. number of items and jobs in the pipeline that have not yet been
+# processed. Limits the memory used for downloaded metadata
+MAX_IN_FLIGHT = 500
+
+###############################################################################
+
+
+class Sync_Pipeline(object):
+    """
+    The download and processing threads of an entire full sync.
+    Started once, then fed with all the items of all media types while we're
+    still looking for more items on the PMS - instead of waiting for every
+    media type to be downloaded and written to the DBs before looking at the
+    next one.
+
+    Everything is written to the DBs in the order it was put() or call()ed,
+    see Threaded_Process_Metadata. Progress is tracked in sync_info.
+
+    Usage:
+        pipeline = Sync_Pipeline(...)
+        pipeline.start()
+        pipeline.put(item)
+        pipeline.call(function, arg1, arg2)
+        pipeline.join()
+        pipeline.stop()
+
+    put(), call() and join() return False once the pipeline failed: if a
+    thread crashed or the sync was aborted, e.g. because the PMS returned 401.
+    failed_items is the dict {viewId: list of the Plex ids of the view's
+    items that could not be synced}.
+
+    Input:
+        thread_number       Number of download threads
+        batch_size          see Threaded_Get_Metadata
+        use_cache           see Threaded_Get_Metadata
+        callback            Optional function called with every item (not
+                            jobs) once it has been processed
+        show_progress       Show a Kodi statusbar with the sync progress
+    """
+    def __init__(self, thread_number, batch_size, use_cache, callback=None,
+                 show_progress=False):
+        self.thread_number = thread_number
+        self.batch_size = batch_size
+        self.use_cache = use_cache
+        self.callback = callback
+        self.show_progress = show_progress
+        self.get_queue = Worker_Queue()
+        self.process_queue = Worker_Queue(maxsize=100)
+        self.threads = []
+        # The download and processing threads - all of them need to be
+        # alive, otherwise items get stuck
+        self.workers = []
+        self.processor = None
+        self.aborted = False
+        self.failed_items = {}
+        # Number of items and jobs put into resp. processed by the pipeline
+        self.submitted = 0
+        self.processed = 0
+        self.condition = Condition()
+        # Wake up put() and join() if the sync threads should stop
+        register_waiter(self)
+
+    def start(self):
+        """
+        Spawns all threads
+        """
+        log.info("Starting sync threads")
+        sync_info.reset()
+        for i in range(self.thread_number):
+            thread = Threaded_Get_Metadata(self.get_queue,
+                                           self.process_queue,
+                                           batch_size=self.batch_size,
+                                           use_cache=self.use_cache,
+                                           abort=self.abort)
+            thread.setDaemon(True)
+            thread.start()
+            self.threads.append(thread)
+        log.info("%s download threads spawned" % self.thread_number)
+        # Spawn one more thread to write the parsed Metadata to the DBs
+        self.processor = Threaded_Process_Metadata(self.process_queue,
+                                                   callback=self.__processed,
+                                                   abort=self.abort)
+        self.processor.setDaemon(True)
+        self.processor.start()
+        self.threads.append(self.processor)
+        self.workers = list(self.threads)
+        if self.show_progress is True:
+            thread = sync_info.Threaded_Show_Sync_Info(
+                xbmcgui.DialogProgressBG())
+            thread.setDaemon(True)
+            thread.start()
+            self.threads.append(thread)
+        metrics.gauge('queue.get_metadata', self.get_queue.qsize)
+        metrics.gauge('queue.process_metadata', self.process_queue.qsize)
+        metrics.gauge('sync.in_flight', self.__in_flight)
+
+    def __in_flight(self):
+        return self.submitted - self.processed
+
+    def abort(self, reason):
+        """
+        Cancels the sync: stops all threads without waiting for them. Thread
+        safe
+        """
+        log.error('Aborting sync: %s' % reason)
+        self.aborted = True
+        for thread in self.threads:
+            thread.stop_thread()
+        self.wake_up()
+
+    def wake_up(self):
+        """
+        Wakes up the threads waiting in put(), call() or join(). Called by
+        utils.wake_up_threads(), e.g. if the sync threads should stop
+        """
+        with self.condition:
+            self.condition.notify_all()
+
+    def failed(self):
+        """
+        Returns True if the sync was aborted or if one of our threads died or
+        should stop, e.g. because PKC is shutting down
+        """
+        if self.aborted is True:
+            return True
+        for thread in self.workers:
+            if thread.thread_stopped():
+                log.info('Sync thread %s stopped' % thread)
+                return True
+            if not thread.is_alive():
+                log.error('Sync thread %s died' % thread)
+                return True
+        return False
+
+    def put(self, item):
+        """
+        Adds the update_list.Update_Item item to be downloaded and processed.
+        Blocks while MAX_IN_FLIGHT items are waiting to be processed. Returns
+        False if the pipeline was shut down, True otherwise
+        """
+        if self.__enqueue(item) is False:
+            return False
+        with sync_info.LOCK:
+            sync_info.TOTAL_COUNT += 1
+        metrics.count('sync.enumerated')
+        self.get_queue.put(item)
+        return True
+
+    def call(self, function, *args):
+        """
+        Calls function(*args) from the processing thread once all items and
+        jobs added before have been processed, e.g. to delete items from the
+        DBs. function will need to open its own DB connections. Returns False
+        if the pipeline was shut down, True otherwise
+        """
+        job = Sync_Job(function, args)
+        if self.__enqueue(job) is False:
+            return False
+        self.process_queue.put(job)
+        return True
+
+    def __enqueue(self, item):
+        """
+        Waits for a free slot and sets item.sequence
+        """
+        with self.condition:
+            while self.submitted - self.processed >= MAX_IN_FLIGHT:
+                if self.failed():
+                    return False
+                self.condition.wait()
+            if self.failed():
+                return False
+            item.sequence = self.submitted
+            self.submitted += 1
+
+    def __processed(self, item):
+        """
+        Called by the processing thread for every item and job
+        """
+        with self.condition:
+            self.processed += 1
+            self.condition.notify_all()
+        if not isinstance(item, Sync_Job) and item.failed is True:
+            self.failed_items.setdefault(item.viewId, []).append(item.itemId)
+        if self.callback is not None and not isinstance(item, Sync_Job):
+            self.callback(item)
+
+    def join(self):
+        """
+        Waits until everything has been processed. Returns False if the
+        pipeline was shut down before, True otherwise. The threads keep
+        running; you may put() more items afterwards
+        """
+        with self.condition:
+            while self.processed < self.submitted:
+                if self.failed():
+                    # Don't wait for items that will never arrive
+                    self.abort('Sync pipeline failed')
+                    return False
+                self.condition.wait()
+            if self.aborted is True:
+                return False
+        log.info('Sync pipeline processed %s items and jobs'
+                 % self.processed)
+        return True
+
+    def stop(self):
+        """
+        Stops all threads and waits for them to terminate
+        """
+        log.info("Waiting to kill threads")
+        for name in ('queue.get_metadata', 'queue.process_metadata',
+                     'sync.in_flight'):
+            metrics.gauge(name)
+        for thread in self.threads:
+            thread.stop_thread()
+        log.debug("Stop sent to all threads")
+        for thread in self.threads:
+            thread.join(1.0)
+        log.info("Sync threads finished")
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+Compact records for the (potentially huge) list of Plex items to sync - we
+might need to keep hundreds of thousands of them in memory
+"""
+###############################################################################
+
+
+class View(object):
+    """
+    Info shared by all items of one Plex library section (view) that are
+    processed the same way. Create once and pass to all the view's
+    Update_Items
+    """
+    __slots__ = ('itemType', 'method', 'viewName', 'viewId', 'get_children')
+
+    def __init__(self, itemType, method, viewName, viewId, get_children):
+        self.itemType = itemType
+        self.method = method
+        self.viewName = viewName
+        self.viewId = viewId
+        self.get_children = get_children
+
+
+class Update_Item(object):
+    """
+    One Plex item to be synced. updatedAt is the int checksum() of the item as
+    listed by the PMS. Attributes set later during sync:
+        sequence:   position in the sync pipeline, see sync_pipeline
+        XML:        xml metadata as downloaded from the PMS (None if the
+                    download failed)
+        children:   list of the children's xml metadata (if get_children)
+        failed:     True if (some of) the item's metadata could not be
+                    downloaded
+    """
+    __slots__ = ('itemId', 'view', 'title', 'mediaType', 'updatedAt',
+                 'sequence', 'XML', 'children', 'failed')
+
+    def __init__(self, itemId, view, title, mediaType, updatedAt):
+        self.itemId = itemId
+        self.view = view
+        self.title = title
+        self.updatedAt = updatedAt
+        # Only a handful of different types - keep one copy of each
+        self.mediaType = intern(mediaType) if mediaType else mediaType
+        self.sequence = None
+        self.XML = None
+        self.children = None
+        self.failed = False
+
+    def __repr__(self):
+        return ('<Update_Item %s %s: %s>'
+                % (self.mediaType, self.itemId, self.title)).encode('utf-8')
+
+    @property
+    def itemType(self):
+        return self.view.itemType
+
+    @property
+    def method(self):
+        return self.view.method
+
+    @property
+    def viewName(self):
+        return self.view.viewName
+
+    @property
+    def viewId(self):
+        return self.view.viewId
+
+    @property
+    def get_children(self):
+        return self.view.get_children
+
+
+class Sync_Job(object):
+    """
+    A function call that the sync pipeline runs in turn with the Update_Items,
+    e.g. to delete items or to update playstates once all items before it have
+    been written to the DBs. Calls function(*args)
+    """
+    __slots__ = ('function', 'args', 'title', 'sequence')
+
+    def __init__(self, function, args):
+        self.function = function
+        self.args = args
+        self.title = function.__name__
+        self.sequence = None
+
+    def __repr__(self):
+        return '<Sync_Job %s>' % self.title
+
+    def run(self):
+        self.function(*self.args)
+
+
+def checksum(updatedAt):
+    """
+    Returns the int we use to compare Plex items: the item's updatedAt or 0
+    if the PMS did not tell us
+    """
+    try:
+        return int(updatedAt)
+    except (TypeError, ValueError):
+        return 0
@@ -2,8 +2,8 @@
 ###############################################################################
 import logging
 from threading import Thread
-import Queue
 from random import shuffle
+from time import time
 
 import xbmc
 import xbmcgui
@@ -12,7 +12,8 @@ from xbmcvfs import exists
 from utils import window, settings, getUnixTimestamp, sourcesXML,\
     thread_methods, create_actor_db_index, dialog, LogTime, getScreensaver,\
     setScreensaver, playlistXSP, language as lang, DateToKodi, reset,\
-    tryDecode, deletePlaylists, deleteNodes, tryEncode, compare_version
+    tryDecode, deletePlaylists, deleteNodes, tryEncode, compare_version,\
+    Worker_Queue
 import downloadutils
 import itemtypes
 import plexdb_functions as plexdb
@@ -22,14 +23,21 @@ import videonodes
 import variables as v
 
 from PlexFunctions import GetPlexMetadata, GetAllPlexLeaves, scrobble, \
-    GetPlexSectionResults, GetAllPlexChildren, GetPMSStatus, get_plex_sections
+    GetPlexSectionResults, GetAllPlexChildren, GetPMSStatus, \
+    get_plex_sections, GetPlexMetadataForItems, GetPlexSectionSize
 import PlexAPI
-from library_sync.get_metadata import Threaded_Get_Metadata
-from library_sync.process_metadata import Threaded_Process_Metadata
-import library_sync.sync_info as sync_info
+from library_sync.sync_pipeline import Sync_Pipeline
+from library_sync.update_list import View, Update_Item, checksum
+from library_sync.checksum_diff import Checksum_Diff
+import library_sync.metadata_cache as metadata_cache
+import web_cache
 from library_sync.fanart import Process_Fanart_Thread
+from library_sync.pending_items import Pending_Items
+from library_sync.fetch_pool import fetch_concurrently
+from migration import migrate_plex_table, migrate_view_table
 import music
 import state
+import metrics
 
 
 REMOTE_DBG = False
@@ -52,6 +60,13 @@ if REMOTE_DBG:
 
 log = logging.getLogger("PLEX."+__name__)
 
+# Incremental syncs look at items updated up to this many seconds before the
+# last sync started - just in case our Kodi-PMS time offset is off
+INCREMENTAL_SYNC_OVERLAP = 10*60
+# Incremental syncs only see items viewed since the last sync - not the ones
+# marked unwatched. Update all playstates at least every so many seconds
+FULL_PLAYSTATE_INTERVAL = 6*60*60
+
 ###############################################################################
 
 
@@ -68,21 +83,37 @@ class LibrarySync(Thread):
         self.just_processed = {}
         # How long do we wait until we start re-processing? (in seconds)
         self.ignore_just_processed = 10*60
-        self.itemsToProcess = []
+        self.itemsToProcess = Pending_Items()
+        # Unix timestamp when the thread waiting for PMS messages will be
+        # woken up next, see schedule_wake_up()
+        self.wake_up_time = None
         self.sessionKeys = []
-        self.fanartqueue = Queue.Queue()
+        self.fanartqueue = Worker_Queue()
+        # library_sync.sync_pipeline.Sync_Pipeline() during full syncs
+        self.pipeline = None
         if settings('FanartTV') == 'true':
             self.fanartthread = Process_Fanart_Thread(self.fanartqueue)
         # How long should we wait at least to process new/changed PMS items?
         self.saftyMargin = int(settings('backgroundsync_saftyMargin'))
 
         self.fullSyncInterval = int(settings('fullSyncInterval')) * 60
+        self.incrementalSync = settings('incrementalSync') == 'true'
+        # Incremental sync: {view_id: PMS timestamp of the last sync}
+        self.incremental = False
+        self.sync_marks = {}
+        # Unix timestamp of the last sync that updated all playstates
+        self.last_playstate_sync = 0
+        # Update all playstates during this incremental sync
+        self.full_playstates = False
+        # Full sync: {view_id: list of the urls and Plex ids that failed}
+        self.sync_errors = {}
 
         self.user = userclient.UserClient()
         self.vnodes = videonodes.VideoNodes()
         self.dialog = xbmcgui.Dialog()
 
         self.syncThreadNumber = int(settings('syncThreadNumber'))
+        self.syncMetadataBatchSize = int(settings('syncMetadataBatchSize'))
         self.installSyncDone = settings('SyncInstallRunDone') == 'true'
         window('dbSyncIndicator', value=settings('dbSyncIndicator'))
         self.enableMusic = settings('enableMusic') == "true"
@@ -237,65 +268,106 @@ class LibrarySync(Thread):
         Run once during startup to verify that plex db exists.
         """
         with plexdb.Get_Plex_DB() as plex_db:
+            # Tables of older PKC versions
+            migrate_plex_table(plex_db.plexcursor)
+            migrate_view_table(plex_db.plexcursor)
             # Create the tables for the plex database
-            plex_db.plexcursor.execute('''
-                CREATE TABLE IF NOT EXISTS plex(
-                plex_id TEXT UNIQUE,
-                view_id TEXT,
-                plex_type TEXT,
-                kodi_type TEXT,
-                kodi_id INTEGER,
-                kodi_fileid INTEGER,
-                kodi_pathid INTEGER,
-                parent_id INTEGER,
-                checksum INTEGER,
-                fanart_synced INTEGER)
-            ''')
+            plex_db.plexcursor.execute(plexdb.PLEX_TABLE)
+            for query in plexdb.PLEX_INDEXES:
+                plex_db.plexcursor.execute(query)
             plex_db.plexcursor.execute('''
                 CREATE TABLE IF NOT EXISTS view(
                 view_id TEXT UNIQUE,
                 view_name TEXT,
                 kodi_type TEXT,
                 kodi_tagid INTEGER,
-                sync_to_kodi INTEGER)
+                sync_to_kodi INTEGER,
+                last_sync INTEGER)
             ''')
             plex_db.plexcursor.execute('''
                 CREATE TABLE IF NOT EXISTS version(idVersion TEXT)
             ''')
+        # Create the DB for cached Plex metadata
+        metadata_cache.create_table()
+        # ... and cached answers of themoviedb.org and fanart.tv
+        web_cache.create_table()
         # Create an index for actors to speed up sync
         create_actor_db_index()
 
     @LogTime
-    def fullSync(self, repair=False):
+    def fullSync(self, repair=False, incremental=False):
         """
         repair=True: force sync EVERY item
+        incremental=True: only look at PMS items updated since the last sync
+            of their library, playstates of items viewed since then. Deleted
+            items are only searched for if the PMS' item counts don't add up
         """
-        # self.compare == False: we're syncing EVERY item
-        # True: we're syncing only the delta, e.g. different checksum
-        self.compare = not repair
-
-        # Empty our list of item's we've just processed in the past
-        self.just_processed = {}
-
-        self.new_items_only = True
-        # This will also update playstates and userratings!
-        log.info('Running fullsync for NEW PMS items with repair=%s' % repair)
-        if self._fullSync() is False:
-            return False
-        self.new_items_only = False
-        # This will NOT update playstates and userratings!
-        log.info('Running fullsync for CHANGED PMS items with repair=%s'
-                 % repair)
-        if self._fullSync() is False:
-            return False
-        return True
+        metrics.reset()
+        try:
+            # self.compare == False: we're syncing EVERY item
+            # True: we're syncing only the delta, e.g. different checksum
+            self.compare = not repair
+            self.incremental = incremental and not repair
+
+            # Empty our list of item's we've just processed in the past
+            self.just_processed = {}
+            self.sync_errors = {}
+
+            # PMS time of this sync's start
+            sync_start = (getUnixTimestamp() - self.timeoffset -
+                          INCREMENTAL_SYNC_OVERLAP)
+            start = getUnixTimestamp()
+            if self.incremental is True:
+                with plexdb.Get_Plex_DB() as plex_db:
+                    self.sync_marks = plex_db.get_sync_marks()
+                self.new_items_only = False
+                self.full_playstates = (start - self.last_playstate_sync >
+                                        FULL_PLAYSTATE_INTERVAL)
+                log.info('Running incremental fullsync for PMS items updated '
+                         'since: %s' % self.sync_marks)
+                if self._fullSync() is False:
+                    return False
+            else:
+                self.new_items_only = True
+                # This will also update playstates and userratings!
+                log.info('Running fullsync for NEW PMS items with repair=%s'
+                         % repair)
+                if self._fullSync() is False:
+                    return False
+                self.new_items_only = False
+                # This will NOT update playstates and userratings!
+                log.info('Running fullsync for CHANGED PMS items with '
+                         'repair=%s' % repair)
+                if self._fullSync() is False:
+                    return False
+            # Next incremental sync can start from here - except for views
+            # we did not entirely sync
+            with plexdb.Get_Plex_DB() as plex_db:
+                for view in self.views:
+                    if self.sync_errors.get(view['id']):
+                        log.warn('Not all items of view %s could be synced, '
+                                 'keeping its last sync mark. Failed: %s'
+                                 % (view['name'],
+                                    self.sync_errors[view['id']][:10]))
+                        continue
+                    plex_db.set_sync_mark(view['id'], sync_start)
+            if self.incremental is False or self.full_playstates is True:
+                self.last_playstate_sync = start
+            with metadata_cache.Metadata_Cache() as cache:
+                cache.evict()
+            return True
+        finally:
+            # Final numbers of this sync
+            if metrics.ENABLED is True:
+                log.info('Sync metrics: %s' % metrics.summary())
+                metrics.publish(to_file=True)
 
     def _fullSync(self):
         xbmc.executebuiltin('InhibitIdleShutdown(true)')
         screensaver = getScreensaver()
         setScreensaver(value="")
 
-        if self.new_items_only is True:
+        if self.new_items_only is True or self.incremental is True:
             # Only do the following once for new items
             # Add sources
             sourcesXML()
@@ -306,24 +378,41 @@ class LibrarySync(Thread):
                 setScreensaver(value=screensaver)
                 return False
 
-        process = {
-            'movies': self.PlexMovies,
-            'musicvideos': self.PlexMusicVideos,
-            'tvshows': self.PlexTVShows,
-        }
+        process = [self.PlexMovies, self.PlexMusicVideos, self.PlexTVShows]
         if self.enableMusic:
-            process['music'] = self.PlexMusic
-
-        # Do the processing
-        for itemtype in process:
-            if self.thread_stopped():
-                xbmc.executebuiltin('InhibitIdleShutdown(false)')
-                setScreensaver(value=screensaver)
-                return False
-            if not process[itemtype]():
+            process.append(self.PlexMusic)
+
+        # One pipeline downloading and processing the items of all media
+        # types while we're still looking for more items on the PMS
+        self.pipeline = Sync_Pipeline(
+            self.syncThreadNumber,
+            self.syncMetadataBatchSize,
+            # Use cached metadata only if playstates are updated later on
+            self.new_items_only or not self.compare,
+            callback=self.queue_fanart,
+            # Show sync progress ONLY for new PMS items
+            show_progress=(self.new_items_only is True and
+                           window('dbSyncIndicator') == 'true'))
+        self.pipeline.start()
+        try:
+            # Do the processing
+            for method in process:
+                if (self.thread_stopped() or not method() or
+                        self.pipeline.failed()):
+                    xbmc.executebuiltin('InhibitIdleShutdown(false)')
+                    setScreensaver(value=screensaver)
+                    self.notify_scan_crashed()
+                    return False
+            if not self.pipeline.join():
                 xbmc.executebuiltin('InhibitIdleShutdown(false)')
                 setScreensaver(value=screensaver)
+                self.notify_scan_crashed()
                 return False
+        finally:
+            self.pipeline.stop()
+            for view_id, plex_ids in self.pipeline.failed_items.iteritems():
+                self.view_errors(view_id).extend(plex_ids)
+            self.pipeline = None
 
         # Let kodi update the views in any case, since we're doing a full sync
         xbmc.executebuiltin('UpdateLibrary(video)')
@@ -333,15 +422,7 @@ class LibrarySync(Thread):
         window('plex_initialScan', clear=True)
         xbmc.executebuiltin('InhibitIdleShutdown(false)')
         setScreensaver(value=screensaver)
-        if window('plex_scancrashed') == 'true':
-            # Show warning if itemtypes.py crashed at some point
-            self.dialog.ok(lang(29999), lang(39408))
-            window('plex_scancrashed', clear=True)
-        elif window('plex_scancrashed') == '401':
-            window('plex_scancrashed', clear=True)
-            if state.PMS_STATUS not in ('401', 'Auth'):
-                # Plex server had too much and returned ERROR
-                self.dialog.ok(lang(29999), lang(39409))
+        self.notify_scan_crashed()
 
         # Path hack, so Kodis Information screen works
         with kodidb.GetKodiDB('video') as kodi_db:
@@ -354,6 +435,20 @@ class LibrarySync(Thread):
         setScreensaver(value=screensaver)
         return True
 
+    def notify_scan_crashed(self):
+        """
+        Warns the user if the sync crashed or the PMS returned 401
+        """
+        if window('plex_scancrashed') == 'true':
+            # Show warning if itemtypes.py crashed at some point
+            self.dialog.ok(lang(29999), lang(39408))
+            window('plex_scancrashed', clear=True)
+        elif window('plex_scancrashed') == '401':
+            window('plex_scancrashed', clear=True)
+            if state.PMS_STATUS not in ('401', 'Auth'):
+                # Plex server had too much and returned ERROR
+                self.dialog.ok(lang(29999), lang(39409))
+
     def processView(self, folderItem, kodi_db, plex_db, totalnodes):
         vnodes = self.vnodes
         folder = folderItem.attrib
@@ -619,15 +714,17 @@ class LibrarySync(Thread):
             with itemtypes.Music() as music:
                 music.remove(item['plex_id'])
 
-    def GetUpdatelist(self, xml, itemType, method, viewName, viewId,
-                      get_children=False):
+    def GetUpdatelist(self, items, itemType, method, viewName, viewId,
+                      get_children=False, plex_ids=None, changed_ids=None):
         """
         THIS METHOD NEEDS TO BE FAST! => e.g. no API calls
 
-        Adds items to self.updatelist as well as self.allPlexElementsId dict
+        Adds the items we need to sync to self.pipeline, comparing them with
+        self.checksum_diff
 
         Input:
-            xml:                    PMS answer for section items
+            items:                  PMS section items as dicts, e.g. from
+                                    PlexFunctions.StreamChunks
             itemType:               'Movies', 'TVShows', ...
             method:                 Method name to be called with this itemtype
                                     see itemtypes.py
@@ -635,12 +732,15 @@ class LibrarySync(Thread):
             viewId:                 Id/Key of Plex library (e.g. '1')
             get_children:           will get Plex children of the item if True,
                                     e.g. for music albums
-
-        Output: self.updatelist, self.allPlexElementsId
-            self.updatelist         APPENDED(!!) list itemids (Plex Keys as
-                                    as received from API.getRatingKey())
-            One item in this list is of the form:
-                'itemId': xxx,
+            plex_ids:               Optional list; the Plex ids of all items
+                                    will be appended
+            changed_ids:            Optional list; the Plex ids of all items
+                                    we sync will be appended
+
+        Output: self.pipeline, self.checksum_diff
+            self.pipeline           gets library_sync.update_list.Update_Items
+                                    with attributes:
+                'itemId': xxx, Plex Key as received from API.getRatingKey()
                 'itemType': 'Movies','TVShows', ...
                 'method': 'add_update', 'add_updateSeason', ...
                 'viewName': xxx,
@@ -648,186 +748,167 @@ class LibrarySync(Thread):
                 'title': xxx
                 'mediaType': xxx, e.g. 'movie', 'episode'
 
-            self.allPlexElementsId      APPENDED(!!) dict
-                = {itemid: checksum}
+            self.checksum_diff      every item is marked as present on the PMS
         """
         now = getUnixTimestamp()
-        if self.new_items_only is True:
-            # Only process Plex items that Kodi does not already have in lib
-            for item in xml:
-                itemId = item.attrib.get('ratingKey')
-                if not itemId:
-                    # Skipping items 'title=All episodes' without a 'ratingKey'
-                    continue
-                self.allPlexElementsId[itemId] = ("K%s%s" %
-                    (itemId, item.attrib.get('updatedAt', '')))
-                if itemId not in self.allKodiElementsId:
-                    self.updatelist.append({
-                        'itemId': itemId,
-                        'itemType': itemType,
-                        'method': method,
-                        'viewName': viewName,
-                        'viewId': viewId,
-                        'title': item.attrib.get('title', 'Missing Title'),
-                        'mediaType': item.attrib.get('type'),
-                        'get_children': get_children
-                    })
-                    self.just_processed[itemId] = now
-            return
-
-        if self.compare:
-            # Only process the delta - new or changed items
-            for item in xml:
-                itemId = item.attrib.get('ratingKey')
-                if not itemId:
-                    # Skipping items 'title=All episodes' without a 'ratingKey'
+        view = View(itemType, method, viewName, viewId, get_children)
+        for item in items:
+            itemId = item.get('ratingKey')
+            if not itemId:
+                # Skipping items 'title=All episodes' without a 'ratingKey'
+                continue
+            if plex_ids is not None:
+                plex_ids.append(itemId)
+            plex_checksum = checksum(item.get('updatedAt'))
+            kodi_checksum = self.checksum_diff.get(itemId)
+            if self.new_items_only is True:
+                # Only process Plex items that Kodi does not already have in
+                # lib
+                if kodi_checksum is not None:
                     continue
-                plex_checksum = ("K%s%s"
-                                 % (itemId, item.attrib.get('updatedAt', '')))
-                self.allPlexElementsId[itemId] = plex_checksum
-                kodi_checksum = self.allKodiElementsId.get(itemId)
-                # Only update if movie is not in Kodi or checksum is
-                # different
-                if kodi_checksum != plex_checksum:
-                    self.updatelist.append({
-                        'itemId': itemId,
-                        'itemType': itemType,
-                        'method': method,
-                        'viewName': viewName,
-                        'viewId': viewId,
-                        'title': item.attrib.get('title', 'Missing Title'),
-                        'mediaType': item.attrib.get('type'),
-                        'get_children': get_children
-                    })
-                    self.just_processed[itemId] = now
-        else:
-            # Initial or repair sync: get all Plex movies
-            for item in xml:
-                itemId = item.attrib.get('ratingKey')
-                if not itemId:
-                    # Skipping items 'title=All episodes' without a 'ratingKey'
+            elif self.compare:
+                # Only process the delta - new or changed items
+                if kodi_checksum == plex_checksum:
                     continue
-                self.allPlexElementsId[itemId] = ("K%s%s"
-                    % (itemId, item.attrib.get('updatedAt', '')))
-                self.updatelist.append({
-                    'itemId': itemId,
-                    'itemType': itemType,
-                    'method': method,
-                    'viewName': viewName,
-                    'viewId': viewId,
-                    'title': item.attrib.get('title', 'Missing Title'),
-                    'mediaType': item.attrib.get('type'),
-                    'get_children': get_children
-                })
-                self.just_processed[itemId] = now
+            # Else initial or repair sync: get all Plex items
+            if not self.pipeline.put(Update_Item(
+                    itemId,
+                    view,
+                    item.get('title', 'Missing Title'),
+                    item.get('type'),
+                    plex_checksum)):
+                # Sync has been stopped
+                return
+            if changed_ids is not None:
+                changed_ids.append(itemId)
+            self.just_processed[itemId] = now
 
-    def GetAndProcessXMLs(self, itemType):
+    def view_errors(self, view_id):
+        """
+        Returns the list of failed downloads of view_id during this full sync,
+        to be passed to PlexFunctions as errors. The view's sync mark is not
+        advanced if this list is not empty
         """
-        Downloads all XMLs for itemType (e.g. Movies, TV-Shows). Processes them
-        by then calling itemtypes.<itemType>()
+        return self.sync_errors.setdefault(view_id, [])
 
-        Input:
-            itemType:               'Movies', 'TVShows', ...
-            self.updatelist
-            showProgress            If False, NEVER shows sync progress
+    def get_checksum_diff(self, plex_types):
         """
-        # Some logging, just in case.
-        log.debug("self.updatelist: %s" % self.updatelist)
-        itemNumber = len(self.updatelist)
-        if itemNumber == 0:
-            return
+        Returns a library_sync.checksum_diff.Checksum_Diff for plex_types
+        (empty if we're not comparing with the Plex DB)
+        """
+        if not self.compare:
+            return Checksum_Diff()
+        with plexdb.Get_Plex_DB() as plex_db:
+            return Checksum_Diff(plex_db, plex_types)
 
-        # Run through self.updatelist, get XML metadata per item
-        # Initiate threads
-        log.info("Starting sync threads")
-        getMetadataQueue = Queue.Queue()
-        processMetadataQueue = Queue.Queue(maxsize=100)
-        # To keep track
-        sync_info.GET_METADATA_COUNT = 0
-        sync_info.PROCESS_METADATA_COUNT = 0
-        sync_info.PROCESSING_VIEW_NAME = ''
-        # Populate queue: GetMetadata
-        for updateItem in self.updatelist:
-            getMetadataQueue.put(updateItem)
-        # Spawn GetMetadata threads for downloading
-        threads = []
-        for i in range(min(self.syncThreadNumber, itemNumber)):
-            thread = Threaded_Get_Metadata(getMetadataQueue,
-                                           processMetadataQueue)
-            thread.setDaemon(True)
-            thread.start()
-            threads.append(thread)
-        log.info("%s download threads spawned" % len(threads))
-        # Spawn one more thread to process Metadata, once downloaded
-        thread = Threaded_Process_Metadata(processMetadataQueue,
-                                           itemType)
-        thread.setDaemon(True)
-        thread.start()
-        threads.append(thread)
-        # Start one thread to show sync progress ONLY for new PMS items
-        if self.new_items_only is True and window('dbSyncIndicator') == 'true':
-            dialog = xbmcgui.DialogProgressBG()
-            thread = sync_info.Threaded_Show_Sync_Info(
-                dialog,
-                itemNumber,
-                itemType)
-            thread.setDaemon(True)
-            thread.start()
-            threads.append(thread)
-
-        # Wait until finished
-        getMetadataQueue.join()
-        processMetadataQueue.join()
-        # Kill threads
-        log.info("Waiting to kill threads")
-        for thread in threads:
-            # Threads might already have quit by themselves (e.g. Kodi exit)
-            try:
-                thread.stop_thread()
-            except AttributeError:
-                pass
-        log.debug("Stop sent to all threads")
-        # Wait till threads are indeed dead
-        for thread in threads:
-            try:
-                thread.join(1.0)
-            except:
-                pass
-        log.info("Sync threads finished")
+    def updated_since(self, view_id):
+        """
+        Returns the PMS unix timestamp of the last sync of view_id if we're
+        syncing incrementally. None otherwise (sync all items)
+        """
+        if self.incremental is True:
+            return self.sync_marks.get(view_id)
+
+    def viewed_since(self, view_id):
+        """
+        Returns the PMS unix timestamp to look for changed playstates from or
+        None to update all playstates, see FULL_PLAYSTATE_INTERVAL
+        """
+        if self.full_playstates is False:
+            return self.updated_since(view_id)
+
+    def get_removed(self, views, type_args):
+        """
+        Generator yielding the plex_ids of all items of self.checksum_diff
+        that are gone from the PMS.
+
+        type_args: list of the url args (or None) for GetPlexSectionResults
+        that list all our items of a view, e.g. [{'type': 2}, {'type': 3}]
+
+        Incremental syncs did not see all items yet. We only enumerate all the
+        PMS' items if the PMS' item count does not add up
+        """
+        diff = self.checksum_diff
+        if self.incremental is True:
+            pms_count = 0
+            for view in views:
+                for args in type_args:
+                    count = GetPlexSectionSize(view['id'], args)
+                    if count is None:
+                        break
+                    pms_count += count
+                else:
+                    continue
+                pms_count = None
+                break
+            if pms_count == len(diff) + diff.unknown:
+                log.debug('PMS item count unchanged, nothing was deleted')
+                return
+            log.info('PMS item count changed, looking for deleted items')
+            for view in views:
+                for args in type_args:
+                    if self.thread_stopped():
+                        # Don't delete items we did not look at
+                        return
+                    for item in GetPlexSectionResults(
+                            view['id'],
+                            args=args,
+                            stream=True,
+                            errors=self.view_errors(view['id'])):
+                        if 'ratingKey' in item:
+                            diff.get(item['ratingKey'])
+        for plex_id in diff.removed():
+            yield plex_id
+
+    def queue_fanart(self, item):
+        """
+        Called by self.pipeline for every item written to the DBs
+        """
         if (settings('FanartTV') == 'true' and
-                itemType in ('Movies', 'TVShows')):
-            for item in self.updatelist:
-                if item['mediaType'] in (v.PLEX_TYPE_MOVIE, v.PLEX_TYPE_SHOW):
-                    self.fanartqueue.put({
-                        'plex_id': item['itemId'],
-                        'plex_type': item['mediaType'],
-                        'refresh': False
-                    })
-        self.updatelist = []
+                item.itemType in ('Movies', 'TVShows') and
+                item.mediaType in (v.PLEX_TYPE_MOVIE, v.PLEX_TYPE_SHOW)):
+            self.fanartqueue.put({
+                'plex_id': item.itemId,
+                'plex_type': item.mediaType,
+                'refresh': False
+            })
+
+    def remove_items(self, itemType, plex_ids):
+        """
+        Run by self.pipeline: deletes plex_ids from the Plex and Kodi DBs
+        """
+        log.info('Deleting %s %s items that are gone from the PMS'
+                 % (len(plex_ids), itemType))
+        with getattr(itemtypes, itemType)() as item_class:
+            for plex_id in plex_ids:
+                item_class.remove(plex_id)
+
+    def process_deletes(self, itemType, views, type_args):
+        """
+        Hands all items of self.checksum_diff that are gone from the PMS to
+        self.pipeline for deletion. See get_removed()
+        """
+        plex_ids = list(self.get_removed(views, type_args))
+        for view in views:
+            if self.sync_errors.get(view['id']):
+                # Items we could not download would look deleted
+                log.warn('Not deleting any %s items, view %s is incomplete'
+                         % (itemType, view['name']))
+                return
+        if plex_ids:
+            self.pipeline.call(self.remove_items, itemType, plex_ids)
 
     @LogTime
     def PlexMovies(self):
-        # Initialize
-        self.allPlexElementsId = {}
-
         itemType = 'Movies'
 
         views = [x for x in self.views if x['itemtype'] == v.KODI_TYPE_MOVIE and 'musicvideo' not in x['name']]
         log.info("Processing Plex %s. Libraries: %s" % (itemType, views))
 
-        self.allKodiElementsId = {}
-        if self.compare:
-            with plexdb.Get_Plex_DB() as plex_db:
-                # Get movies from Plex server
-                # Pull the list of movies and boxsets in Kodi
-                try:
-                    self.allKodiElementsId = dict(
-                        plex_db.getChecksum(v.PLEX_TYPE_MOVIE))
-                except ValueError:
-                    self.allKodiElementsId = {}
+        # Pull the list of movies in Kodi
+        self.checksum_diff = self.get_checksum_diff((v.PLEX_TYPE_MOVIE, ))
 
         # PROCESS MOVIES #####
-        self.updatelist = []
         for view in views:
             if self.thread_stopped():
                 return False
@@ -835,93 +916,80 @@ class LibrarySync(Thread):
             viewId = view['id']
             viewName = view['name']
                 
-            all_plexmovies = GetPlexSectionResults(viewId, args=None)
-            if all_plexmovies is None:
-                log.info("Couldnt get section items, aborting for view.")
-                continue
-            elif all_plexmovies == 401:
-                return False
-            # Populate self.updatelist and self.allPlexElementsId
+            all_plexmovies = GetPlexSectionResults(
+                viewId,
+                stream=True,
+                updatedAt=self.updated_since(viewId),
+                errors=self.view_errors(viewId))
+            # Hand the items to self.pipeline
             self.GetUpdatelist(all_plexmovies,
                                itemType,
                                'add_update',
                                viewName,
                                viewId)
-        self.GetAndProcessXMLs(itemType)
         log.info("Processed view")
         # Update viewstate for EVERY item
         for view in views:
             if self.thread_stopped():
                 return False
-            self.PlexUpdateWatched(view['id'], itemType)
+            self.PlexUpdateWatched(
+                view['id'],
+                itemType,
+                lastViewedAt=self.viewed_since(view['id']))
 
         # PROCESS DELETES #####
         if self.compare:
             # Manual sync, process deletes
-            with itemtypes.Movies() as Movie:
-                for kodimovie in self.allKodiElementsId:
-                    if kodimovie not in self.allPlexElementsId:
-                        Movie.remove(kodimovie)
+            self.process_deletes(itemType, views, [None])
+        self.checksum_diff = None
         log.info("%s sync is finished." % itemType)
         return True
 
     @LogTime
     def PlexMusicVideos(self):
-        # Initialize
-        self.allPlexElementsId = {}
-
         itemType = 'MusicVideos'
 
         views = [x for x in self.views if x['itemtype'] == v.KODI_TYPE_MOVIE and 'musicvideo' in x['name']]
         log.info("Processing Plex %s. Libraries: %s" % (itemType, views))
 
-        self.allKodiElementsId = {}
-        if self.compare:
-            with plexdb.Get_Plex_DB() as plex_db:
-                # Get movies from Plex server
-                # Pull the list of movies and boxsets in Kodi
-                try:
-                    self.allKodiElementsId = dict(
-                        plex_db.getChecksum(v.PLEX_TYPE_MUSICVIDEO))
-                except ValueError:
-                    self.allKodiElementsId = {}
+        # Pull the list of music videos in Kodi
+        self.checksum_diff = self.get_checksum_diff(
+            (v.PLEX_TYPE_MUSICVIDEO, ))
 
         # PROCESS MUSICVIDEOS #####
-        self.updatelist = []
         for view in views:
-            if self.threadStopped():
+            if self.thread_stopped():
                 return False
             # Get items per view
             viewId = view['id']
             viewName = view['name']
                 
-            all_plexmusicvideos = GetPlexSectionResults(viewId, args=None)
-            if all_plexmusicvideos is None:
-                log.info("Couldnt get section items, aborting for view.")
-                continue
-            elif all_plexmusicvideos == 401:
-                return False
-            # Populate self.updatelist and self.allPlexElementsId
+            all_plexmusicvideos = GetPlexSectionResults(
+                viewId,
+                stream=True,
+                updatedAt=self.updated_since(viewId),
+                errors=self.view_errors(viewId))
+            # Hand the items to self.pipeline
             self.GetUpdatelist(all_plexmusicvideos,
                                itemType,
                                'add_update',
                                viewName,
                                viewId)
-        self.GetAndProcessXMLs(itemType)
         log.info("Processed view")
         # Update viewstate for EVERY item
         for view in views:
-            if self.threadStopped():
+            if self.thread_stopped():
                 return False
-            self.PlexUpdateWatched(view['id'], itemType)
+            self.PlexUpdateWatched(
+                view['id'],
+                itemType,
+                lastViewedAt=self.viewed_since(view['id']))
 
         # PROCESS DELETES #####
         if self.compare:
             # Manual sync, process deletes
-            with itemtypes.MusicVideos() as MusicVideo:
-                for kodimusicvideo in self.allKodiElementsId:
-                    if kodimusicvideo not in self.allPlexElementsId:
-                        MusicVideo.remove(kodimusicvideo)
+            self.process_deletes(itemType, views, [None])
+        self.checksum_diff = None
         log.info("%s sync is finished." % itemType)
         return True
 
@@ -931,22 +999,30 @@ class LibrarySync(Thread):
         """
         Updates plex elements' view status ('watched' or 'unwatched') and
         also updates resume times.
-        This is done by downloading one XML for ALL elements with viewId
+        This is done by downloading one XML for ALL elements with viewId.
+        The DBs are updated by self.pipeline once all items handed to it
+        before have been processed
         """
-        if self.new_items_only is False:
+        if (self.new_items_only is False and self.compare is True and
+                self.incremental is False):
             # Only do this once for fullsync: the first run where new items are
-            # added to Kodi
+            # added to Kodi. Repair syncs might have used cached metadata with
+            # outdated playstates
             return
         xml = GetAllPlexLeaves(viewId,
                                lastViewedAt=lastViewedAt,
-                               updatedAt=updatedAt)
-        # Return if there are no items in PMS reply - it's faster
+                               updatedAt=updatedAt,
+                               errors=self.view_errors(viewId))
         try:
-            xml[0].attrib
-        except (TypeError, AttributeError, IndexError):
+            xml.attrib
+        except AttributeError:
             log.error('Error updating watch status. Could not get viewId: '
                       '%s of itemType %s with lastViewedAt: %s, updatedAt: '
                       '%s' % (viewId, itemType, lastViewedAt, updatedAt))
+            self.view_errors(viewId).append('playstates')
+            return
+        # Return if there are no items in PMS reply - it's faster
+        if len(xml) == 0:
             return
 
         if itemType in ('Movies', 'MusicVideos', 'TVShows'):
@@ -954,86 +1030,119 @@ class LibrarySync(Thread):
         elif itemType in ('Music'):
             self.updateKodiMusicLib = True
 
+        self.pipeline.call(self.update_userdata, itemType, xml)
+
+    @staticmethod
+    def update_userdata(itemType, xml):
+        """
+        Run by self.pipeline: writes the playstates of xml to the DBs
+        """
         itemMth = getattr(itemtypes, itemType)
         with itemMth() as method:
             method.updateUserdata(xml)
 
+    @staticmethod
+    def get_show_artwork(plex_id):
+        """
+        Returns the artwork of the TV show with plex_id as returned by
+        PlexAPI.API.getAllArtwork() or None if we could not download it
+        """
+        xml = GetPlexMetadata(plex_id)
+        if xml is None or xml == 401:
+            log.error('Could not download XMLtvshow')
+            return
+        return PlexAPI.API(xml[0]).getAllArtwork()
+
+    @staticmethod
+    def refresh_season_entries(artworks):
+        """
+        Run by self.pipeline: refreshes the season info of the TV shows, pass
+        a list of tuples (Plex id, TV show artwork)
+        """
+        with itemtypes.TVShows() as TVshow:
+            for tvShowId, artwork in artworks:
+                TVshow.refreshSeasonEntry(tvShowId, artwork)
+        log.debug("Season info refreshed")
+
     @LogTime
     def PlexTVShows(self):
-        # Initialize
-        self.allPlexElementsId = {}
         itemType = 'TVShows'
 
         views = [x for x in self.views if x['itemtype'] == 'show']
         log.info("Media folders for %s: %s" % (itemType, views))
 
-        self.allKodiElementsId = {}
-        if self.compare:
-            with plexdb.Get_Plex_DB() as plex:
-                # Pull the list of TV shows already in Kodi
-                for kind in (v.PLEX_TYPE_SHOW,
-                             v.PLEX_TYPE_SEASON,
-                             v.PLEX_TYPE_EPISODE):
-                    try:
-                        elements = dict(plex.getChecksum(kind))
-                        self.allKodiElementsId.update(elements)
-                    # Yet empty/not yet synched
-                    except ValueError:
-                        pass
+        # Pull the list of TV shows already in Kodi
+        self.checksum_diff = self.get_checksum_diff((v.PLEX_TYPE_SHOW,
+                                                     v.PLEX_TYPE_SEASON,
+                                                     v.PLEX_TYPE_EPISODE))
+        # List of tuples (view, Plex id) for all TV shows
+        allPlexTvShowsId = []
+        # Only new or changed TV shows need their season info refreshed
+        changed_shows = []
 
         # PROCESS TV Shows #####
-        self.updatelist = []
         for view in views:
             if self.thread_stopped():
                 return False
             # Get items per view
             viewId = view['id']
             viewName = view['name']
-            allPlexTvShows = GetPlexSectionResults(viewId)
-            if allPlexTvShows is None:
-                log.error("Error downloading show xml for view %s" % viewId)
-                continue
-            elif allPlexTvShows == 401:
-                return False
-            # Populate self.updatelist and self.allPlexElementsId
+            allPlexTvShows = GetPlexSectionResults(
+                viewId,
+                stream=True,
+                updatedAt=self.updated_since(viewId),
+                errors=self.view_errors(viewId))
+            # Hand the items to self.pipeline, populate allPlexTvShowsId
+            show_ids = []
             self.GetUpdatelist(allPlexTvShows,
                                itemType,
                                'add_update',
                                viewName,
-                               viewId)
+                               viewId,
+                               plex_ids=show_ids,
+                               changed_ids=changed_shows)
+            allPlexTvShowsId.extend((view, show_id) for show_id in show_ids)
             log.debug("Analyzed view %s with ID %s" % (viewName, viewId))
 
-        # COPY for later use
-        allPlexTvShowsId = self.allPlexElementsId.copy()
-
-        # Process self.updatelist
-        self.GetAndProcessXMLs(itemType)
-        log.debug("GetAndProcessXMLs completed for tv shows")
-
         # PROCESS TV Seasons #####
-        # Cycle through tv shows
-        for tvShowId in allPlexTvShowsId:
-            if self.thread_stopped():
-                return False
-            # Grab all seasons to tvshow from PMS
-            seasons = GetAllPlexChildren(tvShowId)
-            if seasons is None:
-                log.error("Error download season xml for show %s" % tvShowId)
-                continue
-            elif seasons == 401:
-                return False
-            # Populate self.updatelist and self.allPlexElementsId
-            self.GetUpdatelist(seasons,
-                               itemType,
-                               'add_updateSeason',
-                               viewName,
-                               viewId)
-            log.debug("Analyzed all seasons of TV show with Plex Id %s"
-                      % tvShowId)
-
-        # Process self.updatelist
-        self.GetAndProcessXMLs(itemType)
-        log.debug("GetAndProcessXMLs completed for seasons")
+        # self.pipeline writes them after their TV shows
+        if self.incremental is True:
+            # Unchanged TV shows might have new seasons
+            for view in views:
+                if self.thread_stopped():
+                    return False
+                seasons = GetPlexSectionResults(
+                    view['id'],
+                    args={'type': 3},
+                    stream=True,
+                    updatedAt=self.updated_since(view['id']),
+                    errors=self.view_errors(view['id']))
+                # Hand the items to self.pipeline
+                self.GetUpdatelist(seasons,
+                                   itemType,
+                                   'add_updateSeason',
+                                   view['name'],
+                                   view['id'])
+        else:
+            # Cycle through tv shows, grabbing their seasons from the PMS
+            # several at once
+            for (view, tvShowId), seasons in fetch_concurrently(
+                    lambda show: list(GetAllPlexChildren(
+                        show[1],
+                        stream=True,
+                        errors=self.view_errors(show[0]['id']))),
+                    allPlexTvShowsId,
+                    self.syncThreadNumber):
+                if self.thread_stopped():
+                    return False
+                # Hand the items to self.pipeline
+                self.GetUpdatelist(seasons or (),
+                                   itemType,
+                                   'add_updateSeason',
+                                   view['name'],
+                                   view['id'])
+                log.debug("Analyzed all seasons of TV show with Plex Id %s"
+                          % tvShowId)
 
         # PROCESS TV Episodes #####
         # Cycle through tv shows
@@ -1041,48 +1150,48 @@ class LibrarySync(Thread):
             if self.thread_stopped():
                 return False
             # Grab all episodes to tvshow from PMS
-            episodes = GetAllPlexLeaves(view['id'])
-            if episodes is None:
-                log.error("Error downloading episod xml for view %s"
-                          % view.get('name'))
-                continue
-            elif episodes == 401:
-                return False
-            # Populate self.updatelist and self.allPlexElementsId
+            episodes = GetAllPlexLeaves(
+                view['id'],
+                updatedAt=self.updated_since(view['id']),
+                stream=True,
+                errors=self.view_errors(view['id']))
+            # Hand the items to self.pipeline
             self.GetUpdatelist(episodes,
                                itemType,
                                'add_updateEpisode',
-                               viewName,
-                               viewId)
+                               view['name'],
+                               view['id'])
             log.debug("Analyzed all episodes of TV show with Plex Id %s"
                       % view['id'])
 
-        # Process self.updatelist
-        self.GetAndProcessXMLs(itemType)
-        log.debug("GetAndProcessXMLs completed for episodes")
         # Refresh season info
-        # Cycle through tv shows
-        with itemtypes.TVShows() as TVshow:
-            for tvShowId in allPlexTvShowsId:
-                XMLtvshow = GetPlexMetadata(tvShowId)
-                if XMLtvshow is None or XMLtvshow == 401:
-                    log.error('Could not download XMLtvshow')
-                    continue
-                TVshow.refreshSeasonEntry(XMLtvshow, tvShowId)
-        log.debug("Season info refreshed")
+        # Cycle through new or changed tv shows
+        # Only keep the artwork we need, not the entire xml
+        artworks = []
+        for tvShowId, artwork in fetch_concurrently(
+                self.get_show_artwork, changed_shows, self.syncThreadNumber):
+            if self.thread_stopped():
+                return False
+            if artwork is not None:
+                artworks.append((tvShowId, artwork))
+        if artworks:
+            self.pipeline.call(self.refresh_season_entries, artworks)
 
         # Update viewstate:
         for view in views:
             if self.thread_stopped():
                 return False
-            self.PlexUpdateWatched(view['id'], itemType)
+            self.PlexUpdateWatched(
+                view['id'],
+                itemType,
+                lastViewedAt=self.viewed_since(view['id']))
 
         if self.compare:
             # Manual sync, process deletes
-            with itemtypes.TVShows() as TVShow:
-                for kodiTvElement in self.allKodiElementsId:
-                    if kodiTvElement not in self.allPlexElementsId:
-                        TVShow.remove(kodiTvElement)
+            self.process_deletes(itemType,
+                                 views,
+                                 [{'type': 2}, {'type': 3}, {'type': 4}])
+        self.checksum_diff = None
         log.info("%s sync is finished." % itemType)
         return True
 
@@ -1107,34 +1216,35 @@ class LibrarySync(Thread):
         # Process artist, then album and tracks last to minimize overhead
         # Each album needs to be processed directly with its songs
         # Remaining songs without album will be processed last
+        # self.pipeline processes the items in this order
         for kind in (v.PLEX_TYPE_ARTIST,
                      v.PLEX_TYPE_ALBUM,
                      v.PLEX_TYPE_SONG):
             if self.thread_stopped():
                 return False
+            if kind == v.PLEX_TYPE_SONG and not self.pipeline.join():
+                # Albums write their songs. Wait for them before looking at
+                # the songs in the Plex DB - or we would sync them twice
+                return False
             log.debug("Start processing music %s" % kind)
-            self.allKodiElementsId = {}
-            self.allPlexElementsId = {}
-            self.updatelist = []
             if self.ProcessMusic(views,
                                  kind,
                                  urlArgs[kind],
                                  methods[kind]) is False:
                 return False
-            log.debug("Processing of music %s done" % kind)
-            self.GetAndProcessXMLs(itemType)
-            log.debug("GetAndProcessXMLs for music %s completed" % kind)
+            log.debug("Analyzed music %s" % kind)
 
         # Update viewstate for EVERY item
         for view in views:
             if self.thread_stopped():
                 return False
-            self.PlexUpdateWatched(view['id'], itemType)
+            self.PlexUpdateWatched(
+                view['id'],
+                itemType,
+                lastViewedAt=self.viewed_since(view['id']))
 
         # reset stuff
-        self.allKodiElementsId = {}
-        self.allPlexElementsId = {}
-        self.updatelist = []
+        self.checksum_diff = None
         log.info("%s sync is finished." % itemType)
         return True
 
@@ -1142,27 +1252,19 @@ class LibrarySync(Thread):
         # For albums, we need to look at the album's songs simultaneously
         get_children = True if kind == v.PLEX_TYPE_ALBUM else False
         # Get a list of items already existing in Kodi db
-        if self.compare:
-            with plexdb.Get_Plex_DB() as plex_db:
-                # Pull the list of items already in Kodi
-                try:
-                    elements = dict(plex_db.getChecksum(kind))
-                    self.allKodiElementsId.update(elements)
-                # Yet empty/nothing yet synched
-                except ValueError:
-                    pass
+        self.checksum_diff = self.get_checksum_diff((kind, ))
         for view in views:
             if self.thread_stopped():
                 return False
             # Get items per view
-            itemsXML = GetPlexSectionResults(view['id'], args=urlArgs)
-            if itemsXML is None:
-                log.error("Error downloading xml for view %s" % view['id'])
-                continue
-            elif itemsXML == 401:
-                return False
-            # Populate self.updatelist and self.allPlexElementsId
-            self.GetUpdatelist(itemsXML,
+            items = GetPlexSectionResults(
+                view['id'],
+                args=urlArgs,
+                stream=True,
+                updatedAt=self.updated_since(view['id']),
+                errors=self.view_errors(view['id']))
+            # Hand the items to self.pipeline
+            self.GetUpdatelist(items,
                                'Music',
                                method,
                                view['name'],
@@ -1170,31 +1272,21 @@ class LibrarySync(Thread):
                                get_children=get_children)
         if self.compare:
             # Manual sync, process deletes
-            with itemtypes.Music() as Music:
-                for itemid in self.allKodiElementsId:
-                    if itemid not in self.allPlexElementsId:
-                        Music.remove(itemid)
+            self.process_deletes('Music', views, [urlArgs])
 
     def processMessage(self, message):
         """
         processes json.loads() messages from websocket. Triage what we need to
         do with "process_" methods
         """
+        start = time()
         typus = message.get('type')
         if typus == 'playing':
             self.process_playing(message['PlaySessionStateNotification'])
         elif typus == 'timeline':
             self.process_timeline(message['TimelineEntry'])
-
-    def multi_delete(self, liste, deleteListe):
-        """
-        Deletes the list items of liste at the positions in deleteListe
-        (which can be in any arbitrary order)
-        """
-        indexes = sorted(deleteListe, reverse=True)
-        for index in indexes:
-            del liste[index]
-        return liste
+        metrics.count('websocket.messages')
+        metrics.observe('websocket.message', time() - start)
 
     def processItems(self):
         """
@@ -1222,25 +1314,45 @@ class LibrarySync(Thread):
             6: 'analyzing',
             9: 'deleted'
         """
+        start = time()
         self.videoLibUpdate = False
         self.musicLibUpdate = False
         now = getUnixTimestamp()
-        deleteListe = []
-        for i, item in enumerate(self.itemsToProcess):
-            if self.thread_stopped():
-                # Chances are that Kodi gets shut down
+        deleted = []
+        updated = []
+        while True:
+            # Items are only due once we waited long enough for the PMS to
+            # finish processing them (excepting deletions)
+            item = self.itemsToProcess.pop_due(now)
+            if item is None:
                 break
             if item['state'] == 9:
-                successful = self.process_deleteditems(item)
-            elif now - item['timestamp'] < self.saftyMargin:
-                # We haven't waited long enough for the PMS to finish
-                # processing the item. Do it later (excepting deletions)
-                continue
+                deleted.append(item)
             else:
-                successful = self.process_newitems(item)
-                if successful:
-                    self.just_processed[str(item['ratingKey'])] = now
-                if successful and settings('FanartTV') == 'true':
+                updated.append(item)
+        if deleted:
+            self.process_deleteditems(deleted)
+        retry = []
+        for pos in xrange(0, len(updated), self.syncMetadataBatchSize):
+            if self.thread_stopped():
+                # Chances are that Kodi gets shut down. Don't lose the items
+                # we did not get to
+                retry.extend(updated[pos:])
+                break
+            batch = updated[pos:pos + self.syncMetadataBatchSize]
+            processed = self.process_newitems(batch)
+            for item in batch:
+                if item['ratingKey'] not in processed:
+                    # Safety net if we can't process an item
+                    item['attempt'] += 1
+                    if item['attempt'] > 3:
+                        log.error('Repeatedly could not process item %s, '
+                                  'abort' % item)
+                    else:
+                        retry.append(item)
+                    continue
+                self.just_processed[item['ratingKey']] = now
+                if settings('FanartTV') == 'true':
                     plex_type = v.PLEX_TYPE_FROM_WEBSOCKET[item['type']]
                     if plex_type in (v.PLEX_TYPE_MOVIE, v.PLEX_TYPE_SHOW):
                         self.fanartqueue.put({
@@ -1248,20 +1360,12 @@ class LibrarySync(Thread):
                             'plex_type': plex_type,
                             'refresh': False
                         })
-            if successful is True:
-                deleteListe.append(i)
-            else:
-                # Safety net if we can't process an item
-                item['attempt'] += 1
-                if item['attempt'] > 3:
-                    log.error('Repeatedly could not process item %s, abort'
-                              % item)
-                    deleteListe.append(i)
-
-        # Get rid of the items we just processed
-        if len(deleteListe) > 0:
-            self.itemsToProcess = self.multi_delete(
-                self.itemsToProcess, deleteListe)
+        # Try again next time
+        for item in retry:
+            self.itemsToProcess.add(item, now)
+        metrics.count('sync.processed_websocket_items',
+                      len(updated) + len(deleted))
+        metrics.observe('sync.process_items', time() - start)
         # Let Kodi know of the change
         if self.videoLibUpdate is True:
             log.info("Doing Kodi Video Lib update")
@@ -1270,60 +1374,89 @@ class LibrarySync(Thread):
             log.info("Doing Kodi Music Lib update")
             xbmc.executebuiltin('UpdateLibrary(music)')
 
-    def process_newitems(self, item):
-        xml = GetPlexMetadata(item['ratingKey'])
-        try:
-            mediatype = xml[0].attrib['type']
-        except (IndexError, KeyError, TypeError):
-            log.error('Could not download metadata for %s' % item['ratingKey'])
-            return False
-        log.debug("Processing new/updated PMS item: %s" % item['ratingKey'])
-        viewtag = xml.attrib.get('librarySectionTitle')
-        viewid = xml.attrib.get('librarySectionID')
-        if mediatype == v.PLEX_TYPE_MOVIE:
-            self.videoLibUpdate = True
-            if "musicvideo" in viewtag:
-                with itemtypes.MusicVideos() as musicvideo:
-                    musicvideo.add_update(xml[0],
-                                     viewtag=viewtag,
-                                     viewid=viewid)
-            else:
-                with itemtypes.Movies() as movie:
-                    movie.add_update(xml[0],
-                                     viewtag=viewtag,
-                                     viewid=viewid)
-        elif mediatype == v.PLEX_TYPE_EPISODE:
-            self.videoLibUpdate = True
-            with itemtypes.TVShows() as show:
-                show.add_updateEpisode(xml[0],
-                                       viewtag=viewtag,
-                                       viewid=viewid)
-        elif mediatype == v.PLEX_TYPE_SONG:
-            self.musicLibUpdate = True
-            with itemtypes.Music() as music:
-                music.add_updateSong(xml[0],
-                                     viewtag=viewtag,
-                                     viewid=viewid)
-        return True
+    def process_newitems(self, items):
+        """
+        Downloads the metadata for the list of items with as few PMS requests
+        as possible and adds/updates them in the Kodi DB, using one DB
+        transaction per item type.
 
-    def process_deleteditems(self, item):
-        if item.get('type') == 1:
-            log.debug("Removing movie %s" % item.get('ratingKey'))
-            self.videoLibUpdate = True
-            with itemtypes.Movies() as movie:
-                movie.remove(item.get('ratingKey'))
-        elif item.get('type') in (2, 3, 4):
-            log.debug("Removing episode/season/tv show %s"
-                      % item.get('ratingKey'))
-            self.videoLibUpdate = True
-            with itemtypes.TVShows() as show:
-                show.remove(item.get('ratingKey'))
-        elif item.get('type') in (8, 9, 10):
-            log.debug("Removing song/album/artist %s" % item.get('ratingKey'))
-            self.musicLibUpdate = True
-            with itemtypes.Music() as music:
-                music.remove(item.get('ratingKey'))
-        return True
+        Returns the set of ratingKeys we processed successfully
+        """
+        xmls = GetPlexMetadataForItems([item['ratingKey'] for item in items])
+        if xmls == 401:
+            return set()
+        processed = set()
+        # {(itemtypes class, method name): [etree xml]}
+        grouped = {}
+        for item in items:
+            xml = xmls.get(item['ratingKey'])
+            try:
+                mediatype = xml[0].attrib['type']
+            except (IndexError, KeyError, TypeError):
+                log.error('Could not download metadata for %s'
+                          % item['ratingKey'])
+                continue
+            if mediatype == v.PLEX_TYPE_MOVIE:
+                if "musicvideo" in xml.attrib.get('librarySectionTitle', ''):
+                    key = (itemtypes.MusicVideos, 'add_update')
+                else:
+                    key = (itemtypes.Movies, 'add_update')
+            elif mediatype == v.PLEX_TYPE_EPISODE:
+                key = (itemtypes.TVShows, 'add_updateEpisode')
+            elif mediatype == v.PLEX_TYPE_SONG:
+                key = (itemtypes.Music, 'add_updateSong')
+            else:
+                processed.add(item['ratingKey'])
+                continue
+            grouped.setdefault(key, []).append(xml)
+        for (item_class, method), xmls in grouped.iteritems():
+            if item_class is itemtypes.Music:
+                self.musicLibUpdate = True
+            else:
+                self.videoLibUpdate = True
+            with item_class() as item_fct:
+                method = getattr(item_fct, method)
+                for xml in xmls:
+                    log.debug("Processing new/updated PMS item: %s"
+                              % xml[0].attrib.get('ratingKey'))
+                    method(xml[0],
+                           viewtag=xml.attrib.get('librarySectionTitle'),
+                           viewid=xml.attrib.get('librarySectionID'))
+                    processed.add(xml[0].attrib.get('ratingKey'))
+        return processed
+
+    def process_deleteditems(self, items):
+        """
+        Removes the list of items from the Kodi DB, using one DB transaction
+        per item type
+        """
+        movies = []
+        shows = []
+        songs = []
+        for item in items:
+            if item.get('type') == 1:
+                log.debug("Removing movie %s" % item.get('ratingKey'))
+                movies.append(item.get('ratingKey'))
+            elif item.get('type') in (2, 3, 4):
+                log.debug("Removing episode/season/tv show %s"
+                          % item.get('ratingKey'))
+                shows.append(item.get('ratingKey'))
+            elif item.get('type') in (8, 9, 10):
+                log.debug("Removing song/album/artist %s"
+                          % item.get('ratingKey'))
+                songs.append(item.get('ratingKey'))
+        for item_class, plex_ids in ((itemtypes.Movies, movies),
+                                     (itemtypes.TVShows, shows),
+                                     (itemtypes.Music, songs)):
+            if not plex_ids:
+                continue
+            if item_class is itemtypes.Music:
+                self.musicLibUpdate = True
+            else:
+                self.videoLibUpdate = True
+            with item_class() as item_fct:
+                for plex_id in plex_ids:
+                    item_fct.remove(plex_id)
 
     def process_timeline(self, data):
         """
@@ -1353,19 +1486,16 @@ class LibrarySync(Thread):
                 except KeyError:
                     # Item has NOT just been processed
                     pass
-                # Have we already added this element?
-                for existingItem in self.itemsToProcess:
-                    if existingItem['ratingKey'] == plex_id:
-                        break
-                else:
-                    # Haven't added this element to the queue yet
-                    self.itemsToProcess.append({
+                # Ignored if we have already added this element
+                self.itemsToProcess.add(
+                    {
                         'state': status,
                         'type': typus,
                         'ratingKey': plex_id,
-                        'timestamp': getUnixTimestamp(),
+                        'timestamp': now,
                         'attempt': 0
-                    })
+                    },
+                    now if status == 9 else now + self.saftyMargin)
 
     def process_playing(self, data):
         """
@@ -1488,6 +1618,29 @@ class LibrarySync(Thread):
                 'refresh': refresh
             })
 
+    def schedule_wake_up(self, queue, timestamp):
+        """
+        Wakes up the thread waiting on the Worker_Queue queue at the unix
+        timestamp. Uses a helper thread waiting on Kodi's abort event - Python
+        2 would poll while waiting with a timeout
+        """
+        if self.wake_up_time is not None and self.wake_up_time <= timestamp:
+            # We'll be woken up in time anyway
+            return
+        self.wake_up_time = timestamp
+        thread = Thread(target=self.__wake_up, args=(queue, timestamp))
+        thread.setDaemon(True)
+        thread.start()
+
+    def __wake_up(self, queue, timestamp):
+        monitor = xbmc.Monitor()
+        while time() < timestamp:
+            if monitor.waitForAbort(timestamp - time()):
+                break
+        if self.wake_up_time == timestamp:
+            self.wake_up_time = None
+        queue.wake_up()
+
     def run(self):
         try:
             self.run_internal()
@@ -1690,7 +1843,8 @@ class LibrarySync(Thread):
                         log.info('Doing scheduled full library scan')
                         state.DB_SCAN = True
                         window('plex_dbScan', value="true")
-                        if fullSync() is False and not thread_stopped():
+                        if (fullSync(incremental=self.incrementalSync) is
+                                False and not thread_stopped()):
                             log.error('Could not finish scheduled full sync')
                             self.showKodiNote(lang(39410),
                                               forced=True,
@@ -1707,28 +1861,39 @@ class LibrarySync(Thread):
                         self.syncPMStime()
                         window('plex_dbScan', clear=True)
                         state.DB_SCAN = False
-                    elif enableBackgroundSync:
+                    else:
                         # Check back whether we should process something
                         # Only do this once every while (otherwise, potentially
                         # many screen refreshes lead to flickering)
-                        if now - lastProcessing > 5:
+                        if (enableBackgroundSync and
+                                now - lastProcessing > 5):
                             lastProcessing = now
                             processItems()
-                        # See if there is a PMS message we need to handle
-                        try:
-                            message = queue.get(block=False)
-                        except Queue.Empty:
-                            xbmc.sleep(100)
+                        # Next time we need to do something by ourselves
+                        wake_up_at = min(lastSync + fullSyncInterval,
+                                         lastTimeSync + oneDay) + 1
+                        if wake_up_at <= now:
+                            # Full sync is due, but Kodi is playing
+                            wake_up_at = now + 60
+                        due = self.itemsToProcess.next_due()
+                        if enableBackgroundSync and due is not None:
+                            wake_up_at = min(wake_up_at,
+                                             max(due, lastProcessing + 6))
+                        self.schedule_wake_up(queue, wake_up_at)
+                        # Wait for a PMS message, a sync request (see
+                        # command_pipeline) or wake_up_at - without polling
+                        message = queue.get_or_stop(
+                            lambda: (thread_stopped() or thread_suspended() or
+                                     window('plex_runLibScan') != '' or
+                                     getUnixTimestamp() >= wake_up_at))
+                        if message is None:
                             continue
                         # Got a message from PMS; process it
-                        else:
+                        if enableBackgroundSync:
                             processMessage(message)
-                            queue.task_done()
-                            # NO sleep!
-                            continue
-                    else:
-                        # Still sleep if backgroundsync disabled
-                        xbmc.sleep(100)
+                        queue.task_done()
+                        # NO sleep!
+                        continue
 
             xbmc.sleep(100)
 
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+"""
+Performance metrics of PKC's sync, e.g. to see which stage of a full sync is
+the bottleneck on a certain box. Only recorded if ENABLED (setting
+'syncMetrics'). Use snapshot() or see window('plex_sync_metrics') and the file
+METRICS_PATH for a JSON snapshot.
+
+    count(name, n)          e.g. items that passed a sync stage
+    observe(name, seconds)  e.g. PMS request latencies
+    gauge(name, function)   e.g. queue depths
+
+Run a repair sync with metrics enabled to benchmark the entire sync against
+your PMS: summary() is logged once every full sync is done.
+"""
+from logging import getLogger
+from threading import Lock
+from time import time
+from json import dumps
+from bisect import bisect_left
+from sys import platform
+try:
+    # Not available on Windows
+    import resource
+    HAVE_RESOURCE = True
+except ImportError:
+    HAVE_RESOURCE = False
+
+from xbmc import translatePath
+
+from variables import ADDON_ID
+
+###############################################################################
+
+log = getLogger("PLEX."+__name__)
+
+# Set by the service, see service.py
+ENABLED = False
+
+METRICS_PATH = translatePath(
+    "special://profile/addon_data/%s/sync_metrics.json" % ADDON_ID)
+# Upper bounds in milliseconds of the histogram buckets (last one: more)
+BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+# Publish the snapshot to the window property at most every x seconds
+PUBLISH_INTERVAL = 1.0
+
+LOCK = Lock()
+# {name: int}
+COUNTERS = {}
+# {name: Histogram}
+HISTOGRAMS = {}
+# {name: function returning the current value}
+GAUGES = {}
+STARTED = time()
+LAST_PUBLISH = 0.0
+
+###############################################################################
+
+
+class Histogram(object):
+    """
+    Distribution of durations, see BUCKETS. Only access while holding LOCK
+    """
+    __slots__ = ('count', 'total', 'max', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(BUCKETS) + 1)
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        self.buckets[bisect_left(BUCKETS, seconds * 1000.0)] += 1
+
+    def as_dict(self):
+        labels = ['<=%sms' % bound for bound in BUCKETS]
+        labels.append('>%sms' % BUCKETS[-1])
+        return {
+            'count': self.count,
+            'total_seconds': round(self.total, 3),
+            'avg_ms': round(self.total * 1000.0 / self.count, 2)
+                      if self.count else 0,
+            'max_ms': round(self.max * 1000.0, 2),
+            'buckets': dict(zip(labels, self.buckets))
+        }
+
+
+def reset():
+    """
+    Clears all counters and histograms, e.g. when a full sync starts. Gauges
+    stay registered
+    """
+    global STARTED
+    with LOCK:
+        COUNTERS.clear()
+        HISTOGRAMS.clear()
+        STARTED = time()
+
+
+def count(name, n=1):
+    """
+    Adds n to the counter name
+    """
+    if ENABLED is False:
+        return
+    with LOCK:
+        COUNTERS[name] = COUNTERS.get(name, 0) + n
+    _maybe_publish()
+
+
+def observe(name, seconds):
+    """
+    Adds the duration seconds to the histogram name
+    """
+    if ENABLED is False:
+        return
+    with LOCK:
+        try:
+            HISTOGRAMS[name].add(seconds)
+        except KeyError:
+            HISTOGRAMS[name] = Histogram()
+            HISTOGRAMS[name].add(seconds)
+    _maybe_publish()
+
+
+def gauge(name, function=None):
+    """
+    Registers function() (e.g. a queue's qsize) to be read for every
+    snapshot. Pass function=None to unregister name
+    """
+    with LOCK:
+        if function is None:
+            GAUGES.pop(name, None)
+        else:
+            GAUGES[name] = function
+
+
+def peak_rss():
+    """
+    Returns the peak resident set size of the Kodi process in KB, or None if
+    the platform does not tell us
+    """
+    if HAVE_RESOURCE is False:
+        return
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if platform == 'darwin':
+        # Bytes, not KB
+        peak = peak / 1024
+    return peak
+
+
+def snapshot():
+    """
+    Returns all metrics as a JSON-serializable dict. Rates are per second
+    since the last reset()
+    """
+    with LOCK:
+        elapsed = max(time() - STARTED, 0.001)
+        counters = dict(COUNTERS)
+        histograms = dict((name, histogram.as_dict())
+                          for name, histogram in HISTOGRAMS.iteritems())
+        gauges = dict(GAUGES)
+    for name, function in gauges.iteritems():
+        try:
+            gauges[name] = function()
+        except Exception as err:
+            gauges[name] = str(err)
+    return {
+        'timestamp': int(time()),
+        'elapsed_seconds': round(elapsed, 3),
+        'counters': counters,
+        'rates': dict((name, round(value / elapsed, 2))
+                      for name, value in counters.iteritems()),
+        'histograms': histograms,
+        'gauges': gauges,
+        'peak_rss_kb': peak_rss()
+    }
+
+
+def summary():
+    """
+    Returns a one-line summary of the snapshot() to log: items written per
+    second, PMS requests and peak memory
+    """
+    data = snapshot()
+    written = data['counters'].get('sync.written', 0)
+    requests = data['histograms'].get('pms.request', {})
+    return ('%s items written in %ss (%s items/s), %s PMS requests '
+            '(avg %sms), peak RSS %s KB'
+            % (written,
+               data['elapsed_seconds'],
+               data['rates'].get('sync.written', 0),
+               requests.get('count', 0),
+               requests.get('avg_ms', 0),
+               data['peak_rss_kb']))
+
+
+def publish(to_file=False):
+    """
+    Writes the snapshot() to window('plex_sync_metrics') and, if to_file is
+    True, to the file METRICS_PATH
+    """
+    global LAST_PUBLISH
+    if ENABLED is False:
+        return
+    LAST_PUBLISH = time()
+    data = dumps(snapshot(), sort_keys=True)
+    from utils import window
+    window('plex_sync_metrics', value=data)
+    if to_file is True:
+        try:
+            with open(METRICS_PATH, 'wb') as f:
+                f.write(data)
+        except (IOError, OSError) as err:
+            log.error('Could not write %s: %s' % (METRICS_PATH, err))
+
+
+def _maybe_publish():
+    if time() - LAST_PUBLISH >= PUBLISH_INTERVAL:
+        publish()
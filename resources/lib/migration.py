@@ -1,6 +1,7 @@
 from logging import getLogger
 import variables as v
 from utils import compare_version, settings
+from plexdb_functions import PLEX_TABLE
 ###############################################################################
 
 log = getLogger("PLEX."+__name__)
@@ -22,3 +23,50 @@ def check_migration():
         settings('themoviedbAPIKey', value='19c90103adb9e98f2172c6a6a3d85dc4')
 
     settings('last_migrated_PKC_version', value=v.ADDON_VERSION)
+
+
+def migrate_view_table(cursor):
+    """
+    Run once during startup, before the view table is created. Adds the
+    column last_sync to the Plex DB's view table of older PKC versions
+    """
+    cursor.execute('PRAGMA table_info(view)')
+    columns = [column[1] for column in cursor.fetchall()]
+    if columns and 'last_sync' not in columns:
+        log.info('Adding column last_sync to the view table')
+        cursor.execute('ALTER TABLE view ADD COLUMN last_sync INTEGER')
+
+
+def migrate_plex_table(cursor):
+    """
+    Run once during startup, before the plex table is created. Migrates the
+    Plex DB's plex table of older PKC versions (plex_id TEXT and checksums
+    "K<plex_id><updatedAt>") to integer plex_ids and checksums
+    """
+    cursor.execute('PRAGMA table_info(plex)')
+    for column in cursor.fetchall():
+        if column[1] == 'plex_id':
+            if column[2] == 'INTEGER':
+                # Already migrated
+                return
+            break
+    else:
+        # No plex table yet
+        return
+    log.info('Migrating the plex table to integer plex_ids and checksums')
+    cursor.execute('ALTER TABLE plex RENAME TO plex_old')
+    cursor.execute(PLEX_TABLE)
+    cursor.execute('''
+        INSERT OR REPLACE INTO plex(
+            plex_id, view_id, plex_type, kodi_type, kodi_id, kodi_fileid,
+            kodi_pathid, parent_id, checksum, fanart_synced)
+        SELECT CAST(plex_id AS INTEGER), view_id, plex_type, kodi_type,
+            kodi_id, kodi_fileid, kodi_pathid, parent_id,
+            CASE WHEN substr(checksum, 1, length(plex_id) + 1) = 'K' || plex_id
+                THEN CAST(substr(checksum, length(plex_id) + 2) AS INTEGER)
+            END,
+            fanart_synced
+        FROM plex_old
+        WHERE plex_id != '' AND plex_id NOT GLOB '*[^0-9]*'
+    ''')
+    cursor.execute('DROP TABLE plex_old')
@@ -7,7 +7,7 @@ from urlparse import parse_qsl
 from xbmc import Player
 
 from PKC_listitem import PKC_ListItem
-from pickler import pickle_me, Playback_Successful
+from pickler import Playback_Successful
 from playbackutils import PlaybackUtils
 from utils import window
 from PlexFunctions import GetPlexMetadata
@@ -126,6 +126,11 @@ class Playback_Starter(Thread):
             return result
 
     def triage(self, item):
+        """
+        Returns the JSON-serializable result for the play request item (the
+        add-on's paths argument): None if something went wrong, otherwise
+        {'listitem': PKC_ListItem().data or None}
+        """
         _, params = item.split('?', 1)
         params = dict(parse_qsl(params))
         mode = params.get('mode')
@@ -148,19 +153,20 @@ class Playback_Starter(Thread):
             import traceback
             log.error(traceback.format_exc())
             # Let default.py know!
-            pickle_me(None)
-        else:
-            pickle_me(result)
+            return
+        if result is None:
+            return
+        return {'listitem': result.listitem.data if result.listitem else None}
 
     def run(self):
         queue = self.mgr.command_pipeline.playback_queue
         log.info("----===## Starting Playback_Starter ##===----")
         while True:
-            item = queue.get()
-            if item is None:
+            request = queue.get()
+            if request is None:
                 # Need to shutdown - initiated by command_pipeline
                 break
             else:
-                self.triage(item)
+                request.respond(self.triage(request.args.get('params', '')))
                 queue.task_done()
         log.info("----===## Playback_Starter stopped ##===----")
@@ -10,6 +10,37 @@ import variables as v
 
 log = logging.getLogger("PLEX."+__name__)
 
+# plex_id is the table's rowid, thus stored as int. Checksums are the Plex
+# items' int updatedAt
+PLEX_TABLE = '''
+    CREATE TABLE IF NOT EXISTS plex(
+    plex_id INTEGER PRIMARY KEY,
+    view_id TEXT,
+    plex_type TEXT,
+    kodi_type TEXT,
+    kodi_id INTEGER,
+    kodi_fileid INTEGER,
+    kodi_pathid INTEGER,
+    parent_id INTEGER,
+    checksum INTEGER,
+    fanart_synced INTEGER)
+'''
+# Covering indexes for our lookups of the plex table
+PLEX_INDEXES = (
+    '''CREATE INDEX IF NOT EXISTS ix_plex_kodi_id
+       ON plex(kodi_id, kodi_type, parent_id, plex_type)''',
+    '''CREATE INDEX IF NOT EXISTS ix_plex_kodi_fileid
+       ON plex(kodi_fileid, kodi_type)''',
+    '''CREATE INDEX IF NOT EXISTS ix_plex_parent_id
+       ON plex(parent_id, kodi_type, kodi_id, kodi_fileid)''',
+    '''CREATE INDEX IF NOT EXISTS ix_plex_view_id
+       ON plex(view_id, kodi_type, kodi_id)''',
+    '''CREATE INDEX IF NOT EXISTS ix_plex_plex_type
+       ON plex(plex_type, checksum)''',
+    '''CREATE INDEX IF NOT EXISTS ix_plex_fanart_synced
+       ON plex(fanart_synced, plex_type)''',
+)
+
 ###############################################################################
 
 
@@ -31,7 +62,9 @@ class Get_Plex_DB():
 
 
 class Plex_DB_Functions():
-
+    """
+    plex_id is stored as int in the plex table but handed out as unicode
+    """
     def __init__(self, plexcursor):
         self.plexcursor = plexcursor
 
@@ -74,6 +107,26 @@ class Plex_DB_Functions():
                           'sync_to_kodi': row[4]})
         return views
 
+    def get_sync_marks(self):
+        """
+        Returns a dict {view_id: last_sync} with the PMS unix timestamp up to
+        which we synced the Plex library view_id (if we ever did)
+        """
+        query = '''
+            SELECT view_id, last_sync
+            FROM view
+            WHERE last_sync IS NOT NULL
+        '''
+        self.plexcursor.execute(query)
+        return dict(self.plexcursor.fetchall())
+
+    def set_sync_mark(self, view_id, last_sync):
+        """
+        Remembers the PMS unix timestamp last_sync for view_id
+        """
+        query = 'UPDATE view SET last_sync = ? WHERE view_id = ?'
+        self.plexcursor.execute(query, (last_sync, view_id))
+
     def getView_byId(self, view_id):
         """
         Returns tuple (view_name, kodi_type, kodi_tagid) for view_id
@@ -168,7 +221,11 @@ class Plex_DB_Functions():
             'kodi_type': xxx
         }
         """
-        query = '''SELECT plex_id, kodi_type FROM plex WHERE view_id = ?'''
+        query = '''
+            SELECT CAST(plex_id AS TEXT), kodi_type
+            FROM plex
+            WHERE view_id = ?
+        '''
         self.plexcursor.execute(query, (view_id, ))
         rows = self.plexcursor.fetchall()
         res = []
@@ -183,7 +240,7 @@ class Plex_DB_Functions():
         None if not found
         """
         query = '''
-            SELECT plex_id
+            SELECT CAST(plex_id AS TEXT)
             FROM plex
             WHERE kodi_fileid = ? AND kodi_type = ?
         '''
@@ -201,7 +258,7 @@ class Plex_DB_Functions():
         None if not found
         """
         query = '''
-            SELECT plex_id
+            SELECT CAST(plex_id AS TEXT)
             FROM plex
             WHERE kodi_id = ? AND kodi_type = ?
         '''
@@ -232,18 +289,6 @@ class Plex_DB_Functions():
         except:
             return None
 
-    def getItem_byWildId(self, plex_id):
-        """
-        Returns a list of tuples (kodi_id, kodi_type) for plex_id (% appended)
-        """
-        query = '''
-            SELECT kodi_id, kodi_type
-            FROM plex
-            WHERE plex_id LIKE ?
-        '''
-        self.plexcursor.execute(query, (plex_id+"%",))
-        return self.plexcursor.fetchall()
-
     def getItem_byView(self, view_id):
         """
         Returns kodi_id for view_id
@@ -262,7 +307,7 @@ class Plex_DB_Functions():
         kodi_type
         """
         query = '''
-            SELECT plex_id, parent_id, plex_type
+            SELECT CAST(plex_id AS TEXT), parent_id, plex_type
             FROM plex
             WHERE kodi_id = ?
             AND kodi_type = ?
@@ -276,10 +321,10 @@ class Plex_DB_Functions():
         kodi_type
         """
         query = '''
-            SELECT plex_id, kodi_id, kodi_fileid
+            SELECT CAST(plex_id AS TEXT), kodi_id, kodi_fileid
             FROM plex
             WHERE parent_id = ?
-            AND kodi_type = ?"
+            AND kodi_type = ?
         '''
         self.plexcursor.execute(query, (parent_id, kodi_type,))
         return self.plexcursor.fetchall()
@@ -289,7 +334,7 @@ class Plex_DB_Functions():
         Returns the tuple (plex_id, kodi_id) for parent_id, kodi_type
         """
         query = '''
-            SELECT plex_id, kodi_id
+            SELECT CAST(plex_id AS TEXT), kodi_id
             FROM plex
             WHERE parent_id = ?
             AND kodi_type = ?
@@ -302,13 +347,27 @@ class Plex_DB_Functions():
         Returns a list of tuples (plex_id, checksum) for plex_type
         """
         query = '''
-            SELECT plex_id, checksum
+            SELECT CAST(plex_id AS TEXT), checksum
             FROM plex
             WHERE plex_type = ?
         '''
         self.plexcursor.execute(query, (plex_type,))
         return self.plexcursor.fetchall()
 
+    def checksums_by_types(self, plex_types):
+        """
+        Returns an iterator over the tuples (plex_id, checksum), both int, for
+        all items of the list plex_types, sorted by plex_id
+        """
+        query = '''
+            SELECT plex_id, checksum
+            FROM plex
+            WHERE plex_type IN (%s)
+            ORDER BY plex_id
+        ''' % ','.join('?' * len(plex_types))
+        self.plexcursor.execute(query, plex_types)
+        return self.plexcursor
+
     def getMediaType_byId(self, plex_id):
         """
         Returns plex_type for plex_id
@@ -386,13 +445,6 @@ class Plex_DB_Functions():
         query = "DELETE FROM plex WHERE plex_id = ?"
         self.plexcursor.execute(query, (plex_id,))
 
-    def removeWildItem(self, plex_id):
-        """
-        Removes all entries with plex_id with % added
-        """
-        query = "DELETE FROM plex WHERE plex_id LIKE ?"
-        self.plexcursor.execute(query, (plex_id+"%",))
-
     def itemsByType(self, plex_type):
         """
         Returns a list of dicts for plex_type:
@@ -404,7 +456,7 @@ class Plex_DB_Functions():
         }
         """
         query = '''
-            SELECT plex_id, kodi_id, kodi_type
+            SELECT CAST(plex_id AS TEXT), kodi_id, kodi_type
             FROM plex
             WHERE plex_type = ?
         '''
@@ -434,7 +486,7 @@ class Plex_DB_Functions():
         This only for plex_type is either movie or TV show
         """
         query = '''
-            SELECT plex_id, plex_type FROM plex
+            SELECT CAST(plex_id AS TEXT), plex_type FROM plex
             WHERE fanart_synced = ?
             AND (plex_type = ? OR plex_type = ?)
         '''
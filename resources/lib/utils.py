@@ -5,10 +5,10 @@ import logging
 from cProfile import Profile
 from json import loads, dumps
 from pstats import Stats
-from sqlite3 import connect, OperationalError
+from sqlite3 import connect, Connection, Cursor, OperationalError
 from datetime import datetime, timedelta
 from StringIO import StringIO
-from time import localtime, strftime, strptime
+from time import localtime, strftime, strptime, time
 from unicodedata import normalize
 import xml.etree.ElementTree as etree
 from functools import wraps, partial
@@ -17,6 +17,9 @@ from os.path import join
 from os import remove, walk, makedirs
 from shutil import rmtree
 from urllib import quote_plus
+from threading import local
+from Queue import Queue
+from weakref import WeakSet
 
 import xbmc
 import xbmcaddon
@@ -24,8 +27,9 @@ import xbmcgui
 from xbmcvfs import exists, delete
 
 from variables import DB_VIDEO_PATH, DB_MUSIC_PATH, DB_TEXTURE_PATH, \
-    DB_PLEX_PATH, KODI_PROFILE, KODIVERSION
+    DB_PLEX_PATH, DB_PLEX_CACHE_PATH, KODI_PROFILE, KODIVERSION
 import state
+import metrics
 
 ###############################################################################
 
@@ -34,6 +38,12 @@ log = logging.getLogger("PLEX."+__name__)
 WINDOW = xbmcgui.Window(10000)
 ADDON = xbmcaddon.Addon(id='plugin.video.plexkodiconnect')
 
+# Idle DB connections of the current thread, see kodiSQL()
+# {db path: [Pooled_Connection]}
+DB_CONNECTIONS = local()
+# Max. number of idle connections to keep per thread and DB
+DB_MAX_IDLE = 2
+
 ###############################################################################
 # Main methods
 
@@ -59,35 +69,29 @@ def window(property, value=None, clear=False, windowid=10000):
         return tryDecode(win.getProperty(property))
 
 
-def pickl_window(property, value=None, clear=False, windowid=10000):
-    """
-    Get or set window property - thread safe! For use with Pickle
-    Property and value must be string
+def plex_command(key, value):
     """
-    if windowid != 10000:
-        win = xbmcgui.Window(windowid)
-    else:
-        win = WINDOW
+    Used to funnel states between different Python instances. Returns once
+    the PKC service has adjusted its state, see command_pipeline
 
-    if clear:
-        win.clearProperty(property)
-    elif value is not None:
-        win.setProperty(property, value)
-    else:
-        return win.getProperty(property)
+        key:   state.py variable
+        value: either 'True' or 'False'
+    """
+    from command_pipeline import send_command
+    send_command('state', key=key, value=value)
 
 
-def plex_command(key, value):
+def request_lib_scan(kind):
     """
-    Used to funnel states between different Python instances. NOT really thread
-    safe - let's hope the Kodi user can't click fast enough
+    Asks the library sync thread of the PKC service to scan, from any Python
+    instance. See command_pipeline
 
-        key:   state.py variable
-        value: either 'True' or 'False'
+        kind:  'full', 'repair', 'views', 'fanart' or 'del_textures'
     """
-    while window('plex_command'):
-        xbmc.sleep(5)
-    window('plex_command', value='%s-%s' % (key, value))
+    window('plex_runLibScan', value=kind)
+    from command_pipeline import send_command
+    # Wakes up the library sync thread
+    send_command('lib_scan', kind=kind)
 
 
 def settings(setting, value=None):
@@ -282,16 +286,112 @@ def getUnixTimestamp(secondsIntoTheFuture=None):
     return timegm(future.timetuple())
 
 
+class Timed_Cursor(Cursor):
+    """
+    sqlite3 cursor recording the time of every statement in metrics, by DB
+    and statement class, e.g. 'sqlite.video.INSERT'
+    """
+    def _observe(self, sql, start):
+        try:
+            statement = sql.split(None, 1)[0].upper()
+        except IndexError:
+            statement = ''
+        metrics.observe('sqlite.%s.%s' % (self.connection.media_type,
+                                          statement),
+                        time() - start)
+
+    def execute(self, sql, *args):
+        start = time()
+        try:
+            return Cursor.execute(self, sql, *args)
+        finally:
+            self._observe(sql, start)
+
+    def executemany(self, sql, *args):
+        start = time()
+        try:
+            return Cursor.executemany(self, sql, *args)
+        finally:
+            self._observe(sql, start)
+
+
+class Pooled_Connection(Connection):
+    """
+    sqlite3 connection that kodiSQL() hands out. close() does not close the
+    connection but keeps it for the next kodiSQL() call of the same thread.
+    Just like with a real close(), uncommitted changes are rolled back and
+    all cursors of the connection are closed
+    """
+    def __init__(self, *args, **kwargs):
+        Connection.__init__(self, *args, **kwargs)
+        self.db_path = args[0]
+        # Set by kodiSQL()
+        self.media_type = None
+        self.cursors = WeakSet()
+        self.in_use = True
+
+    def cursor(self, *args, **kwargs):
+        # Connection.execute() uses cursor() as well
+        if metrics.ENABLED and not args and not kwargs:
+            cursor = Connection.cursor(self, Timed_Cursor)
+        else:
+            cursor = Connection.cursor(self, *args, **kwargs)
+        self.cursors.add(cursor)
+        return cursor
+
+    def close(self):
+        if self.in_use is False:
+            # Already closed
+            return
+        self.in_use = False
+        # Release all locks we might hold on the DB
+        for cursor in list(self.cursors):
+            cursor.close()
+        self.cursors.clear()
+        self.rollback()
+        idle = DB_CONNECTIONS.__dict__.setdefault(self.db_path, [])
+        if len(idle) < DB_MAX_IDLE:
+            idle.append(self)
+        else:
+            Connection.close(self)
+
+
 def kodiSQL(media_type="video"):
+    """
+    Returns a sqlite3 connection to the DB media_type: 'video' (default),
+    'music', 'texture', 'plex' or 'plexcache'.
+
+    Connections are reused by the same thread once they are close()d, so
+    always close() them when you are done.
+    """
     if media_type == "plex":
         dbPath = DB_PLEX_PATH
+    elif media_type == "plexcache":
+        dbPath = DB_PLEX_CACHE_PATH
     elif media_type == "music":
         dbPath = DB_MUSIC_PATH
     elif media_type == "texture":
         dbPath = DB_TEXTURE_PATH
     else:
         dbPath = DB_VIDEO_PATH
-    return connect(dbPath, timeout=60.0)
+    idle = DB_CONNECTIONS.__dict__.get(dbPath)
+    if idle:
+        conn = idle.pop()
+        conn.in_use = True
+        return conn
+    conn = connect(dbPath,
+                   timeout=60.0,
+                   factory=Pooled_Connection,
+                   cached_statements=200)
+    conn.media_type = media_type
+    # 8MB page cache, temporary tables and indices in memory
+    conn.execute('PRAGMA cache_size = -8000')
+    conn.execute('PRAGMA temp_store = MEMORY')
+    if media_type in ('plex', 'plexcache'):
+        # Only for our own DBs - Kodi opens its DBs in rollback journal mode
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute('PRAGMA synchronous = NORMAL')
+    return conn
 
 
 def create_actor_db_index():
@@ -392,6 +492,11 @@ def reset():
     cursor.execute('DROP table IF EXISTS view')
     connection.commit()
     cursor.close()
+    # Wipe the cached Plex metadata
+    connection = kodiSQL('plexcache')
+    connection.execute('DROP table IF EXISTS metadata')
+    connection.commit()
+    connection.close()
 
     # Remove all cached artwork? (recommended!)
     if dialog('yesno',
@@ -975,6 +1080,81 @@ def LogTime(func):
     return wrapper
 
 
+# All objects with a wake_up() method that threads might be waiting on, e.g.
+# Worker_Queues
+WAITERS = WeakSet()
+
+
+def register_waiter(waiter):
+    """
+    Makes sure wake_up_threads() calls waiter.wake_up(). Use for objects whose
+    Condition threads wait on without a timeout - in Python 2, waiting with a
+    timeout is polling
+    """
+    WAITERS.add(waiter)
+
+
+def wake_up_threads():
+    """
+    Wakes up all threads waiting on a Worker_Queue (or on another registered
+    waiter) to let them check whether they should stop. Call after setting one
+    of the state variables that stop threads, e.g. state.STOP_PKC
+    """
+    for waiter in list(WAITERS):
+        waiter.wake_up()
+
+
+class Worker_Queue(Queue):
+    """
+    Queue.Queue for threads (see thread_methods) that wait for items without
+    polling: get_or_stop() blocks until there's an item or until the thread
+    should stop - stop_thread(), wake_up_threads() and wake_up() wake up the
+    waiting threads. Don't put None into the queue
+    """
+    def __init__(self, maxsize=0):
+        Queue.__init__(self, maxsize)
+        register_waiter(self)
+
+    def get_or_stop(self, stopped):
+        """
+        Removes and returns an item from the queue. Waits until an item is
+        available or until stopped() returns True (then returns None).
+        stopped() is checked every time the thread is woken up
+        """
+        with self.not_empty:
+            while not self._qsize():
+                if stopped():
+                    return
+                self.not_empty.wait()
+            item = self._get()
+            self.not_full.notify()
+            return item
+
+    def put_or_stop(self, item, stopped):
+        """
+        Puts item into the queue, waiting for a free slot if necessary.
+        Returns False if stopped() returned True before (item was not put
+        into the queue), True otherwise
+        """
+        with self.not_full:
+            while 0 < self.maxsize <= self._qsize():
+                if stopped():
+                    return False
+                self.not_full.wait()
+            self._put(item)
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+            return True
+
+    def wake_up(self):
+        """
+        Wakes up all threads waiting in get_or_stop() or put_or_stop()
+        """
+        with self.mutex:
+            self.not_empty.notify_all()
+            self.not_full.notify_all()
+
+
 def thread_methods(cls=None, add_stops=None, add_suspends=None):
     """
     Decorator to add the following methods to a threading class:
@@ -987,6 +1167,9 @@ def thread_methods(cls=None, add_stops=None, add_suspends=None):
     thread_stopped():    returns True if thread is stopped (or should stop ;-))
                          ALSO returns True if PKC should exit
 
+    Threads waiting on a Worker_Queue (or another registered waiter) are woken
+    up by stop_thread() and suspend_thread(), see also wake_up_threads()
+
     Also adds the following class attributes:
         __thread_stopped
         __thread_suspended
@@ -1020,10 +1203,12 @@ def thread_methods(cls=None, add_stops=None, add_suspends=None):
     # Define new class methods and attach them to class
     def stop_thread(self):
         self.__thread_stopped = True
+        wake_up_threads()
     cls.stop_thread = stop_thread
 
     def suspend_thread(self):
         self.__thread_suspended = True
+        wake_up_threads()
     cls.suspend_thread = suspend_thread
 
     def resume_thread(self):
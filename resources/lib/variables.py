@@ -97,6 +97,12 @@ DB_TEXTURE_PATH = tryDecode(xbmc.translatePath(
     "special://database/Textures%s.db" % _DB_TEXTURE_VERSION[KODIVERSION]))
 
 DB_PLEX_PATH = tryDecode(xbmc.translatePath("special://database/plex.db"))
+DB_PLEX_CACHE_PATH = tryDecode(xbmc.translatePath(
+    "special://database/plex_metadata_cache.db"))
+
+# Third party web services for additional artwork, see web_cache
+TMDB_URL = 'https://api.themoviedb.org/3'
+FANARTTV_URL = 'http://webservice.fanart.tv/v3'
 
 EXTERNAL_SUBTITLE_TEMP_PATH = tryDecode(xbmc.translatePath(
     "special://profile/addon_data/%s/temp/" % ADDON_ID))
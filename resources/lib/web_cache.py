@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+On-disk cache for the JSON answers of third party web services, e.g.
+themoviedb.org and fanart.tv. Requests to the same host are rate limited.
+Stored in the same DB as library_sync.metadata_cache
+
+    get_json(url, parameters)   Cached (if not older than ttl) or downloaded
+"""
+from logging import getLogger
+from threading import Lock
+from time import time
+from json import dumps, loads
+from zlib import compress, decompress
+from sqlite3 import Binary
+from urllib import urlencode
+from urlparse import urlparse
+
+from xbmc import sleep
+
+from utils import kodiSQL, tryEncode
+from downloadutils import DownloadUtils
+
+###############################################################################
+
+log = getLogger("PLEX."+__name__)
+
+# Answers older than this many seconds are downloaded again
+CACHE_TTL = 7 * 24 * 60 * 60
+# Same for answers without JSON, e.g. 404 if fanart.tv does not know an item
+NEGATIVE_CACHE_TTL = 24 * 60 * 60
+# Max. number of requests per second to one host
+REQUESTS_PER_SECOND = {
+    'api.themoviedb.org': 4.0,
+    'webservice.fanart.tv': 4.0
+}
+DEFAULT_REQUESTS_PER_SECOND = 4.0
+# Parameters that don't change the answer - not part of the cache key
+IGNORED_PARAMETERS = ('api_key', )
+
+RATE_LIMITERS = {}
+RATE_LIMITERS_LOCK = Lock()
+
+###############################################################################
+
+
+def create_table():
+    """
+    Run once during startup to set up the DB for get_json(). Also drops
+    expired answers
+    """
+    conn = kodiSQL('plexcache')
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS web(
+        key TEXT PRIMARY KEY,
+        fetched_at INTEGER,
+        data BLOB)
+    ''')
+    cursor.execute('DELETE FROM web WHERE fetched_at < ?',
+                   (int(time()) - CACHE_TTL, ))
+    conn.commit()
+    conn.close()
+
+
+class Rate_Limiter(object):
+    """
+    Spaces calls to wait() at least 1/rate seconds apart. Thread safe
+    """
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self.next_slot = 0.0
+        self.lock = Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time()
+            delay = self.next_slot - now
+            self.next_slot = max(now, self.next_slot) + self.interval
+        if delay > 0:
+            sleep(int(delay * 1000))
+
+
+def _rate_limiter(url):
+    host = urlparse(url).netloc
+    with RATE_LIMITERS_LOCK:
+        try:
+            return RATE_LIMITERS[host]
+        except KeyError:
+            limiter = Rate_Limiter(REQUESTS_PER_SECOND.get(
+                host, DEFAULT_REQUESTS_PER_SECOND))
+            RATE_LIMITERS[host] = limiter
+            return limiter
+
+
+def _cache_key(url, parameters):
+    if not parameters:
+        return url
+    parameters = sorted((key, tryEncode(value))
+                        for key, value in parameters.iteritems()
+                        if key not in IGNORED_PARAMETERS)
+    return '%s?%s' % (url, urlencode(parameters))
+
+
+def get_json(url, parameters=None, timeout=None, ttl=CACHE_TTL):
+    """
+    Returns the JSON answer (a dict) of a GET request to url with the dict
+    parameters, from the cache if we downloaded it less than ttl seconds ago.
+    Returns None if the download failed or if the answer was not JSON, e.g.
+    an HTTP 404. The latter is cached for NEGATIVE_CACHE_TTL seconds (at most
+    ttl), failed connections are not cached. Thread safe
+    """
+    key = _cache_key(url, parameters)
+    conn = kodiSQL('plexcache')
+    try:
+        cursor = conn.cursor()
+        cursor.execute('SELECT fetched_at, data FROM web WHERE key = ?',
+                       (key, ))
+        row = cursor.fetchone()
+        if row is not None and row[1] is None:
+            if row[0] >= time() - min(ttl, NEGATIVE_CACHE_TTL):
+                return
+        elif row is not None and row[0] >= time() - ttl:
+            try:
+                return loads(decompress(row[1]))
+            except Exception as err:
+                log.error('Could not read cached answer for %s: %s'
+                          % (key, err))
+        _rate_limiter(url).wait()
+        data = DownloadUtils().downloadUrl(url,
+                                           authenticate=False,
+                                           parameters=parameters,
+                                           timeout=timeout)
+        if data is None:
+            # No connection - try again next time
+            return
+        if not isinstance(data, dict):
+            log.debug('No JSON answer for %s' % key)
+            data = None
+        cursor.execute('''
+            INSERT OR REPLACE INTO web(key, fetched_at, data)
+            VALUES (?, ?, ?)
+        ''', (key,
+              int(time()),
+              None if data is None else Binary(compress(dumps(data)))))
+        conn.commit()
+        return data
+    finally:
+        conn.close()
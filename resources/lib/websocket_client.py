@@ -6,12 +6,11 @@ import websocket
 from json import loads
 import xml.etree.ElementTree as etree
 from threading import Thread
-from Queue import Queue
 from ssl import CERT_NONE
 
 from xbmc import sleep
 
-from utils import window, settings, thread_methods
+from utils import window, settings, thread_methods, Worker_Queue
 from companion import process_command
 import state
 
@@ -155,7 +154,7 @@ class PMS_Websocket(WebSocket):
     Websocket connection with the PMS for Plex Companion
     """
     # Communication with librarysync
-    queue = Queue()
+    queue = Worker_Queue()
 
     def getUri(self):
         server = window('pms_server')
@@ -31,7 +31,7 @@ sys_path.append(_base_resource)
 ###############################################################################
 
 from utils import settings, window, language as lang, dialog, tryEncode, \
-    tryDecode
+    tryDecode, wake_up_threads
 from userclient import UserClient
 import initialsetup
 from kodimonitor import KodiMonitor
@@ -43,11 +43,12 @@ from playqueue import Playqueue
 
 import PlexAPI
 from PlexCompanion import PlexCompanion
-from command_pipeline import Monitor_Window
+from command_pipeline import Command_Server
 from playback_starter import Playback_Starter
 from artwork import Image_Cache_Thread
 import variables as v
 import state
+import metrics
 
 ###############################################################################
 
@@ -92,6 +93,7 @@ class Service():
                value='true' if settings('enableContext') == "true" else "")
         window('fetch_pms_item_number',
                value=settings('fetch_pms_item_number'))
+        metrics.ENABLED = settings('syncMetrics') == 'true'
 
         # Initial logging
         log.warn("======== START %s ========" % v.ADDON_NAME)
@@ -103,6 +105,7 @@ class Service():
         log.warn("Number of sync threads: %s"
                  % settings('syncThreadNumber'))
         log.warn("Log Level: %s" % logLevel)
+        log.warn("Recording sync metrics: %s" % metrics.ENABLED)
         log.warn("Full sys.argv received: %s" % argv)
 
         # Reset window props for profile switch
@@ -116,7 +119,8 @@ class Service():
             "plex_authenticated", "PlexUserImage", "useDirectPaths",
             "kodiplextimeoffset", "countError", "countUnauthorized",
             "plex_restricteduser", "plex_allows_mediaDeletion",
-            "plex_command", "plex_result", "plex_force_transcode_pix"
+            "plex_command_port", "plex_command_token", "plex_sync_metrics",
+            "plex_force_transcode_pix"
         ]
         for prop in properties:
             window(prop, clear=True)
@@ -148,7 +152,7 @@ class Service():
         kodiProfile = v.KODI_PROFILE
 
         # Detect playback start early on
-        self.command_pipeline = Monitor_Window(self)
+        self.command_pipeline = Command_Server(self)
         self.command_pipeline.start()
 
         # Server auto-detect
@@ -268,6 +272,8 @@ class Service():
                             window('plex_online', value="false")
                             # Suspend threads
                             state.SUSPEND_LIBRARY_THREAD = True
+                            # Stops the sync threads
+                            wake_up_threads()
                             log.error("Plex Media Server went offline")
                             if settings('show_pms_offline') == 'true':
                                 dialog('notification',
@@ -327,6 +333,7 @@ class Service():
 
         # Tell all threads to terminate (e.g. several lib sync threads)
         state.STOP_PKC = True
+        wake_up_threads()
         try:
             downloadutils.DownloadUtils().stopSession()
         except:
@@ -0,0 +1,466 @@
+# -*- coding: utf-8 -*-
+"""
+A local fake Plex Media Server for the benchmark. Serves a synthetic library
+of configurable size - movies, TV shows with seasons and episodes, music
+artists with albums and tracks - with everything PKC requests during a full
+sync:
+
+    /library/sections
+    /library/sections/<id>/all          with type=, updatedAt>= and paging
+    /library/sections/<id>/allLeaves    with updatedAt>=, lastViewedAt>=
+    /library/metadata/<id>[,<id>...]
+    /library/metadata/<id>/children
+
+Every answer is delayed by latency seconds. Requests are counted per endpoint
+
+    pms = Fake_PMS(Library(movies=1000), latency=0.01)
+    pms.start()
+    ... pms.url ...
+    pms.stop()
+"""
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+from threading import Thread, Lock
+from urllib import unquote
+from xml.sax.saxutils import quoteattr
+from time import sleep
+
+###############################################################################
+
+# Plex ids of the sections
+MOVIE_SECTION = '1'
+SHOW_SECTION = '2'
+MUSIC_SECTION = '3'
+# Plex' url argument 'type' for the different media types
+PLEX_TYPE_NUMBERS = {
+    '1': 'movie',
+    '2': 'show',
+    '3': 'season',
+    '4': 'episode',
+    '8': 'artist',
+    '9': 'album',
+    '10': 'track'
+}
+# Unix timestamp of the synthetic items' addedAt/updatedAt
+TIMESTAMP = 1500000000
+GENRES = ('Action', 'Comedy', 'Drama', 'Thriller', 'Documentary', 'Horror',
+          'Animation', 'Romance')
+
+###############################################################################
+
+
+class Item(object):
+    """
+    One synthetic Plex item. parent is the Item of the season/TV show resp.
+    album/artist
+    """
+    __slots__ = ('plex_id', 'plex_type', 'section', 'index', 'parent',
+                 'children', 'updated_at')
+
+    def __init__(self, plex_id, plex_type, section, index, parent=None):
+        self.plex_id = plex_id
+        self.plex_type = plex_type
+        self.section = section
+        self.index = index
+        self.parent = parent
+        self.children = []
+        self.updated_at = TIMESTAMP
+        if parent is not None:
+            parent.children.append(self)
+
+    @property
+    def title(self):
+        return '%s %s' % (self.plex_type.capitalize(), self.plex_id)
+
+
+class Library(object):
+    """
+    The synthetic PMS library. Build it with the number of items per media
+    type; all ids are consecutive
+    """
+    def __init__(self, movies=0, shows=0, seasons=0, episodes=0, artists=0,
+                 albums=0, tracks=0):
+        """
+        seasons, episodes: per TV show resp. per season
+        albums, tracks: per artist resp. per album
+        """
+        self.items = {}
+        self.sections = {MOVIE_SECTION: [], SHOW_SECTION: [],
+                         MUSIC_SECTION: []}
+        self.next_id = 1000
+        for i in xrange(movies):
+            self.add('movie', MOVIE_SECTION, i)
+        for i in xrange(shows):
+            show = self.add('show', SHOW_SECTION, i)
+            for j in xrange(1, seasons + 1):
+                season = self.add('season', SHOW_SECTION, j, show)
+                for k in xrange(1, episodes + 1):
+                    self.add('episode', SHOW_SECTION, k, season)
+        for i in xrange(artists):
+            artist = self.add('artist', MUSIC_SECTION, i)
+            for j in xrange(1, albums + 1):
+                album = self.add('album', MUSIC_SECTION, j, artist)
+                for k in xrange(1, tracks + 1):
+                    self.add('track', MUSIC_SECTION, k, album)
+
+    def add(self, plex_type, section, index, parent=None):
+        item = Item(str(self.next_id), plex_type, section, index, parent)
+        self.next_id += 1
+        self.items[item.plex_id] = item
+        self.sections[section].append(item)
+        return item
+
+    def touch(self, every, timestamp):
+        """
+        Marks every n-th item as updated on the PMS at timestamp. Returns the
+        number of items touched
+        """
+        touched = 0
+        for i, item in enumerate(self.sections[MOVIE_SECTION] +
+                                 self.sections[SHOW_SECTION] +
+                                 self.sections[MUSIC_SECTION]):
+            if i % every == 0:
+                item.updated_at = timestamp
+                touched += 1
+        return touched
+
+    def __len__(self):
+        return len(self.items)
+
+
+def _attributes(attributes):
+    return ' '.join('%s=%s' % (key, quoteattr(unicode(value)))
+                    for key, value in attributes)
+
+
+def _media(item, kind):
+    """
+    Media, Part and Stream elements of a movie, episode or track
+    """
+    if kind == 'track':
+        path = '/media/music/%s/%s.flac' % (item.parent.plex_id, item.plex_id)
+        streams = ('<Stream id="%s2" streamType="2" codec="flac" '
+                   'channels="2" selected="1" />' % item.plex_id)
+        media = ('duration="240000" bitrate="1000" audioChannels="2" '
+                 'audioCodec="flac" container="flac"')
+    else:
+        path = '/media/%s/%s/%s.mkv' % (kind, item.plex_id, item.title)
+        streams = (
+            '<Stream id="%s1" streamType="1" codec="h264" index="0" '
+            'height="1080" width="1920" frameRate="23.976" '
+            'language="English" languageCode="eng" />'
+            '<Stream id="%s2" streamType="2" codec="ac3" index="1" '
+            'channels="6" language="English" languageCode="eng" '
+            'selected="1" />'
+            '<Stream id="%s3" streamType="3" codec="srt" index="2" '
+            'language="Deutsch" languageCode="ger" />'
+            % (item.plex_id, item.plex_id, item.plex_id))
+        media = ('duration="5400000" bitrate="8000" width="1920" '
+                 'height="1080" aspectRatio="1.78" audioChannels="6" '
+                 'audioCodec="ac3" videoCodec="h264" videoResolution="1080" '
+                 'container="mkv" videoFrameRate="24p"')
+    return ('<Media id="%s" %s><Part id="%s" key="/library/parts/%s/file" '
+            'file=%s size="1000000" container="mkv">%s</Part></Media>'
+            % (item.plex_id, media, item.plex_id, item.plex_id,
+               quoteattr(path), streams))
+
+
+def _tags(item, full):
+    """
+    Genre, Role etc. child elements. Only full metadata has all of them
+    """
+    number = int(item.plex_id)
+    genres = ''.join(
+        '<Genre id="%s" tag="%s" />'
+        % ((number + i) % len(GENRES), GENRES[(number + i) % len(GENRES)])
+        for i in range(2))
+    if not full:
+        return genres
+    if item.plex_type in ('artist', 'album', 'track'):
+        return genres + '<Mood id="1" tag="Calm" />'
+    return genres + ''.join((
+        '<Director id="%s" tag="Director %s" />'
+        % (10000 + number % 300, number % 300),
+        '<Writer id="%s" tag="Writer %s" />'
+        % (20000 + number % 500, number % 500),
+        '<Country id="%s" tag="Country %s" />'
+        % (30000 + number % 20, number % 20),
+        ''.join('<Role id="%s" tag="Actor %s" role="Role %s" thumb='
+                '"http://image.tmdb.org/t/p/original/actor%s.jpg" />'
+                % (40000 + (number * 7 + i) % 5000, (number * 7 + i) % 5000,
+                   i, (number * 7 + i) % 5000)
+                for i in range(8)),
+        '<Collection id="%s" tag="Collection %s" />'
+        % (50000 + number % 50, number % 50)
+        if item.plex_type == 'movie' and number % 5 == 0 else ''))
+
+
+def element(item, full=True):
+    """
+    Returns the xml string for item - as part of a section listing or, if
+    full, with all its metadata
+    """
+    parent = item.parent
+    grandparent = parent.parent if parent is not None else None
+    attributes = [
+        ('ratingKey', item.plex_id),
+        ('key', '/library/metadata/%s%s'
+                % (item.plex_id, '/children' if item.children else '')),
+        ('guid', 'com.plexapp.agents.imdb://tt%07d?lang=en' % int(
+            item.plex_id)),
+        ('librarySectionID', item.section),
+        ('type', item.plex_type),
+        ('title', item.title),
+        ('titleSort', item.title),
+        ('summary', 'Synthetic summary of %s' % item.title),
+        ('index', item.index),
+        ('year', 2000 + int(item.plex_id) % 18),
+        ('rating', '%.1f' % (int(item.plex_id) % 100 / 10.0)),
+        ('contentRating', 'PG-13'),
+        ('studio', 'Studio %s' % (int(item.plex_id) % 40)),
+        ('thumb', '/library/metadata/%s/thumb/%s'
+                  % (item.plex_id, item.updated_at)),
+        ('art', '/library/metadata/%s/art/%s'
+                % (item.plex_id, item.updated_at)),
+        ('originallyAvailableAt', '2001-05-04'),
+        ('addedAt', TIMESTAMP),
+        ('updatedAt', item.updated_at)]
+    if int(item.plex_id) % 3 == 0:
+        attributes.extend((('viewCount', 1), ('lastViewedAt', TIMESTAMP)))
+    if parent is not None:
+        attributes.extend((
+            ('parentRatingKey', parent.plex_id),
+            ('parentKey', '/library/metadata/%s' % parent.plex_id),
+            ('parentTitle', parent.title),
+            ('parentIndex', parent.index),
+            ('parentThumb', '/library/metadata/%s/thumb/%s'
+                            % (parent.plex_id, parent.updated_at))))
+    if grandparent is not None:
+        attributes.extend((
+            ('grandparentRatingKey', grandparent.plex_id),
+            ('grandparentKey', '/library/metadata/%s' % grandparent.plex_id),
+            ('grandparentTitle', grandparent.title),
+            ('grandparentThumb', '/library/metadata/%s/thumb/%s'
+                                 % (grandparent.plex_id,
+                                    grandparent.updated_at)),
+            ('grandparentArt', '/library/metadata/%s/art/%s'
+                               % (grandparent.plex_id,
+                                  grandparent.updated_at))))
+    if item.plex_type in ('movie', 'episode', 'track'):
+        attributes.append(('duration', 240000 if item.plex_type == 'track'
+                           else 5400000))
+        children = _media(item, item.plex_type) + _tags(item, full)
+        tag = 'Track' if item.plex_type == 'track' else 'Video'
+    else:
+        if item.plex_type in ('show', 'season'):
+            leaves = (item.children if item.plex_type == 'season' else
+                      [e for season in item.children
+                       for e in season.children])
+            attributes.extend((('leafCount', len(leaves)),
+                               ('viewedLeafCount', 0),
+                               ('childCount', len(item.children))))
+        children = _tags(item, full)
+        if item.plex_type == 'show':
+            children += '<Location path="/media/show/%s" />' % item.plex_id
+        tag = 'Directory'
+    return '<%s %s>%s</%s>' % (tag, _attributes(attributes), children, tag)
+
+
+def container(elements, size=None, offset=0, **attributes):
+    attributes.setdefault('identifier', 'com.plexapp.plugins.library')
+    attributes['size'] = len(elements)
+    attributes['totalSize'] = len(elements) if size is None else size
+    attributes['offset'] = offset
+    return ('<?xml version="1.0" encoding="UTF-8"?>\n<MediaContainer %s>%s'
+            '</MediaContainer>'
+            % (_attributes(sorted(attributes.items())), ''.join(elements)))
+
+
+class Request_Stats(object):
+    """
+    Thread safe counters of the requests the fake PMS answered
+    """
+    def __init__(self):
+        self.lock = Lock()
+        # {endpoint: number of requests}
+        self.requests = {}
+        self.bytes_sent = 0
+
+    def add(self, endpoint, size):
+        with self.lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+            self.bytes_sent += size
+
+    def total(self):
+        with self.lock:
+            return sum(self.requests.itervalues())
+
+    def reset(self):
+        with self.lock:
+            self.requests = {}
+            self.bytes_sent = 0
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # Keep-alive, just like the PMS
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        pms = self.server.pms
+        if pms.latency:
+            sleep(pms.latency)
+        path, _, query = self.path.partition('?')
+        args = {}
+        for arg in query.split('&'):
+            if not arg:
+                continue
+            # PKC sends e.g. updatedAt>=1500000000 unencoded
+            for separator in ('>=', '='):
+                if separator in arg:
+                    key, value = arg.split(separator, 1)
+                    args[unquote(key) + separator.rstrip('=')] = unquote(
+                        value)
+                    break
+        try:
+            endpoint, body = pms.answer(path, args)
+        except Exception as err:
+            endpoint, body = 'error', None
+            self.send_error(500, str(err))
+        if body is None:
+            if endpoint != 'error':
+                self.send_error(404)
+            pms.stats.add(endpoint, 0)
+            return
+        body = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/xml;charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        pms.stats.add(endpoint, len(body))
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    request_queue_size = 64
+
+
+class Fake_PMS(object):
+    """
+    The fake PMS serving library on http://127.0.0.1:<port>, with every
+    answer delayed by latency seconds
+    """
+    def __init__(self, library, latency=0.0):
+        self.library = library
+        self.latency = latency
+        self.stats = Request_Stats()
+        self.server = _Server(('127.0.0.1', 0), _Handler)
+        self.server.pms = self
+        self.url = 'http://127.0.0.1:%s' % self.server.server_address[1]
+        self.thread = None
+
+    def start(self):
+        self.thread = Thread(target=self.server.serve_forever)
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def answer(self, path, args):
+        """
+        Returns the tuple (endpoint name, xml string or None for 404)
+        """
+        parts = path.strip('/').split('/')
+        if parts == ['library', 'sections']:
+            return 'sections', self.sections()
+        if parts[:2] == ['library', 'sections'] and len(parts) == 4:
+            if parts[3] == 'all':
+                return 'section_all', self.section_all(parts[2], args)
+            if parts[3] == 'allLeaves':
+                return 'section_leaves', self.section_leaves(parts[2], args)
+            return 'section_other', container([])
+        if parts[:2] == ['library', 'metadata'] and len(parts) == 3:
+            return 'metadata', self.metadata(parts[2].split(','))
+        if (parts[:2] == ['library', 'metadata'] and len(parts) == 4 and
+                parts[3] == 'children'):
+            return 'children', self.children(parts[2], args)
+        # E.g. /identity, /status/sessions
+        return 'other', container([])
+
+    def sections(self):
+        directories = []
+        for key, plex_type, title in (
+                (MOVIE_SECTION, 'movie', 'Movies'),
+                (SHOW_SECTION, 'show', 'TV Shows'),
+                (MUSIC_SECTION, 'artist', 'Music')):
+            directories.append(
+                '<Directory allowSync="1" key="%s" type="%s" title="%s" '
+                'agent="com.plexapp.agents.none" language="en" '
+                'updatedAt="%s"><Location id="%s" path="/media/%s" />'
+                '</Directory>'
+                % (key, plex_type, title, TIMESTAMP, key, plex_type))
+        return container(directories, title1='Plex Library')
+
+    def _page(self, items, args, **attributes):
+        updated_since = int(args.get('updatedAt>', 0))
+        if updated_since:
+            items = [item for item in items
+                     if item.updated_at >= updated_since]
+        if args.get('lastViewedAt>'):
+            # We never play anything
+            items = []
+        start = int(args.get('X-Plex-Container-Start', 0))
+        size = int(args.get('X-Plex-Container-Size', len(items)))
+        return container([element(item, full=False)
+                          for item in items[start:start + size]],
+                         size=len(items),
+                         offset=start,
+                         **attributes)
+
+    def section_all(self, section, args):
+        try:
+            items = self.library.sections[section]
+        except KeyError:
+            return
+        default_type = {MOVIE_SECTION: 'movie',
+                        SHOW_SECTION: 'show',
+                        MUSIC_SECTION: 'artist'}[section]
+        plex_type = PLEX_TYPE_NUMBERS.get(args.get('type'), default_type)
+        return self._page([item for item in items
+                           if item.plex_type == plex_type],
+                          args,
+                          librarySectionID=section)
+
+    def section_leaves(self, section, args):
+        try:
+            items = self.library.sections[section]
+        except KeyError:
+            return
+        return self._page([item for item in items
+                           if item.plex_type in ('movie', 'episode',
+                                                 'track')],
+                          args,
+                          librarySectionID=section)
+
+    def metadata(self, plex_ids):
+        items = [self.library.items[plex_id] for plex_id in plex_ids
+                 if plex_id in self.library.items]
+        if not items:
+            return
+        return container([element(item) for item in items],
+                         librarySectionID=items[0].section)
+
+    def children(self, plex_id, args):
+        try:
+            item = self.library.items[plex_id]
+        except KeyError:
+            return
+        return self._page(item.children,
+                          args,
+                          key=plex_id,
+                          librarySectionID=item.section)
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+Empty Kodi 17 Krypton databases (MyVideos107, MyMusic60, Textures13) for the
+benchmark. Only the tables and indexes PKC reads or writes - copied from
+Kodi's VideoDatabase.cpp, MusicDatabase.cpp and TextureDatabase.cpp.
+
+    create_dbs(database_dir)
+"""
+from os.path import join
+import sqlite3
+
+###############################################################################
+
+_VIDEO_COLUMNS = ', '.join('c%02d text' % i for i in range(24))
+
+VIDEO_DB = 'MyVideos107.db'
+VIDEO_SCHEMA = (
+    'CREATE TABLE version (idVersion integer, iCompressCount integer)',
+    'CREATE TABLE bookmark (idBookmark integer primary key, idFile integer, '
+    'timeInSeconds double, totalTimeInSeconds double, thumbNailImage text, '
+    'player text, playerState text, type integer)',
+    'CREATE INDEX ix_bookmark ON bookmark (idFile, type)',
+    'CREATE TABLE settings (idFile integer, Deinterlace bool, '
+    'ViewMode integer, ZoomAmount float, PixelRatio float, '
+    'VerticalShift float, AudioStream integer, SubtitleStream integer, '
+    'SubtitleDelay float, SubtitlesOn bool, Brightness float, '
+    'Contrast float, Gamma float, VolumeAmplification float, '
+    'AudioDelay float, OutputToAllSpeakers bool, ResumeTime integer, '
+    'Sharpness float, NoiseReduction float, NonLinStretch bool, '
+    'PostProcess bool, ScalingMethod integer, DeinterlaceMode integer, '
+    'StereoMode integer, StereoInvert bool, VideoStream integer)',
+    'CREATE UNIQUE INDEX ix_settings ON settings (idFile)',
+    'CREATE TABLE stacktimes (idFile integer, times text)',
+    'CREATE UNIQUE INDEX ix_stacktimes ON stacktimes (idFile)',
+    'CREATE TABLE genre (genre_id integer primary key, name TEXT)',
+    'CREATE UNIQUE INDEX ix_genre_1 ON genre (name)',
+    'CREATE TABLE genre_link (genre_id integer, media_id integer, '
+    'media_type TEXT)',
+    'CREATE UNIQUE INDEX ix_genre_link_1 ON genre_link '
+    '(genre_id, media_type, media_id)',
+    'CREATE TABLE country (country_id integer primary key, name TEXT)',
+    'CREATE UNIQUE INDEX ix_country_1 ON country (name)',
+    'CREATE TABLE country_link (country_id integer, media_id integer, '
+    'media_type TEXT)',
+    'CREATE UNIQUE INDEX ix_country_link_1 ON country_link '
+    '(country_id, media_type, media_id)',
+    'CREATE TABLE movie (idMovie integer primary key, idFile integer, %s, '
+    'idSet integer, userrating integer, premiered text)' % _VIDEO_COLUMNS,
+    'CREATE UNIQUE INDEX ix_movie_file_1 ON movie (idFile, idMovie)',
+    'CREATE TABLE actor (actor_id INTEGER PRIMARY KEY, name TEXT, '
+    'art_urls TEXT)',
+    'CREATE UNIQUE INDEX ix_actor_1 ON actor (name)',
+    'CREATE TABLE actor_link (actor_id INTEGER, media_id INTEGER, '
+    'media_type TEXT, role TEXT, cast_order INTEGER)',
+    'CREATE UNIQUE INDEX ix_actor_link_1 ON actor_link '
+    '(actor_id, media_type, media_id, role)',
+    'CREATE TABLE director_link (actor_id INTEGER, media_id INTEGER, '
+    'media_type TEXT)',
+    'CREATE UNIQUE INDEX ix_director_link_1 ON director_link '
+    '(actor_id, media_type, media_id)',
+    'CREATE TABLE writer_link (actor_id INTEGER, media_id INTEGER, '
+    'media_type TEXT)',
+    'CREATE UNIQUE INDEX ix_writer_link_1 ON writer_link '
+    '(actor_id, media_type, media_id)',
+    'CREATE TABLE path (idPath integer primary key, strPath text, '
+    'strContent text, strScraper text, strHash text, '
+    'scanRecursive integer, useFolderNames bool, strSettings text, '
+    'noUpdate bool, exclude bool, dateAdded text, idParentPath integer)',
+    'CREATE UNIQUE INDEX ix_path ON path (strPath)',
+    'CREATE TABLE files (idFile integer primary key, idPath integer, '
+    'strFilename text, playCount integer, lastPlayed text, dateAdded text)',
+    'CREATE UNIQUE INDEX ix_files ON files (idPath, strFilename)',
+    'CREATE TABLE tvshow (idShow integer primary key, %s, '
+    'userrating integer, duration INTEGER)' % _VIDEO_COLUMNS,
+    'CREATE TABLE episode (idEpisode integer primary key, idFile integer, '
+    '%s, idShow integer, userrating integer, idSeason integer)'
+    % _VIDEO_COLUMNS,
+    'CREATE UNIQUE INDEX ix_episode_file_1 ON episode (idEpisode, idFile)',
+    'CREATE INDEX ix_episode_show1 ON episode (idEpisode, idShow)',
+    'CREATE TABLE tvshowlinkpath (idShow integer, idPath integer)',
+    'CREATE UNIQUE INDEX ix_tvshowlinkpath_1 ON tvshowlinkpath '
+    '(idShow, idPath)',
+    'CREATE TABLE movielinktvshow (idMovie integer, IdShow integer)',
+    'CREATE TABLE studio (studio_id integer primary key, name TEXT)',
+    'CREATE UNIQUE INDEX ix_studio_1 ON studio (name)',
+    'CREATE TABLE studio_link (studio_id integer, media_id integer, '
+    'media_type TEXT)',
+    'CREATE UNIQUE INDEX ix_studio_link_1 ON studio_link '
+    '(studio_id, media_type, media_id)',
+    'CREATE TABLE musicvideo (idMVideo integer primary key, '
+    'idFile integer, %s, userrating integer, premiered text)'
+    % _VIDEO_COLUMNS,
+    'CREATE TABLE streamdetails (idFile integer, iStreamType integer, '
+    'strVideoCodec text, fVideoAspect float, iVideoWidth integer, '
+    'iVideoHeight integer, strAudioCodec text, iAudioChannels integer, '
+    'strAudioLanguage text, strSubtitleLanguage text, '
+    'iVideoDuration integer, strStereoMode text, strVideoLanguage text)',
+    'CREATE INDEX ix_streamdetails ON streamdetails (idFile)',
+    'CREATE TABLE sets (idSet integer primary key, strSet text, '
+    'strOverview text)',
+    'CREATE TABLE seasons (idSeason integer primary key, idShow integer, '
+    'season integer, name text, userrating integer)',
+    'CREATE UNIQUE INDEX ix_seasons ON seasons (idShow, season)',
+    'CREATE TABLE art (art_id INTEGER PRIMARY KEY, media_id INTEGER, '
+    'media_type TEXT, type TEXT, url TEXT)',
+    'CREATE INDEX ix_art ON art (media_id, media_type, type)',
+    'CREATE TABLE tag (tag_id integer primary key, name TEXT)',
+    'CREATE UNIQUE INDEX ix_tag_1 ON tag (name)',
+    'CREATE TABLE tag_link (tag_id integer, media_id integer, '
+    'media_type TEXT)',
+    'CREATE UNIQUE INDEX ix_tag_link_1 ON tag_link '
+    '(tag_id, media_type, media_id)',
+    'CREATE TABLE rating (rating_id INTEGER PRIMARY KEY, media_id INTEGER, '
+    'media_type TEXT, rating_type TEXT, rating FLOAT, votes INTEGER)',
+    'CREATE INDEX ix_rating ON rating (media_id, media_type)',
+    'CREATE TABLE uniqueid (uniqueid_id INTEGER PRIMARY KEY, '
+    'media_id INTEGER, media_type TEXT, value TEXT, type TEXT)',
+    'CREATE INDEX ix_uniqueid1 ON uniqueid (media_id, media_type, type)',
+    'CREATE INDEX ix_uniqueid2 ON uniqueid (media_type, value)',
+)
+
+MUSIC_DB = 'MyMusic60.db'
+MUSIC_SCHEMA = (
+    'CREATE TABLE version (idVersion integer, iCompressCount integer)',
+    'CREATE TABLE artist (idArtist integer primary key, '
+    'strArtist varchar(256), strMusicBrainzArtistID text, strBorn text, '
+    'strFormed text, strGenres text, strMoods text, strStyles text, '
+    'strInstruments text, strBiography text, strDied text, '
+    'strDisbanded text, strYearsActive text, strImage text, '
+    'strFanart text, lastScraped varchar(20) default NULL)',
+    'CREATE INDEX idxArtist ON artist (strArtist)',
+    'CREATE TABLE album (idAlbum integer primary key, '
+    'strAlbum varchar(256), strMusicBrainzAlbumID text, strArtists text, '
+    'strGenres text, iYear integer, idThumb integer, '
+    "bCompilation integer not null default '0', strMoods text, "
+    'strStyles text, strThemes text, strReview text, strImage text, '
+    'strLabel text, strType text, fRating FLOAT NOT NULL DEFAULT 0, '
+    'iUserrating INTEGER NOT NULL DEFAULT 0, '
+    'lastScraped varchar(20) default NULL, strReleaseType text, '
+    'iVotes INTEGER NOT NULL DEFAULT 0)',
+    'CREATE INDEX idxAlbum ON album (strAlbum)',
+    'CREATE TABLE album_artist (idArtist integer, idAlbum integer, '
+    'iOrder integer, strArtist text)',
+    'CREATE UNIQUE INDEX idxAlbumArtist_1 ON album_artist '
+    '(idAlbum, idArtist)',
+    'CREATE TABLE album_genre (idGenre integer, idAlbum integer, '
+    'iOrder integer)',
+    'CREATE UNIQUE INDEX idxAlbumGenre_1 ON album_genre (idAlbum, idGenre)',
+    'CREATE TABLE genre (idGenre integer primary key, '
+    'strGenre varchar(256))',
+    'CREATE INDEX idxGenre ON genre (strGenre)',
+    'CREATE TABLE path (idPath integer primary key, strPath varchar(512), '
+    'strHash text)',
+    'CREATE UNIQUE INDEX idxPath ON path (strPath)',
+    'CREATE TABLE song (idSong integer primary key, idAlbum integer, '
+    'idPath integer, strArtists text, strGenres text, '
+    'strTitle varchar(512), iTrack integer, iDuration integer, '
+    'iYear integer, dwFileNameCRC text, strFileName text, '
+    'strMusicBrainzTrackID text, iTimesPlayed integer, '
+    'iStartOffset integer, iEndOffset integer, idThumb integer, '
+    'lastplayed varchar(20) default NULL, '
+    'rating FLOAT NOT NULL DEFAULT 0, '
+    'userrating INTEGER NOT NULL DEFAULT 0, comment text, mood text, '
+    'dateAdded text, votes INTEGER NOT NULL DEFAULT 0)',
+    'CREATE INDEX idxSong3 ON song (idAlbum)',
+    'CREATE TABLE song_artist (idArtist integer, idSong integer, '
+    'idRole integer, iOrder integer, strArtist text)',
+    'CREATE UNIQUE INDEX idxSongArtist_1 ON song_artist '
+    '(idSong, idArtist, idRole)',
+    'CREATE TABLE song_genre (idGenre integer, idSong integer, '
+    'iOrder integer)',
+    'CREATE UNIQUE INDEX idxSongGenre_1 ON song_genre (idSong, idGenre)',
+    'CREATE TABLE role (idRole integer primary key, strRole text)',
+    "INSERT INTO role(idRole, strRole) VALUES (1, 'Artist')",
+    'CREATE TABLE discography (idArtist integer, strAlbum text, '
+    'strYear text)',
+    'CREATE TABLE albuminfosong (idAlbumInfoSong integer primary key, '
+    'idAlbumInfo integer, iTrack integer, strTitle text, '
+    'iDuration integer)',
+    'CREATE TABLE art (art_id INTEGER PRIMARY KEY, media_id INTEGER, '
+    'media_type TEXT, type TEXT, url TEXT)',
+    'CREATE INDEX ix_art ON art (media_id, media_type, type)',
+)
+
+TEXTURE_DB = 'Textures13.db'
+TEXTURE_SCHEMA = (
+    'CREATE TABLE version (idVersion integer, iCompressCount integer)',
+    'CREATE TABLE texture (id integer primary key, url text, '
+    'cachedurl text, imagehash text, lasthashcheck text)',
+    'CREATE INDEX idxTexture ON texture (url)',
+    'CREATE TABLE sizes (idtexture integer, size integer, width integer, '
+    'height integer, usecount integer, lastusetime text)',
+    'CREATE INDEX idxSize ON sizes (idtexture, size)',
+)
+
+###############################################################################
+
+
+def create_dbs(database_dir):
+    """
+    Creates the empty Kodi DBs in the directory database_dir
+    """
+    for name, schema in ((VIDEO_DB, VIDEO_SCHEMA),
+                         (MUSIC_DB, MUSIC_SCHEMA),
+                         (TEXTURE_DB, TEXTURE_SCHEMA)):
+        conn = sqlite3.connect(join(database_dir, name))
+        for statement in schema:
+            conn.execute(statement)
+        conn.commit()
+        conn.close()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the lookups in PKC's Plex DB (plexdb_functions) on a synthetic
+plex table - before and after migration.migrate_plex_table, i.e. with the old
+schema (TEXT plex_id, string checksums, no indexes) and with the current one
+(INTEGER PRIMARY KEY plex_id, int checksums, covering indexes).
+
+    python2 tests/benchmark/plex_db_benchmark.py --rows 500000
+
+Reports milliseconds per call of every lookup and how long the migration
+took. Needs no Kodi, the Kodi modules are stubbed (stubs/)
+"""
+import argparse
+from os import environ
+from os.path import abspath, dirname, join, getsize
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+from time import time
+
+BENCHMARK_DIR = dirname(abspath(__file__))
+ADDON_DIR = dirname(dirname(BENCHMARK_DIR))
+
+# (plex_type, kodi_type) of the synthetic rows, in turn
+TYPES = (('movie', 'movie'),
+         ('episode', 'episode'),
+         ('season', 'season'),
+         ('show', 'tvshow'),
+         ('track', 'song'))
+# Number of views the rows are spread over
+VIEWS = 20
+# Plex id of the first row
+FIRST_ID = 1000
+
+###############################################################################
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the Plex DB lookups before and after the '
+                    'plex table migration')
+    parser.add_argument('--rows', type=int, default=500000,
+                        help='rows of the synthetic plex table. Default: '
+                             '%(default)s')
+    parser.add_argument('--calls', type=int, default=200,
+                        help='calls of every single-item lookup. Default: '
+                             '%(default)s')
+    parser.add_argument('--seed', type=int, default=1)
+    return parser.parse_args()
+
+
+def create_old_table(cursor, rows):
+    """
+    Fills the plex table the way PKC did before the migration
+    """
+    cursor.execute('''
+        CREATE TABLE plex(
+            plex_id TEXT UNIQUE, view_id TEXT, plex_type TEXT, kodi_type TEXT,
+            kodi_id INTEGER, kodi_fileid INTEGER, kodi_pathid INTEGER,
+            parent_id INTEGER, checksum INTEGER, fanart_synced INTEGER)
+    ''')
+    data = []
+    for i in xrange(rows):
+        plex_type, kodi_type = TYPES[i % len(TYPES)]
+        data.append((str(i + FIRST_ID), str(i % VIEWS), plex_type,
+                     kodi_type, i // 5, i // 5, i % 1000, i // 50,
+                     'K%s%s' % (i + FIRST_ID, 1500000000 + i), i % 2))
+    cursor.executemany('INSERT INTO plex VALUES (?,?,?,?,?,?,?,?,?,?)', data)
+
+
+def run_lookups(cursor, rows, calls):
+    """
+    Returns a list of (lookup, milliseconds per call)
+    """
+    import plexdb_functions as plexdb
+    plex_db = plexdb.Plex_DB_Functions(cursor)
+    numbers = [random.randrange(rows) for _ in xrange(calls)]
+    lookups = (
+        # Single items - called for every item of a sync
+        ('getItem_byId', calls,
+         lambda i: plex_db.getItem_byId(str(i + FIRST_ID))),
+        ('getItem_byKodiId', calls,
+         lambda i: plex_db.getItem_byKodiId(i // 5, 'movie')),
+        ('getItem_byFileId', calls,
+         lambda i: plex_db.getItem_byFileId(i // 5, 'episode')),
+        ('getItemId_byParentId', calls,
+         lambda i: plex_db.getItemId_byParentId(i // 50, 'episode')),
+        # Many items - called once per view or sync
+        ('getItem_byView', 5,
+         lambda i: plex_db.getItem_byView(str(i % VIEWS))),
+        ('getChecksum', 5,
+         lambda i: plex_db.getChecksum('movie')),
+        ('get_missing_fanart', 5,
+         lambda i: plex_db.get_missing_fanart()),
+    )
+    result = []
+    for name, number, lookup in lookups:
+        start = time()
+        for i in numbers[:number]:
+            lookup(i)
+        result.append((name, (time() - start) * 1000 / number))
+    return result
+
+
+def main():
+    args = parse_args()
+    random.seed(args.seed)
+    home = tempfile.mkdtemp(prefix='pkc_benchmark_')
+    environ['PKC_BENCHMARK_HOME'] = home
+    sys.path[:0] = [join(BENCHMARK_DIR, 'stubs'),
+                    join(ADDON_DIR, 'resources', 'lib')]
+    import plexdb_functions as plexdb
+    import migration
+    try:
+        path = join(home, 'plex.db')
+        conn = sqlite3.connect(path)
+        cursor = conn.cursor()
+        create_old_table(cursor, args.rows)
+        conn.commit()
+        before = run_lookups(cursor, args.rows, args.calls)
+
+        start = time()
+        migration.migrate_plex_table(cursor)
+        cursor.execute(plexdb.PLEX_TABLE)
+        for query in plexdb.PLEX_INDEXES:
+            cursor.execute(query)
+        conn.commit()
+        migration_time = time() - start
+        after = run_lookups(cursor, args.rows, args.calls)
+        size = getsize(path)
+        conn.close()
+    finally:
+        shutil.rmtree(home, ignore_errors=True)
+
+    print('Plex DB lookups, synthetic plex table with %s rows, ms per call'
+          % args.rows)
+    print('%-22s %10s %10s' % ('', 'before', 'after'))
+    for (name, old), (_, new) in zip(before, after):
+        print('%-22s %10.3f %10.3f' % (name, old, new))
+    print('Migrating the table and building the indexes took %.1f s'
+          % migration_time)
+    print('DB size after the migration: %.1f MB' % (size / 1e6))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
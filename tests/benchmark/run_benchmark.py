@@ -0,0 +1,309 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+"""
+Offline benchmark of PKC's full sync - no Plex Media Server and no Kodi
+needed. Starts a local fake PMS (fake_pms.py) with a synthetic library, stubs
+Kodi's python modules (stubs/), creates empty Kodi 17 DBs (kodi_dbs.py) in a
+temporary directory and runs LibrarySync.fullSync() end to end.
+
+Every scenario is one full sync:
+    initial     into the empty DBs
+    unchanged   nothing changed on the PMS
+    changed     1 in every --change-every items was updated on the PMS
+    repair      a repair sync, re-syncing every item
+    incremental an incremental sync after the changes
+
+Reports items/s, peak RSS and the number of requests per PMS endpoint.
+Needs Python 2.7 with requests installed, e.g.
+
+    python2 tests/benchmark/run_benchmark.py --movies 2000 --latency 5
+    python2 tests/benchmark/run_benchmark.py --json results.json
+
+Exits with 1 if a sync failed or, with --min-items-per-second, if the initial
+sync was slower - e.g. to catch regressions in CI
+"""
+import argparse
+import json
+import logging
+from os import environ, makedirs
+from os.path import abspath, dirname, join
+import shutil
+import sqlite3
+import sys
+import tempfile
+from time import time
+
+BENCHMARK_DIR = dirname(abspath(__file__))
+ADDON_DIR = dirname(dirname(BENCHMARK_DIR))
+ADDON_ID = 'plugin.video.plexkodiconnect'
+
+log = logging.getLogger('PLEX.benchmark')
+
+###############################################################################
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Benchmark PKC full syncs against a local fake PMS')
+    library = parser.add_argument_group('synthetic PMS library')
+    library.add_argument('--movies', type=int, default=1000)
+    library.add_argument('--shows', type=int, default=50)
+    library.add_argument('--seasons', type=int, default=3,
+                         help='per TV show')
+    library.add_argument('--episodes', type=int, default=10,
+                         help='per season')
+    library.add_argument('--artists', type=int, default=20)
+    library.add_argument('--albums', type=int, default=3,
+                         help='per artist')
+    library.add_argument('--tracks', type=int, default=10,
+                         help='per album')
+    library.add_argument('--latency', type=float, default=0.0,
+                         help='milliseconds the fake PMS waits before every '
+                              'answer')
+    sync = parser.add_argument_group('PKC settings')
+    sync.add_argument('--threads', type=int, default=None,
+                      help='download threads (setting syncThreadNumber)')
+    sync.add_argument('--batch-size', type=int, default=None,
+                      help='setting syncMetadataBatchSize')
+    sync.add_argument('--chunk-size', type=int, default=None,
+                      help='setting limitindex')
+    sync.add_argument('--no-music', action='store_true',
+                      help='disable music sync')
+    parser.add_argument('--scenarios', default='initial,unchanged,changed',
+                        help='comma separated, see above. Default: '
+                             '%(default)s')
+    parser.add_argument('--change-every', type=int, default=100,
+                        help='scenario changed: touch every n-th PMS item')
+    parser.add_argument('--json', metavar='PATH',
+                        help='also write the results to this JSON file')
+    parser.add_argument('--min-items-per-second', type=float, default=None,
+                        help='fail if the initial sync was slower')
+    parser.add_argument('--home', metavar='DIR',
+                        help='Kodi home directory to use (kept afterwards); '
+                             'default: a temporary directory')
+    parser.add_argument('--verbose', '-v', action='store_true',
+                        help='log PKC debug messages to the console')
+    return parser.parse_args()
+
+
+def setup_kodi(home):
+    """
+    Points the Kodi stubs to home, creates the Kodi DBs there and makes PKC
+    importable
+    """
+    environ['PKC_BENCHMARK_HOME'] = home
+    for directory in ('userdata/Database',
+                      'userdata/Thumbnails',
+                      'userdata/addon_data/%s' % ADDON_ID,
+                      'userdata/library/video',
+                      'userdata/playlists/video',
+                      'temp'):
+        try:
+            makedirs(join(home, directory))
+        except OSError:
+            pass
+    sys.path[:0] = [join(BENCHMARK_DIR, 'stubs'),
+                    join(ADDON_DIR, 'resources', 'lib')]
+    import kodi_dbs
+    kodi_dbs.create_dbs(join(home, 'userdata', 'Database'))
+
+
+def setup_logging(home, verbose):
+    """
+    PKC logs to home/pkc.log; to the console only if verbose
+    """
+    root = logging.getLogger('PLEX')
+    root.setLevel(logging.DEBUG)
+    handler = logging.FileHandler(join(home, 'pkc.log'))
+    handler.setFormatter(logging.Formatter(
+        '%(asctime)s %(threadName)s %(name)s %(levelname)s: %(message)s'))
+    root.addHandler(handler)
+    console = logging.StreamHandler()
+    console.setFormatter(logging.Formatter('%(name)s: %(message)s'))
+    console.setLevel(logging.DEBUG if verbose else logging.ERROR)
+    root.addHandler(console)
+
+
+def setup_pkc(args, pms_url):
+    """
+    Sets PKC's settings and state as if the user had just signed in to our
+    fake PMS
+    """
+    import xbmcaddon
+    xbmcaddon.Addon()
+    settings = xbmcaddon.SETTINGS
+    settings.update({
+        'enableMusic': 'false' if args.no_music else 'true',
+        'dbSyncIndicator': 'false',
+        'FanartTV': 'false',
+        'enableTextureCache': 'false',
+        'syncMetrics': 'true',
+        'useDirectPaths': '0',
+        'SyncInstallRunDone': 'true',
+        'plexToken': 'benchmark',
+        'plexid': 'benchmark',
+        'serverid': 'benchmark',
+        'plex_servername': 'Fake PMS'
+    })
+    if args.threads is not None:
+        settings['syncThreadNumber'] = str(args.threads)
+    if args.batch_size is not None:
+        settings['syncMetadataBatchSize'] = str(args.batch_size)
+    if args.chunk_size is not None:
+        settings['limitindex'] = str(args.chunk_size)
+
+    from utils import window
+    import state
+    import metrics
+    import downloadutils
+    window('pms_server', value=pms_url)
+    window('pms_token', value='benchmark')
+    window('plex_online', value='true')
+    window('plex_serverStatus', clear=True)
+    window('plex_pathverified', value='true')
+    state.AUTHENTICATED = True
+    state.PLEX_TOKEN = 'benchmark'
+    state.DIRECT_PATHS = False
+    metrics.ENABLED = True
+    downloadutils.DownloadUtils().startSession(reset=True)
+
+
+def count_rows(home):
+    """
+    Returns {table: number of rows} of the Kodi DB tables with our items
+    """
+    import kodi_dbs
+    result = {}
+    for db, tables in ((kodi_dbs.VIDEO_DB, ('movie', 'tvshow', 'seasons',
+                                            'episode')),
+                       (kodi_dbs.MUSIC_DB, ('artist', 'album', 'song'))):
+        conn = sqlite3.connect(join(home, 'userdata', 'Database', db))
+        for table in tables:
+            result[table] = conn.execute(
+                'SELECT COUNT(*) FROM %s' % table).fetchone()[0]
+        conn.close()
+    return result
+
+
+def run_scenario(name, args, library, pms):
+    """
+    Runs one full sync and returns its results as a dict
+    """
+    from librarysync import LibrarySync
+    import fake_pms
+    import metrics
+    if name == 'changed' or name == 'incremental':
+        touched = library.touch(args.change_every, int(time()))
+    else:
+        touched = 0
+    sync = LibrarySync()
+    pms.stats.reset()
+    start = time()
+    if name == 'repair':
+        success = sync.fullSync(repair=True)
+    elif name == 'incremental':
+        # Pretend we synced everything just before the changes
+        import plexdb_functions as plexdb
+        with plexdb.Get_Plex_DB() as plex_db:
+            for view_id in (fake_pms.MOVIE_SECTION,
+                            fake_pms.SHOW_SECTION,
+                            fake_pms.MUSIC_SECTION):
+                plex_db.set_sync_mark(view_id, fake_pms.TIMESTAMP + 1)
+        success = sync.fullSync(incremental=True)
+    else:
+        success = sync.fullSync()
+    elapsed = time() - start
+    counters = metrics.snapshot()['counters']
+    written = counters.get('sync.written', 0)
+    return {
+        'scenario': name,
+        'success': success is not False,
+        'seconds': round(elapsed, 3),
+        'items_written': written,
+        'items_touched_on_pms': touched,
+        'items_per_second': round(written / elapsed, 1) if elapsed else None,
+        'library_items_per_second': round(len(library) / elapsed, 1),
+        'peak_rss_kb': metrics.peak_rss(),
+        'pms_requests': pms.stats.total(),
+        'pms_requests_per_endpoint': dict(pms.stats.requests),
+        'pms_bytes_sent': pms.stats.bytes_sent,
+        'metrics': counters
+    }
+
+
+def report(results, library_size, rows):
+    print('')
+    print('PKC full sync benchmark - %s PMS items' % library_size)
+    print('%-12s %8s %8s %10s %10s %12s %9s' % (
+        'scenario', 'ok', 'seconds', 'written', 'written/s', 'PMS requests',
+        'RSS MB'))
+    for result in results:
+        print('%-12s %8s %8.2f %10s %10s %12s %9s' % (
+            result['scenario'],
+            'yes' if result['success'] else 'FAILED',
+            result['seconds'],
+            result['items_written'],
+            result['items_per_second'],
+            result['pms_requests'],
+            '%.1f' % (result['peak_rss_kb'] / 1024.0)
+            if result['peak_rss_kb'] else '?'))
+    for result in results:
+        print('')
+        print('%s - PMS requests per endpoint: %s'
+              % (result['scenario'],
+                 ', '.join('%s %s' % item for item in sorted(
+                     result['pms_requests_per_endpoint'].iteritems()))))
+    print('')
+    print('Kodi DB rows: %s' % ', '.join(
+        '%s %s' % item for item in sorted(rows.iteritems())))
+
+
+def main():
+    args = parse_args()
+    home = args.home or tempfile.mkdtemp(prefix='pkc_benchmark_')
+    setup_kodi(home)
+    setup_logging(home, args.verbose)
+
+    import fake_pms
+    library = fake_pms.Library(movies=args.movies,
+                               shows=args.shows,
+                               seasons=args.seasons,
+                               episodes=args.episodes,
+                               artists=args.artists,
+                               albums=args.albums,
+                               tracks=args.tracks)
+    pms = fake_pms.Fake_PMS(library, latency=args.latency / 1000.0)
+    pms.start()
+    log.info('Fake PMS with %s items running at %s'
+             % (len(library), pms.url))
+    try:
+        setup_pkc(args, pms.url)
+        from librarysync import LibrarySync
+        LibrarySync().initializeDBs()
+        results = [run_scenario(name.strip(), args, library, pms)
+                   for name in args.scenarios.split(',') if name.strip()]
+        rows = count_rows(home)
+    finally:
+        pms.stop()
+        if args.home is None:
+            shutil.rmtree(home, ignore_errors=True)
+
+    report(results, len(library), rows)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'library_items': len(library),
+                       'kodi_rows': rows,
+                       'results': results}, f, indent=2, sort_keys=True)
+    if not all(result['success'] for result in results):
+        return 1
+    initial = [result for result in results if result['scenario'] == 'initial']
+    if (args.min_items_per_second is not None and initial and
+            initial[0]['items_per_second'] < args.min_items_per_second):
+        print('Initial sync too slow: %s items/s, expected at least %s'
+              % (initial[0]['items_per_second'], args.min_items_per_second))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+Stand-in for Kodi's xbmc module - just enough to run a PKC full sync outside
+of Kodi. All special:// paths point to the directory KODI_HOME, set by
+run_benchmark.py before any PKC module is imported
+"""
+import logging
+from json import dumps, loads
+from os import environ
+from os.path import join
+from time import sleep as _sleep
+
+###############################################################################
+
+KODI_HOME = environ.get('PKC_BENCHMARK_HOME', '/tmp/pkc_benchmark')
+# Pretend to be this Kodi version
+BUILD_VERSION = '17.6 Git:20171114-a9a7a20'
+
+LOGDEBUG = 0
+LOGINFO = 1
+LOGNOTICE = 2
+LOGWARNING = 3
+LOGERROR = 4
+LOGSEVERE = 5
+LOGFATAL = 6
+LOGNONE = 7
+
+ISO_639_1 = 0
+ISO_639_2 = 1
+ENGLISH_NAME = 2
+
+PLAYLIST_MUSIC = 0
+PLAYLIST_VIDEO = 1
+
+# All calls of executebuiltin() and executeJSONRPC()
+BUILTINS = []
+# Answers to JSON-RPC Settings.GetSettingValue
+KODI_SETTINGS = {
+    'services.webserver': True,
+    'services.webserverport': 8080,
+    'services.webserverusername': 'kodi',
+    'services.webserverpassword': '',
+    'screensaver.mode': 'screensaver.xbmc.builtin.dim'
+}
+
+_SPECIAL_PATHS = (
+    ('special://database/', 'userdata/Database/'),
+    ('special://thumbnails/', 'userdata/Thumbnails/'),
+    ('special://profile/', 'userdata/'),
+    ('special://masterprofile/', 'userdata/'),
+    ('special://userdata/', 'userdata/'),
+    ('special://temp/', 'temp/'),
+    ('special://home/', ''),
+    ('special://xbmc/', 'xbmc/')
+)
+
+###############################################################################
+
+
+def log(msg, level=LOGDEBUG):
+    logging.getLogger('kodi').debug(msg)
+
+
+def sleep(milliseconds):
+    _sleep(milliseconds / 1000.0)
+
+
+def translatePath(path):
+    for special, real in _SPECIAL_PATHS:
+        if path.startswith(special):
+            return join(KODI_HOME, real, path[len(special):])
+        if path == special[:-1]:
+            return join(KODI_HOME, real)
+    return path
+
+
+def getInfoLabel(label):
+    if label == 'System.BuildVersion':
+        return BUILD_VERSION
+    return ''
+
+
+def getCondVisibility(condition):
+    return condition == 'system.platform.linux'
+
+
+def getLanguage(format=ENGLISH_NAME, region=False):
+    return 'en' if format == ISO_639_1 else 'English'
+
+
+def getLocalizedString(string_id):
+    return ''
+
+
+def getIPAddress():
+    return '127.0.0.1'
+
+
+def executebuiltin(function, wait=False):
+    BUILTINS.append(function)
+
+
+def executeJSONRPC(query):
+    BUILTINS.append(query)
+    query = loads(query)
+    result = {}
+    method = query.get('method', '').lower()
+    if method == 'settings.getsettingvalue':
+        result['value'] = KODI_SETTINGS.get(query['params']['setting'])
+    elif method == 'settings.setsettingvalue':
+        KODI_SETTINGS[query['params']['setting']] = query['params']['value']
+    return dumps({'id': query.get('id'), 'jsonrpc': '2.0', 'result': result})
+
+
+class Monitor(object):
+    def abortRequested(self):
+        return False
+
+    def waitForAbort(self, timeout=None):
+        if timeout:
+            _sleep(timeout)
+        return False
+
+
+class Player(object):
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def isPlaying(self):
+        return False
+
+    def isPlayingVideo(self):
+        return False
+
+    def isPlayingAudio(self):
+        return False
+
+
+class PlayList(object):
+    def __init__(self, playlist):
+        self.playlist = playlist
+        self.items = []
+
+    def size(self):
+        return len(self.items)
+
+    def clear(self):
+        self.items = []
+
+    def getposition(self):
+        return -1
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+Stand-in for Kodi's xbmcaddon module. Settings start out with the defaults of
+resources/settings.xml; run_benchmark.py overrides some of them in SETTINGS.
+Strings are read from the English strings.po
+"""
+from os.path import dirname, join
+from re import compile as re_compile
+import xml.etree.ElementTree as etree
+
+import xbmc
+
+###############################################################################
+
+ADDON_PATH = dirname(dirname(dirname(dirname(__file__))))
+ADDON_ID = 'plugin.video.plexkodiconnect'
+REGEX_STRING = re_compile(r'msgctxt "#(\d+)"\s*\nmsgid "(.*)"')
+
+# {setting id: value}, filled on first use
+SETTINGS = {}
+# {string id: string}
+STRINGS = {}
+
+###############################################################################
+
+
+def _load():
+    if SETTINGS:
+        return
+    xml = etree.parse(join(ADDON_PATH, 'resources', 'settings.xml'))
+    for setting in xml.iter('setting'):
+        if 'id' in setting.attrib:
+            SETTINGS.setdefault(setting.attrib['id'],
+                                setting.attrib.get('default', ''))
+    with open(join(ADDON_PATH, 'resources', 'language',
+                   'resource.language.en_gb', 'strings.po')) as f:
+        for string_id, string in REGEX_STRING.findall(f.read()):
+            STRINGS[int(string_id)] = string.decode('utf-8')
+
+
+class Addon(object):
+    def __init__(self, id=ADDON_ID):
+        self.id = id
+        _load()
+
+    def getSetting(self, setting_id):
+        return SETTINGS.get(setting_id, '')
+
+    def setSetting(self, setting_id, value):
+        SETTINGS[setting_id] = value
+
+    def getLocalizedString(self, string_id):
+        return STRINGS.get(string_id, u'')
+
+    def getAddonInfo(self, info):
+        return {
+            'id': ADDON_ID,
+            'name': 'PlexKodiConnect',
+            'version': etree.parse(join(ADDON_PATH, 'addon.xml'))
+                            .getroot().attrib['version'],
+            'path': ADDON_PATH,
+            'profile': xbmc.translatePath(
+                'special://profile/addon_data/%s/' % ADDON_ID)
+        }.get(info, '')
+
+    def openSettings(self):
+        pass
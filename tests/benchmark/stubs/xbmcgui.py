@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+Stand-in for Kodi's xbmcgui module: window properties are kept in a dict,
+dialogs don't show anything and answer "no"
+"""
+###############################################################################
+
+NOTIFICATION_INFO = 'info'
+NOTIFICATION_WARNING = 'warning'
+NOTIFICATION_ERROR = 'error'
+
+INPUT_ALPHANUM = 0
+INPUT_NUMERIC = 1
+INPUT_DATE = 2
+INPUT_TIME = 3
+INPUT_IPADDRESS = 4
+INPUT_PASSWORD = 5
+ALPHANUM_HIDE_INPUT = 2
+
+# {window id: {property: value}}
+PROPERTIES = {}
+# All dialogs PKC tried to show: (dialog method, args)
+DIALOGS = []
+
+###############################################################################
+
+
+class Window(object):
+    def __init__(self, window_id=10000):
+        self.properties = PROPERTIES.setdefault(window_id, {})
+
+    def getProperty(self, key):
+        return self.properties.get(key, '')
+
+    def setProperty(self, key, value):
+        self.properties[key] = value
+
+    def clearProperty(self, key):
+        self.properties.pop(key, None)
+
+
+class WindowXMLDialog(Window):
+    def __init__(self, *args, **kwargs):
+        Window.__init__(self)
+
+
+class Dialog(object):
+    def __getattr__(self, method):
+        def show(*args, **kwargs):
+            DIALOGS.append((method, args))
+            return False
+        return show
+
+
+class DialogProgressBG(object):
+    def create(self, heading, message=''):
+        pass
+
+    def update(self, percent=0, heading=None, message=None):
+        pass
+
+    def close(self):
+        pass
+
+    def isFinished(self):
+        return False
+
+
+class ListItem(object):
+    def __init__(self, label='', label2='', iconImage='', thumbnailImage='',
+                 path=''):
+        self.label = label
+        self.path = path
+        self.properties = {}
+
+    def __getattr__(self, method):
+        return lambda *args, **kwargs: None
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""
+Stand-in for Kodi's xbmcplugin module - PKC only needs it to import
+"""
+###############################################################################
+
+SORT_METHOD_NONE = 0
+SORT_METHOD_LABEL = 1
+SORT_METHOD_DATE = 3
+SORT_METHOD_VIDEO_TITLE = 25
+
+###############################################################################
+
+
+def addDirectoryItem(handle, url, listitem, isFolder=False, totalItems=0):
+    return True
+
+
+def addDirectoryItems(handle, items, totalItems=0):
+    return True
+
+
+def endOfDirectory(handle, succeeded=True, updateListing=False,
+                   cacheToDisc=True):
+    pass
+
+
+def setContent(handle, content):
+    pass
+
+
+def setPluginCategory(handle, category):
+    pass
+
+
+def addSortMethod(handle, sortMethod, label2Mask=''):
+    pass
+
+
+def setResolvedUrl(handle, succeeded, listitem):
+    pass